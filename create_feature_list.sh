@@ -0,0 +1,13 @@
+CODE=$1
+
+# the names of the columns of the CODE rows, from the feature registry of molgeom
+# (--schema prints type, column number, block and name)
+python3 molgeom.py --schema --types $CODE | cut -f 4 > feature.list.$CODE
+
+sed -i 's/ /\t/g' $CODE.xxx
+paste $CODE.xxx feature.list.$CODE > feature2.list
+awk -v FS="\t" '{if(NR>=6 && $2!="" && $2>100) {i++; print i"\t"$0}}' feature2.list > feature3.list
+
+awk -v FS="," '{printf("%d\n",$2)}' feature_iportance.txt > feature2_iportance.txt
+
+paste feature3.list feature2_iportance.txt
@@ -1,5 +1,7 @@
 INPUT=$1
 
+# molgeom.py --sparse writes this format directly, with the non-zero count of every feature
+
 #cut -f 2- -d, $INPUT > tmp.label_features
 #cut -f 2 -d, $INPUT > tmp.labels
 
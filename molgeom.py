@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 '''
 ********************************************
 Molgeom 1.1 
@@ -23,7 +23,19 @@ Description:
     Please refer to the documentation for further information.
 
 Requirements:
-    Numpy
+    Python 2.7 or 3, Numpy
+
+Python API:
+    molgeom can be imported to compute the features in-process:
+        coordinates, at_symbols = load_structure("dsgdb9nsd_000001.xyz")
+        topology = perceive_bonds(coordinates, at_symbols)
+        moments = CouplingTable(["train.csv"]).moments("dsgdb9nsd_000001")
+        arrays = compute_features(coordinates, at_symbols, moments, topology=topology)
+    arrays holds id, atom_index_0, atom_index_1, type, target and features, as
+    written by --npz. compute_features_by_type returns them for every coupling type
+    (type -> arrays), all the types computed in one pass.
+    With --blockcache the feature blocks of every molecule are kept on disk, and
+    only the blocks whose code or constants changed are computed again.
     
 Known issues and limitations for version 1.0:
     1) Data have to be plotted with third part software, e.g., with gnuplot.
@@ -60,20 +72,29 @@ Changelog:
 
 #import modules
 from __future__ import print_function  # to allow print as a function with sep parameter
-from sys import argv, exit, version, stderr
-from os import system, path
+from sys import argv, exit, version, stderr, stdout
+from os import system, path, makedirs, rename, getpid, remove
+from io import BytesIO
+from shutil import copyfileobj
+from zipfile import ZipFile, ZIP_STORED
+from hashlib import md5
+from glob import glob
+from multiprocessing import Pool
 try:
     from optparse import OptionParser as OP
 except:
     print("Optparse not installed or not in python path. I give up...")
     exit(10)
 try:
-    from numpy import array,zeros, sin, cos, sqrt, pi, arccos, modf, linspace, full, sort
+    from numpy import array,zeros, sin, cos, sqrt, pi, arccos, modf, linspace, full, sort, newaxis, nonzero, fill_diagonal, \
+        floor, dot, argsort, searchsorted, concatenate, unique, maximum, minimum, exp, add, float_power, \
+        float32, float64, int64, uint8, integer, arange, nan, savez, save, load, where, clip, \
+        savez_compressed, ndarray, int32, bool_, dtype, loadtxt
+    from numpy import __version__ as numpyversion
+    from numpy.lib.format import write_array, write_array_header_1_0, dtype_to_descr
 except:
     print("Numpy not installed or not in python path. I give up...")
     exit(10)
-from string import split, strip, join,lower
-from math import exp
 
 # global variables
 
@@ -81,8 +102,68 @@ from math import exp
 #covalentR = { "H":0.31, "C":0.76, "N":0.71, "F":0.57, "O":0.66 }
 covalentR = { "H":0.38, "C":0.95, "N":0.88, "F":0.71, "O":0.82 }
 
+# rows of the element resolved descriptors, "all" collects the heavy atoms
+ELEMENTS = { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
+
+# order of the neighbor counts (see GetNeighborsCount), as the dictionaries were listed by python 2
+COUNTORDER = [ "C", "F", "H", "all", "O", "N" ]
+
 NBINS=10
 
+# bins of the G2 descriptors (see GetG2descriptorB): distances, and their projections along the bond
+G2BINS=9
+G2RANGE=linspace(1, 5.5, G2BINS)
+G2RANGE2=linspace(-5, 5, G2BINS)
+
+# molecules with more atoms than this are analysed through the cell list (see CellList)
+GRIDATOMS=200
+
+# values in every row of the Coulomb matrix (the largest molecules of the data set have 29 atoms):
+# the rows of larger molecules keep only the COULOMBWIDTH values largest in absolute
+# value, with a warning (see GetSortedCoulombRows)
+COULOMBWIDTH=29
+
+# numpy.loadtxt parses in C from numpy 1.23 on (see LoadColumns), before that it is
+# slower than splitting the lines in python
+BLOCKLOADTXT=tuple([int(x) for x in numpyversion.split(".")[:2]]) >= (1, 23)
+
+# batch mode: at most this many structures are sent to a worker at once
+BATCHCHUNK=100
+
+# --npz: rows of features kept in memory before they are written (see NpzSink)
+NPZSHARD=10000
+
+
+class MolgeomError(Exception):
+    ''' a structure cannot be processed (missing file, unexpected topology...) '''
+    pass
+
+
+class ErrorLog(object):
+    ''' where the errors and warnings go; every message is prefixed by the
+    structure being processed, so that one log can serve a whole batch.
+    When messages is a list the lines are collected there instead (worker processes)
+    '''
+    def __init__(self, stream=stderr):
+        self.stream = stream
+        self.structure = None
+        self.messages = None
+
+    def write(self, message):
+        line = "%s: %s\n" % (self.structure, message)
+        if self.messages is not None:
+            self.messages.append(line)
+        else:
+            self.stream.write(line)
+            self.stream.flush()
+
+errorlog = ErrorLog()
+
+# coupling table and structure store of the batch being processed, inherited by
+# forked worker processes and loaded again from their files by the others (see init_worker)
+couplingtable = None
+structurestore = None
+
 '''
 #===============================================================================
 #                               SUBROUTINES
@@ -95,6 +176,13 @@ def vecmod(a):
     return mod_a
 
 
+def power2(x):
+    ''' x**2 for every element of an array, by pow() as python computes it for
+    a single number: numpy squares arrays by multiplication, which can differ in the last bit
+    '''
+    return float_power(x,2)
+
+
 def pscalar_cos(a,b):
     ''' scalar product: return the cosine of an angle between the two
     vectors
@@ -130,28 +218,6 @@ def pvect(a,b):
     return n
 
 
-def nint(a):
-    ''' implementation of anint function: return the nearest integer of a
-    float number
-    '''
-    temp=modf(a)
-    if temp[0] >= 0.5:
-        approx=temp[1]+1
-    else:
-        approx=temp[1]
-    return approx
-
-
-def vecxmat(vec, mat):
-    '''product vector*matrix (to be done using numpy functions?)
-    '''
-    outvec=zeros(3)
-    for j in range (3):
-        for i in range (3):
-            outvec[j]=outvec[j]+vec[i]*mat[i][j]
-    return outvec
-
-
 def setpbc(cellp):
 #NB: vectors are passed for address, so any change in it is not local,
 #and will be also in the rest of the code, even in the main!!!
@@ -195,6 +261,32 @@ def setpbc(cellp):
     return Tmatrix
 
 
+class PeriodicCell(object):
+    ''' periodic unit cell given by a,b,c (angstrom) and alpha,beta,gamma (degrees),
+    as for -u/--unitcell. The transformation matrices of setpbc are computed once:
+    cartesian (row) vectors times B give fractional coordinates, times A back cartesian.
+    '''
+    def __init__(self, cellparam):
+        self.cellparam = tuple([float(x) for x in cellparam])  # setpbc needs floats
+        self.A, self.B = setpbc(self.cellparam)
+        # the perpendicular width of the cell along axis k is 1/|b_k|, b_k being the reciprocal vectors
+        self.widths = 1.0/sqrt((self.B**2).sum(axis=0))
+
+    def fractional(self, xyz):
+        return dot(xyz, self.B)
+
+    def cartesian(self, frac):
+        return dot(frac, self.A)
+
+    def minimage(self, vectors):
+        ''' minimum image of displacement vectors, one vector or (M x 3) array of them:
+        the nearest integer of each fractional component is removed
+        '''
+        tvec = self.fractional(vectors)
+        tvec = tvec - floor(tvec + 0.5)
+        return self.cartesian(tvec)
+
+
 def getdist(at1,at2):
     ''' Calculate distance between two particles
     '''
@@ -230,6 +322,107 @@ def gettors(at1,at2,at3,at4):
     return theta
 
 
+def vecmods(v):
+    ''' moduli of the rows of an (M x 3) array of vectors
+    '''
+    return sqrt(power2(v[:,0])+power2(v[:,1])+power2(v[:,2]))
+
+
+def pscalars_cos(a,b):
+    ''' pscalar_cos of every row of the (M x 3) arrays a and b
+    '''
+    norm=vecmods(a)*vecmods(b)
+    tiny=norm<0.0001
+    theta=(a[:,0]*b[:,0]+a[:,1]*b[:,1]+a[:,2]*b[:,2])/where(tiny,1.0,norm)
+    theta=clip(theta,-1,1)
+    theta[tiny]=0
+    return theta
+
+
+def pvects(a,b):
+    ''' pvect of every row of the (M x 3) arrays a and b
+    '''
+    n=zeros((len(a),3))
+    n[:,0]=a[:,1]*b[:,2]-a[:,2]*b[:,1]
+    n[:,1]=a[:,2]*b[:,0]-a[:,0]*b[:,2]
+    n[:,2]=a[:,0]*b[:,1]-a[:,1]*b[:,0]
+    return n
+
+
+def atomblocks(coordinates, indices, n):
+    ''' coordinates (x,y,z only) of the atoms in the (M x n) array of indices,
+    as n arrays (M x 3): one per column
+    '''
+    indices=array(indices,int).reshape((-1,n))
+    return [coordinates[indices[:,k]][:,:3] for k in range(n)]
+
+
+def getdists(coordinates, pairs, cell=None):
+    ''' getdist of every pair of atoms, pairs being an (M x 2) array of atom indices.
+    With a PeriodicCell the minimum image convention is used (as getpbcdist)
+    '''
+    at1,at2=atomblocks(coordinates,pairs,2)
+    if cell is not None:
+        return vecmods(cell.minimage(at2-at1))
+    return sqrt(power2(at2[:,0]-at1[:,0])+power2(at2[:,1]-at1[:,1])+power2(at2[:,2]-at1[:,2]))
+
+
+def getangles(coordinates, triples, cell=None):
+    ''' getangle of every triple of atoms, triples being an (M x 3) array of atom indices.
+    With a PeriodicCell the minimum image convention is used (as getpbcangle)
+    '''
+    at1,at2,at3=atomblocks(coordinates,triples,3)
+    vij=at1-at2
+    vkj=at3-at2
+    if cell is not None:
+        vij=cell.minimage(vij)
+        vkj=cell.minimage(vkj)
+    theta=arccos(pscalars_cos(vij,vkj))
+    return theta*180/pi
+
+
+def torsionblocks(coordinates, quadruples, cell=None):
+    ''' unsigned dihedral angles of every four atoms (0<=theta<=180) and the values
+    whose sign gives the sign of the dihedrals, for gettorsions and getdihs
+    '''
+    at1,at2,at3,at4=atomblocks(coordinates,quadruples,4)
+    vij=at1-at2
+    vkj=at3-at2
+    vlj=at4-at3
+    if cell is not None:
+        vij=cell.minimage(vij)
+        vkj=cell.minimage(vkj)
+        vlj=cell.minimage(vlj)
+    v1=pvects(vkj,vij)
+    v2=pvects(vkj,vlj)
+    theta=arccos(pscalars_cos(v1,v2))*180/pi
+    sign=vlj[:,0]*v1[:,0]+vlj[:,1]*v1[:,1]+vlj[:,2]*v1[:,2]
+    return theta, sign
+
+
+def gettorsions(coordinates, quadruples, cell=None):
+    ''' gettors of every four atoms, quadruples being an (M x 4) array of atom indices.
+    With a PeriodicCell the minimum image convention is used
+    '''
+    theta,sign=torsionblocks(coordinates,quadruples,cell)
+    #checking the sign
+    theta[sign<0]*=-1
+    return theta
+
+
+def getdihs(coordinates, quadruples, periods, cell=None):
+    ''' getdih (getpbctors with a PeriodicCell) of every four atoms, quadruples being
+    an (M x 4) array of atom indices and periods the periodicity of each dihedral
+    '''
+    theta,sign=torsionblocks(coordinates,quadruples,cell)
+    theta=where(sign<0,theta*-1+360,theta) #0<=theta<=360
+    #fold theta for the periodicity, exactly as getdih
+    periods=array(periods,float)
+    nfold=modf(theta/periods)[1] #number of folding steps
+    even=modf(nfold/2)[0]==0
+    return where(even,theta-nfold*periods,2*pi-(theta-(nfold-1)*periods))
+
+
 def getdih(at1,at2,at3,at4,period):
     ''' Routine getdih:
             calculates dihedral angle between four particles. Returns angle.
@@ -263,61 +456,28 @@ def getdih(at1,at2,at3,at4,period):
 
 
 def getpbcdist(at1,at2,cellparam):
-    matrix=setpbc(cellparam)
-    mat_a=matrix[0]
-    mat_b=matrix[1]
-    vdiff=array(at2)-array(at1)
-    tvec=vecxmat(vdiff,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vecdiff=vecxmat(tvec,mat_a)
+    ''' distance with the minimum image convention; cellparam are the unit cell
+    parameters or (better, when measuring many times) a PeriodicCell
+    '''
+    cell=cellparam if isinstance(cellparam,PeriodicCell) else PeriodicCell(cellparam)
+    vecdiff=cell.minimage(array(at2[:3])-array(at1[:3]))
     dist_at=vecmod(vecdiff)
     return dist_at
 
 
 def getpbcangle(at1,at2,at3,cellparam):
-    matrix=setpbc(cellparam)
-    mat_a=matrix[0]
-    mat_b=matrix[1]
-    vij=at1-at2
-    tvec=vecxmat(vij,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vij=vecxmat(tvec, mat_a)
-    vkj=at3-at2 #be careful to the order of atoms
-    tvec=vecxmat(vkj,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vkj=vecxmat(tvec,mat_a)
+    cell=cellparam if isinstance(cellparam,PeriodicCell) else PeriodicCell(cellparam)
+    vij=cell.minimage(at1[:3]-at2[:3])
+    vkj=cell.minimage(at3[:3]-at2[:3]) #be careful to the order of atoms
     theta=pscalar(vij,vkj)
     return theta
 
 
 def getpbctors(at1,at2,at3,at4,period,cellparam):
-    matrix=setpbc(cellparam)
-    mat_a=matrix[0]
-    mat_b=matrix[1]
-    vij=at1-at2
-    tvec=vecxmat(vij,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vij=vecxmat(tvec, mat_a)
-    vkj=at3-at2
-    tvec=vecxmat(vkj,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vkj=vecxmat(tvec,mat_a)
-    vlj=at4-at3
-    tvec=vecxmat(vlj,mat_b)
-    tvec[0]=tvec[0]-nint(tvec[0])
-    tvec[1]=tvec[1]-nint(tvec[1])
-    tvec[2]=tvec[2]-nint(tvec[2])
-    vlj=vecxmat(tvec,mat_a)
+    cell=cellparam if isinstance(cellparam,PeriodicCell) else PeriodicCell(cellparam)
+    vij=cell.minimage(at1[:3]-at2[:3])
+    vkj=cell.minimage(at3[:3]-at2[:3])
+    vlj=cell.minimage(at4[:3]-at3[:3])
     v1=pvect(vkj,vij)
     v2=pvect(vkj,vlj)
     theta=pscalar(v1,v2)
@@ -334,41 +494,56 @@ def getpbctors(at1,at2,at3,at4,period,cellparam):
     return theta
 
 
+def LoadColumns(lines, columns):
+    ''' the given columns of the atom lines of a frame as a float64 array, one row
+    per line, parsed all at once by numpy.loadtxt. None when it cannot: with numpy
+    older than 1.23 (see BLOCKLOADTXT), or if a line is too short or not a number
+    where one is expected
+    '''
+    if not BLOCKLOADTXT or len(lines) == 0:
+        return None
+    try:
+        numbers = loadtxt(lines, usecols=columns, comments=None, ndmin=2)
+    except ValueError:
+        return None
+    if len(numbers) != len(lines): # blank lines are skipped
+        return None
+    return numbers
+
+
 def read_arc(file,offset=None):
     '''
     parse data from tinker file or tinker arc trajectory. Only coordinates are updated each frame.
     All the other lists are the same for each frame in the trajectory, therefore they store
     info from the first frame only. The trajectory is read one frame at a time by
     passing the offset.
+    The atom lines of a frame are read as a block and their coordinates parsed all at
+    once (see LoadColumns), or split line by line with older numpy.
     '''
     if offset != None:
         file.seek(offset)
     line=file.readline() #read fist line: number of atoms and optional comment
     if len(line)==0: #reached end of file: stop
         return "EOF"
-    junk=split(line[:-1])
+    junk=line[:-1].split()
     at_number=int(junk[0])
-    coordinates=zeros((at_number,3))
-    if offset == None:
-        at_symbols=[]
-        at_types=zeros(at_number)
+    lines=[file.readline() for i in range(at_number)]
+    coordinates=LoadColumns(lines,(2,3,4)) #X,Y,Z-coords
+    rows=None
+    if coordinates is None:
+        rows=[line.split() for line in lines]
+        coordinates=array([x for junk in rows for x in junk[2:5]],float64).reshape((at_number,3))
+    newoffset=file.tell()
+    if offset==None:
+        if rows is None:
+            rows=[line.split() for line in lines]
+        at_symbols=[junk[1] for junk in rows]  #atomic symbols
+        at_types=array([junk[5] for junk in rows],float64)    #atom types
         at_connectivity=zeros((at_number,5))
-    
-    linecount=0
-    while linecount<at_number:
-        line=file.readline()
-        junk=split(line[:-1])
-        coordinates[linecount,0]=junk[2] #get X-coords
-        coordinates[linecount,1]=junk[3] #get Y-coords
-        coordinates[linecount,2]=junk[4] #get Z-coords
-        if offset == None:
-            at_symbols.append(junk[1])  #get atomic symbol
-            at_types[linecount]=junk[5]    #get atom type
+        for linecount in range(at_number):
+            junk=rows[linecount]
             for i in range(6,len(junk)):
                 at_connectivity[linecount,i-6]=junk[i]  #get connectivity
-        linecount+=1
-    newoffset=file.tell()
-    if offset==None:
         return coordinates, newoffset, at_symbols, at_types, at_connectivity
     else:
         return coordinates, newoffset
@@ -379,29 +554,26 @@ def read_xyz(file,offset=None):
     parse data from xyz file or xmol trajectory
     The trajectory is read one frame at a time by
     passing the offset.
+    The atom lines of a frame are read as a block and their numbers parsed all at once
+    (see LoadColumns). Otherwise, when the lines all have the same number of fields,
+    their numbers are converted with a single array conversion.
     '''
     if offset != None:
         file.seek(offset)
     line=file.readline() #read fist line: number of atoms and optional comment
     if len(line)==0: #reached end of file: stop
         return "EOF"
-    junk=split(line[:-1])
+    junk=line[:-1].split()
     at_number=int(junk[0])
-    coordinates=zeros((at_number,4))
-    if offset == None:
-        at_symbols=[]
     file.readline() #!skip line    
-    linecount=0
-    while linecount<at_number:
-        line=file.readline()
-        junk=split(line[:-1])
-        coordinates[linecount,0]=junk[1] #get X-coords
-        coordinates[linecount,1]=junk[2] #get Y-coords
-        coordinates[linecount,2]=junk[3] #get Z-coords
-        coordinates[linecount,3] = junk[4]  # get Mulliken charge
-        if offset == None:
-            at_symbols.append(junk[0])  #get atomic symbol
-        linecount+=1
+    lines=[file.readline() for i in range(at_number)]
+    # symbol, X, Y, Z and the Mulliken charge (the lines of 4 fields, without it, go below)
+    coordinates=LoadColumns(lines,(1,2,3,4))
+    if coordinates is not None:
+        if offset==None:
+            at_symbols=[line.split(None,1)[0] for line in lines]
+    else:
+        coordinates,at_symbols=split_xyz("".join(lines),at_number)
     newoffset=file.tell()
     if offset==None:
         return coordinates, newoffset, at_symbols
@@ -409,6 +581,109 @@ def read_xyz(file,offset=None):
         return coordinates, newoffset
 
 
+def split_xyz(block,at_number):
+    ''' coordinates (with the charges, 0 if missing) and symbols of the atom lines of
+    an xyz frame, split in python
+    '''
+    fields=block.split()
+    width=len(fields)//max(at_number,1)
+    if (width == 4 or width == 5) and len(fields) == width*at_number:
+        # every line is symbol, X, Y, Z and maybe the Mulliken charge, if the symbols are
+        # found every width fields: lines of other widths (4 and 6 fields, say) would put
+        # a number where a symbol is expected, or a symbol among the numbers
+        at_symbols=fields[0::width]
+        if "".join(at_symbols).isalpha():
+            del fields[0::width]
+            try:
+                numbers=array(fields,float64).reshape((at_number,width-1))
+                coordinates=zeros((at_number,4))
+                coordinates[:,:width-1]=numbers
+                return coordinates,at_symbols
+            except ValueError:
+                pass
+    # lines with and without the charge, or with more columns
+    rows=[line.split() for line in block.splitlines()]
+    at_symbols=[junk[0] for junk in rows]
+    coordinates=array([junk[1:5]+["0"][:5-len(junk)] for junk in rows],float64).reshape((at_number,4))
+    return coordinates,at_symbols
+
+
+class StructureStore(object):
+    ''' all the structures packed column by column in a directory of .npy files:
+    coordinates.npy  x,y,z and Mulliken charge of all the atoms, one molecule after the other
+    elements.npy     element code of every atom (see ELEMENTS)
+    offsets.npy      first atom of every molecule (plus the total number of atoms at the end)
+    names.npy        molecule names (structure file name without extension)
+    The arrays are memory mapped, so that the worker processes share the page cache
+    and read() is a slice of the big arrays, without copying nor parsing.
+    '''
+    def __init__(self, directory):
+        if not path.isdir(directory):
+            raise MolgeomError("Cannot find the structure store "+directory)
+        self.directory = directory
+        self.coordinates = load(path.join(directory, "coordinates.npy"), mmap_mode='r')
+        self.elements = load(path.join(directory, "elements.npy"), mmap_mode='r')
+        self.offsets = load(path.join(directory, "offsets.npy"))
+        # str names whichever python wrote the store (bytes under python 2, unicode under 3)
+        names = load(path.join(directory, "names.npy")).astype(str)
+        self.index = dict(zip(names.tolist(), range(len(names))))
+        self.symbols = [None]*len(ELEMENTS)
+        for e in ELEMENTS:
+            self.symbols[ELEMENTS[e]] = e
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, molecule):
+        return molecule in self.index
+
+    def read(self, molecule):
+        ''' same as read_xyz: coordinates (with charges), offset (None) and atomic symbols '''
+        if molecule not in self.index:
+            raise MolgeomError("Cannot find "+molecule+" in the structure store")
+        k = self.index[molecule]
+        start, stop = self.offsets[k], self.offsets[k+1]
+        at_symbols = [self.symbols[e] for e in self.elements[start:stop]]
+        return self.coordinates[start:stop], None, at_symbols
+
+
+def build_store(files, directory):
+    ''' pack the xyz structure files into a StructureStore in directory.
+    Files which cannot be read are reported in the error log and skipped.
+    Returns the number of molecules stored.
+    '''
+    coordinates, elements, offsets, names = [], [], [0], []
+    for infile in files:
+        errorlog.structure = infile
+        structfile = safeopen(infile,'r')
+        if structfile == None:
+            errorlog.write("Cannot find "+infile)
+            continue
+        try:
+            retdata = read_xyz(structfile)
+            if retdata == "EOF":
+                raise MolgeomError("empty structure file")
+            codes = [ELEMENTS[s] for s in retdata[2]]
+        except Exception as e:
+            errorlog.write("%s: %s" % (type(e).__name__, e))
+            continue
+        finally:
+            structfile.close()
+        coordinates.append(retdata[0])
+        elements.append(array(codes, uint8))
+        offsets.append(offsets[-1] + len(codes))
+        names.append(path.splitext(path.basename(infile))[0])
+    errorlog.structure = None
+
+    if not path.isdir(directory):
+        makedirs(directory)
+    save(path.join(directory, "coordinates.npy"), concatenate(coordinates) if coordinates else zeros((0,4)))
+    save(path.join(directory, "elements.npy"), concatenate(elements) if elements else zeros(0, uint8))
+    save(path.join(directory, "offsets.npy"), array(offsets, int64))
+    save(path.join(directory, "names.npy"), array(names, str))
+    return len(names)
+
+
 def read_moments(file):
     '''
     parse data from moments file
@@ -427,6 +702,63 @@ def read_moments(file):
     return myDict
     
 
+class CouplingTable(object):
+    ''' the couplings of all the molecules, read once from the train.csv and/or
+    test.csv tables (id,molecule_name,atom_index_0,atom_index_1,type[,scalar_coupling_constant]).
+    The rows are kept as numpy arrays sorted by molecule, index gives the slice
+    of each molecule. Test rows have target NaN.
+    '''
+    def __init__(self, filenames):
+        self.filenames = list(filenames)
+        ids, names, atom0, atom1, types, target = [], [], [], [], [], []
+        for filename in filenames:
+            file=safeopen(filename,'r')
+            if file == None:
+                raise MolgeomError("Cannot find the coupling table "+filename)
+            for line in file:
+                junk=line.rstrip().split(",")
+                if len(junk) < 5 or junk[0] == "id": # header or empty line
+                    continue
+                ids.append(int(junk[0]))
+                names.append(junk[1])
+                atom0.append(int(junk[2]))
+                atom1.append(int(junk[3]))
+                types.append(junk[4])
+                target.append(float(junk[5]) if len(junk) == 6 else nan)
+            file.close()
+
+        names = array(names, str)
+        order = argsort(names, kind='mergesort') # keep the file order inside a molecule
+        self.id = array(ids, int64)[order]
+        self.atom_index_0 = array(atom0, int64)[order]
+        self.atom_index_1 = array(atom1, int64)[order]
+        self.type = array(types, str)[order]
+        self.target = array(target, float64)[order]
+        molecules, starts = unique(names[order], return_index=True)
+        stops = list(starts[1:]) + [len(order)]
+        self.index = dict(zip(molecules.tolist(), zip(starts.tolist(), stops)))
+
+    def __len__(self):
+        return len(self.id)
+
+    def __contains__(self, molecule):
+        return molecule in self.index
+
+    def moments(self, molecule):
+        ''' the couplings of a molecule, in the same format as read_moments '''
+        if molecule not in self.index:
+            raise MolgeomError("No couplings for "+molecule+" in the coupling table")
+        start, stop = self.index[molecule]
+        myDict = {}
+        for n, i, j, t, y in zip(self.id[start:stop].tolist(),
+                                 self.atom_index_0[start:stop].tolist(),
+                                 self.atom_index_1[start:stop].tolist(),
+                                 self.type[start:stop].tolist(),
+                                 self.target[start:stop].tolist()):
+            myDict[str(n)] = [i, j, t, "X" if y != y else y]   # y != y: NaN, test set
+        return myDict
+
+
 def safeopen(infile,mode):
     '''Open safetely a file
     '''
@@ -492,6 +824,38 @@ See documentation for further information."
                      help='define periodic unit cell (a,b,c in angstrom; alpha,beta,gamma in degrees)')
     parser.add_option('-l','--listformats',dest='listformats',action='store_true',
                      default=False, help='list the available formats')
+    parser.add_option('--npz',dest='npz',nargs=1,
+                     help='write the features as numpy arrays into the given .npz file instead of printing them (the rows of all the --types must have the same width, see --pertype otherwise)')
+    parser.add_option('--sparse',dest='sparse',action='store_true',default=False,
+                     help='write only the non-zero features: CSR arrays for --npz and .npz --pertype files, svmlight lines (the ids after a #) otherwise, with the non-zero count of every feature over the train rows (in FILE.nonzero for svmlight --pertype files, see --nonzero for the standard output)')
+    parser.add_option('--nonzero',dest='nonzero',nargs=1,
+                     help='with --sparse svmlight lines on the standard output, write the non-zero count of every feature over the train rows into this file')
+    parser.add_option('-b','--batch',dest='batch',action='store_true',default=False,
+                     help='input_file is a list of structure files (one per line) or a quoted glob pattern; all of them are processed')
+    parser.add_option('-j','--jobs',dest='jobs',type='int',default=1,
+                     help='number of processes sharing the structures in batch mode, or the frames of a trajectory [default: %default]')
+    parser.add_option('--frames',dest='frames',nargs=1,
+                     help='measure only the frames start:stop:step of the trajectory (numbered from 1, stop excluded), found through an index kept in input_file.frames.npz')
+    parser.add_option('--couplings',dest='couplings',action='append',
+                     help='read the couplings from this train/test table (can be given more than once) instead of the .train file of each structure')
+    parser.add_option('--store',dest='store',nargs=1,
+                     help='read the structures from this structure store (see --buildstore), looked up by molecule name')
+    parser.add_option('--buildstore',dest='buildstore',nargs=1,
+                     help='pack the structures of the batch input_file into a structure store in this directory, then quit')
+    parser.add_option('--topocache',dest='topocache',nargs=1,
+                     help='keep the bonds, rings and topological distances of every molecule in this directory and reuse them')
+    parser.add_option('--blockcache',dest='blockcache',nargs=1,
+                     help='keep the feature blocks of every molecule in this directory and reuse them, recomputing only the blocks whose code or constants changed')
+    parser.add_option('--types',dest='types',nargs=1,default=",".join(FEATURETYPES),
+                     help='comma separated coupling types to compute the features of, or all [default: %default]')
+    parser.add_option('--blocks',dest='blocks',nargs=1,
+                     help='comma separated feature blocks to compute (see --schema) [default: all of them]')
+    parser.add_option('--pertype',dest='pertype',nargs=1,
+                     help='write the rows of every coupling type into its own file, named as this pattern with {type} (which it must hold) replaced by the type (.npz for numpy arrays, see --npz)')
+    parser.add_option('--schema',dest='schema',action='store_true',default=False,
+                     help='print the columns of the rows of the --types (type, column, block, name) and quit')
+    parser.add_option('--errorlog',dest='errorlog',nargs=1,
+                     help='write errors and warnings, one line per structure, into this file [default: stderr]')
     (options, args) = parser.parse_args(argv[1:])
     
     #manage parse errors
@@ -503,6 +867,32 @@ See documentation for further information."
        print(credits)
        exit()
        
+    if options.types == "all":
+        options.types=",".join(ALLTYPES)
+    options.types=options.types.split(",")
+    for t in options.types:
+        if t not in COUPLINGTYPES:
+            parser.error('Unknown coupling type '+t+', known ones are '+",".join(sorted(COUPLINGTYPES)))
+    if options.blocks is not None:
+        options.blocks=options.blocks.split(",")
+        for b in options.blocks:
+            if b not in FEATURES:
+                parser.error('Unknown feature block '+b+', known ones are '+",".join(sorted(FEATURES)))
+    if (options.npz or options.sparse) and not options.pertype:
+        # one array of features, or one count of the non-zero features: the rows of all
+        # the types must have the same columns
+        widths=set([COUPLINGTYPES[t].width(options.blocks) for t in options.types])
+        if len(widths) > 1:
+            parser.error('The rows of the types '+",".join(options.types)+' differ in width and cannot be written together '
+                         'with --npz or --sparse, write every type into its own file with --pertype (e.g. --pertype features_{type}.npz)')
+    if options.pertype and "{type}" not in options.pertype:
+        parser.error('The --pertype pattern '+options.pertype+' has no {type}, all the types would be written into the same file')
+    if options.nonzero and (not options.sparse or options.npz or options.pertype):
+        parser.error('--nonzero is for the svmlight lines of --sparse on the standard output')
+    if options.schema:
+        write_schema(options.types, options.blocks)
+        exit(0)
+
     if len(args)==0 and not options.listformats:   #arguments missing
         parser.exit(parser.print_help())
     
@@ -531,10 +921,10 @@ def read_filedata(file):
         line=file.readline()
         if len(line)==0:
             break
-        if split(line)[0] == "#":
+        if line.split()[0] == "#":
             pass
         else:
-            line=split(line[:-1])
+            line=line[:-1].split()
             if len(line)==2: #two atoms have been found
                 junk.append(int(line[0]))
                 junk.append(int(line[1]))
@@ -586,8 +976,7 @@ def GetIdentity(symbol, symbol2 = None):
     counts[symbol] += 1
     if symbol2 != None:
         counts[symbol2] += 1
-    print(counts["H"], counts["C"], counts["N"], counts["F"], counts["O"], end=",", sep=",")
-    return counts
+    return [counts["H"], counts["C"], counts["N"], counts["F"], counts["O"]]
 
 
 def GetNeighborsCount(atom,at_symbols, neighbors, ignore = None):
@@ -600,45 +989,110 @@ def GetNeighborsCount(atom,at_symbols, neighbors, ignore = None):
                 counts["all"]+=1
 
     #print("AAA", atom, end=",")
-    for f in counts:
-        print(counts[f], end=",")
-    #print("")
+    return [counts[f] for f in COUNTORDER]
 
 
-def SmoothGaussian(r1, r2, beta=100/40*NBINS):
+def SmoothGaussian(r1, r2, beta=100//40*NBINS):
     #return 1*(abs(r1-r2)<0.01)
+    # works also on numpy arrays (then r1 and r2 broadcast against each other)
     x = beta * (r1-r2)
     #print beta,x
-    return exp(-x**2)
+    return exp(-power2(x))
 
 
-def Rc(r, cutoff=11.3):
-    val = 0
-    if r < cutoff:
-        val = 0.5 * (cos(pi*r/cutoff) + 1)
-    return val
+def SmearedHistogram(values, symbols, Range, beta, weights=None, heavy=None):
+    ''' histogram of values smeared by SmoothGaussian over the bins in Range,
+    resolved by the element of the atom each value belongs to (optionally each
+    value is multiplied by its weight).
+    Returns (6 x Nbins) matrix with rows H, C, N, F, O and all heavy atoms;
+    the last row can be built from other atoms by the boolean mask heavy
+    '''
+    counts = zeros((len(ELEMENTS), len(Range)))
+    if len(values) == 0:
+        return counts
+
+    vals = SmoothGaussian(array(values, float)[:,newaxis], Range[newaxis,:], beta)
+    if weights is not None:
+        vals = vals * array(weights, float)[:,newaxis]
+    codes = array([ELEMENTS[symbol] for symbol in symbols])
+    if heavy is None:
+        heavy = codes != ELEMENTS["H"]
+
+    # add.at accumulates the values one by one in the given order (as the loops over bins did)
+    add.at(counts, codes, vals)
+    add.at(counts, full(heavy.sum(), ELEMENTS["all"]), vals[heavy])
+    return counts
 
 
-def IsCyclic(atom, Afrom, start, visited, neighbors, at_symbols):
-    #print("searching for",start," in ",atom)
-    if not (atom == start):
-        visited[atom] = 1
-    for i in neighbors[atom]:
-        if (not at_symbols[i] == "H") and (not i in visited) and (not Afrom == i):
-            if i==start:
-                return True
-            if IsCyclic(i, atom, start, visited, neighbors, at_symbols):
-                return True
+def Rc(r, cutoff=11.3):
+    # works also on numpy arrays
+    return where(r < cutoff, 0.5 * (cos(pi*r/cutoff) + 1), 0.0)
 
-    return False
 
-# find bond distance between atoms
-def FindDistance(currentD, currentA, returnVal, neighbors):
-    returnVal[currentA] = currentD
-    for i in neighbors[currentA]:
-        if (returnVal[i]> currentD+1):
-            returnVal = FindDistance(currentD+1, i, returnVal, neighbors)
-    return returnVal
+def GetCyclicAtoms(neighbors, at_symbols):
+    ''' heavy atoms belonging to a ring (cyclic[i]=1), hydrogens are ignored.
+    Single (iterative) depth first search finding the bridges (Tarjan): an atom is
+    in a ring when one of its bonds is not a bridge, i.e. when the subtree below the
+    bond is connected by a back edge to the atom or above it.
+    '''
+    N = len(neighbors)
+    order = [-1]*N  # discovery time in the search
+    low = [0]*N     # earliest discovery time reachable through a back edge
+    cyclic = dict()
+    time = 0
+    for root in range(N):
+        if at_symbols[root] == "H" or order[root] >= 0:
+            continue
+        order[root] = low[root] = time
+        time += 1
+        stack = [(root, -1, iter(neighbors[root]))]
+        while len(stack) > 0:
+            atom, parent, bonds = stack[-1]
+            for i in bonds:
+                if at_symbols[i] == "H" or i == parent:
+                    continue
+                if order[i] < 0: # go down
+                    order[i] = low[i] = time
+                    time += 1
+                    stack.append((i, atom, iter(neighbors[i])))
+                    break
+                # back edge: closes a ring
+                low[atom] = min(low[atom], order[i])
+                cyclic[atom] = 1
+                cyclic[i] = 1
+            else: # all bonds seen, go up
+                stack.pop()
+                if parent >= 0:
+                    low[parent] = min(low[parent], low[atom])
+                    if low[atom] <= order[parent]: # parent-atom is not a bridge
+                        cyclic[atom] = 1
+                        cyclic[parent] = 1
+    return cyclic
+
+
+def GetTopologicalDistances(neighbors):
+    ''' number of bonds along the shortest path between every two atoms as a (N x N)
+    matrix, 1000 if they are not connected. Breadth first search from every atom
+    along the bonds, one row of the matrix at a time: O(N*(N+bonds)).
+    '''
+    N = len(neighbors)
+    distances = full((N,N), 1000, int64)
+    for a in range(N):
+        row = [1000]*N
+        row[a] = 0
+        frontier = [a]
+        d = 0
+        while frontier:
+            d += 1
+            newfrontier = []
+            for i in frontier:
+                for j in neighbors[i]:
+                    if row[j] == 1000:
+                        row[j] = d
+                        newfrontier.append(j)
+            frontier = newfrontier
+        distances[a] = row
+    return distances
 
 
 def GetBondTorsion(i,j,k,distances, neighborsOfk, coordinates):
@@ -646,39 +1100,29 @@ def GetBondTorsion(i,j,k,distances, neighborsOfk, coordinates):
         if distances[l]==distances[k]-1:
             return pscalar_cos(coordinates[j]-coordinates[i],coordinates[k]-coordinates[l])
             #return abs(gettors(coordinates[i], coordinates[j], coordinates[k], coordinates[l]))
-    print("Error, atom L not found!", file=stderr)
+    errorlog.write("Error, atom L not found!")
 
 # also includes G1 descriptors...
-def GetG2descriptorB(atom, ref_atom, at_symbols, coordinates, neighbors):
-    Nbins = 9
-    Range = linspace(1, 5.5, Nbins)
-    Range2 = linspace(-5,5, Nbins)
+def GetG2descriptorB(atom, ref_atom, at_symbols, coordinates, neighbors, topology=None):
+    Nbins = G2BINS
+    Range = G2RANGE
+    Range2 = G2RANGE2
     #print(Range);
-    element = {"H": 0, "C": 1, "N": 2, "F": 3, "O": 4, "all": 5}
+    element = ELEMENTS
     #rev_element = {0: "H", 1: "C", 2: "N", 3: "F", 4: "O", 5: "all"}
 
     N = 6
-    counts = [[0] * Nbins for i in range(N)]
-    counts1 = [[0] * Nbins for i in range(N)]
-    counts2 = [[0] * Nbins for i in range(N)]
-
-    countsG1 = zeros(N)
-    countsG1b = zeros(N)
-    countsG1c = zeros(N)
-
     charge = zeros((N,2))
     closestAtom = full((N,2), 1000)
     distA = full((N,2), 1000.0)
     distB = full((N,2), 1000.0)
     distC = full((N,2), 1000.0)
     distD = full((N,2),1000.0)
-    torsion = full((N,2),1000.0)
-    angle = full((N,2), 1000.0)
-
-    distances = full(len(coordinates), 1000)
-    distances = FindDistance(0, atom, distances, neighbors)
-    #exit(1)
 
+    if topology is not None:
+        distances = topology.distances[atom]
+    else:
+        distances = GetTopologicalDistances(neighbors)[atom]
 
     # get 1st and 2nd level neighbors
     neighbors2 = dict()
@@ -687,99 +1131,73 @@ def GetG2descriptorB(atom, ref_atom, at_symbols, coordinates, neighbors):
         for j in neighbors[i]:
             neighbors2[j]=1
 
-    AB = coordinates[atom] - coordinates[ref_atom]
-
-    #for all atoms in the molecule
-    for i in range(len(coordinates)):
-        # exclude self, 1st and 2nd order neighbors ... this actually might not be a good idea
-        if not (i in neighbors2 or i==atom):
-        # exclude self and the reference atom
-        #if not (i==atom or j==ref_atom):
-            symbol = at_symbols[i]
-            tt = element[symbol]
-            DD = coordinates[atom] - coordinates[i]
-            cosA = pscalar_cos(AB,DD)
-            dd = getdist(coordinates[atom], coordinates[i])
-            dd1 = dd*cosA
-            dd2 = dd* sqrt(1 - cosA**2)
-
-            if distA[tt][0] > dd:
-                distA[tt][1] = distA[tt][0]
-                closestAtom[tt][1] = closestAtom[tt][0]
-
-                distA[tt][0] = dd
-                closestAtom[tt][0] =i
-            elif distA[tt][1] > dd:
-                distA[tt][1] = dd
-                closestAtom[tt][1] = i
+    # all the atoms at once, excluding self, 1st and 2nd order neighbors ... this actually might not be a good idea
+    others = array([i for i in range(len(coordinates)) if not (i in neighbors2 or i==atom)], int)
+    symbols = [at_symbols[i] for i in others]
+    codes = array([element[symbol] for symbol in symbols], int)
+    heavy = codes != element["H"]
 
-            if not symbol == "H":
-                if distA[5][0] > dd:
-                    distA[5][1] = distA[5][0]
-                    closestAtom[5][1] = closestAtom[5][0]
-
-                    distA[5][0] = dd
-                    closestAtom[5][0]=i
-                elif distA[5][1] > dd:
-                    distA[5][1] = dd
-                    closestAtom[5][1] = i
-
-            rr = Rc(dd, 5.0)
-            countsG1[tt] += rr
-            if not symbol == "H": countsG1[5] += rr
-            if dd1>0:
-                countsG1b[tt] += rr
-                if not symbol == "H": countsG1b[5] += rr
-            else:
-                countsG1c[tt] += rr
-                if not symbol == "H": countsG1c[5] += rr
-
-
-            for n in range(Nbins):
-                val = SmoothGaussian(dd, Range[n], beta=1.7) * Rc(dd, 6.0)
-                counts[tt][n] += val
-                if not symbol == "H": counts[5][n] += val
-
-                val = SmoothGaussian(dd1, Range2[n], beta=1.4) * Rc(abs(dd1), 6.0)
-                counts1[tt][n] += val
-                if not symbol == "H": counts1[5][n] += val
+    # distance (dd), its projection along AB (dd1) and perpendicular to it (dd2),
+    # same operations as getdist and pscalar_cos
+    AB = coordinates[atom] - coordinates[ref_atom]
+    DD = coordinates[atom][:3] - coordinates[others][:,:3].reshape((len(others),3))
+    dd = sqrt(power2(DD[:,0]) + power2(DD[:,1]) + power2(DD[:,2]))
+    norm = vecmod(AB) * dd
+    tiny = norm < 0.0001
+    cosA = (AB[0]*DD[:,0] + AB[1]*DD[:,1] + AB[2]*DD[:,2]) / where(tiny, 1.0, norm)
+    cosA = clip(cosA, -1, 1)
+    cosA[tiny] = 0
+    dd1 = dd*cosA
+    dd2 = dd*sqrt(1 - power2(cosA))
+
+    # G1 descriptors: all, in front of and behind the atom (along AB)
+    rr = Rc(dd, 5.0)
+    front = dd1 > 0
+    countsG1 = zeros(N)
+    countsG1b = zeros(N)
+    countsG1c = zeros(N)
+    for counts, mask in ((countsG1, full(len(dd), True)), (countsG1b, front), (countsG1c, ~front)):
+        add.at(counts, codes[mask], rr[mask])
+        add.at(counts, full((mask & heavy).sum(), element["all"]), rr[mask & heavy])
 
-                val = SmoothGaussian(dd2, Range[n], beta=1.7) * Rc(dd2, 6.0)
-                counts2[tt][n] += val
-                if not symbol == "H": counts2[5][n] += val
+    counts = SmearedHistogram(dd, symbols, Range, 1.7, weights=Rc(dd, 6.0))
+    counts1 = SmearedHistogram(dd1, symbols, Range2, 1.4, weights=Rc(abs(dd1), 6.0))
+    counts2 = SmearedHistogram(dd2, symbols, Range, 1.7, weights=Rc(dd2, 6.0))
 
-    # assign properties of closestAtom for each type:
+    # properties of the two closest atoms of each type (the first one found wins ties)
     for tt in range(N):
-        for index in range(2):
-            if not closestAtom[tt][index] == 1000:
-                i = closestAtom[tt][index]
-                DD = coordinates[atom] - coordinates[i]
-                cosA = pscalar_cos(AB, DD)
-                dd = distA[tt][index]  # distance is already stored from previous loop
-                dd1 = dd * cosA
-                dd2 = dd * sqrt(1 - cosA ** 2)
-
-                distB[tt][index] = dd1
-                distC[tt][index] = dd2
-                distD[tt][index] = distances[i]
-                charge[tt][index] = coordinates[i][3]
-                torsion[tt][index] = GetBondTorsion(ref_atom, atom, i, distances, neighbors[i], coordinates)
-                angle[tt][index] = getangle(coordinates[ref_atom], coordinates[atom], coordinates[i])
-
-
+        if tt == element["all"]:
+            candidates = nonzero(heavy & (dd < 1000.0))[0]
+        else:
+            candidates = nonzero((codes == tt) & (dd < 1000.0))[0]
+        closest = candidates[argsort(dd[candidates], kind='mergesort')[:2]]
+        for index, k in enumerate(closest):
+            i = others[k]
+            closestAtom[tt][index] = i
+            distA[tt][index] = dd[k]
+            distB[tt][index] = dd1[k]
+            distC[tt][index] = dd2[k]
+            distD[tt][index] = distances[i]
+            charge[tt][index] = coordinates[i][3]
+            # torsion (GetBondTorsion) and angle of the closest atoms are not used any more
+
+    # the histograms are written rounded to 2 decimals (format "%.2f"), the rest as they are (None)
+    values = []
+    formats = []
     for f in range(N):
         for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-            print("%.2f" % counts1[f][n], end=",")
-            print("%.2f" % counts2[f][n], end=",")
-        print(countsG1[f], countsG1b[f], countsG1c[f], sep=",", end=",")
+            values += [counts[f][n], counts1[f][n], counts2[f][n]]
+            formats += ["%.2f"]*3
+        values += [countsG1[f], countsG1b[f], countsG1c[f]]
+        formats += [None]*3
         #print("")
         if not closestAtom[f][0]== 1000:
-            print(distA[f][0],distB[f][0],distC[f][0], distD[f][0],charge[f][0], sep=",", end=",")
-            #if (at_symbols[atom]=="H"): print(torsion[f][0], angle[f][0], sep=",", end=",")  # this worsens performance!
+            values += [distA[f][0],distB[f][0],distC[f][0], distD[f][0],charge[f][0]]
+            #if (at_symbols[atom]=="H"): values += [torsion[f][0], angle[f][0]]  # this worsens performance!
         else:
-            print("0,0,0,0,0", sep=",", end=",")
-            #if (at_symbols[atom] == "H"): print("0,0", sep=",", end=",")
+            values += [0,0,0,0,0]
+            #if (at_symbols[atom] == "H"): values += [0,0]
+        formats += [None]*5
         #print("")
         ''''
         if not closestAtom[f][1] == 1000:
@@ -797,43 +1215,35 @@ def GetG2descriptorB(atom, ref_atom, at_symbols, coordinates, neighbors):
             if (at_symbols[atom] == "H"): print("NA,NA", sep=",", end=",")
         #print("")
         '''
+    return values, formats
+
 
 # THIS vesrion is not being used
 def GetG2descriptor(atom, at_symbols, coordinates, neighbors):
     Nbins = 9
     Range = linspace(2, 10, Nbins)
     #print(Range);
-    element = {"H": 0, "C": 1, "N": 2, "F": 3, "O": 4, "all": 5}
-    #rev_element = {0: "H", 1: "C", 2: "N", 3: "F", 4: "O", 5: "all"}
-
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
 
+    symbols = []
+    dist = []
     for i in range(len(coordinates)):
         if not (i in neighbors[atom] or i==atom):
             dd = getdist(coordinates[atom], coordinates[i])
             #print(atom, i , dd)
-            for n in range(Nbins):
-                val = SmoothGaussian(dd, Range[n], beta=1.7) * Rc(dd)
-                symbol = at_symbols[i]
-                counts[element[symbol]][n] += val
-                if not symbol=="H": counts[5][n] += val
+            symbols.append(at_symbols[i])
+            dist.append(dd)
 
-    for f in range(N):
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    counts = SmearedHistogram(dist, symbols, Range, 1.7, weights=[Rc(dd) for dd in dist])
+    return counts
 
 
 def Get2ndLevelDistances(atom,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(1.4, 3.4, Nbins)
     # print Range
-    element = {"H": 0, "C": 1, "N": 2, "F": 3, "O": 4, "all": 5}
-    rev_element = {0: "H", 1: "C", 2: "N", 3: "F", 4: "O", 5: "all"}
 
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
+    symbols = []
+    dist = []
 
     mm = 100
     MM = -100
@@ -849,19 +1259,15 @@ def Get2ndLevelDistances(atom,at_symbols, coordinates, neighbors):
                 MM = max(MM, dd)
                 nn += 1
                 meanM += dd
-                for n in range(Nbins):
-                    val = SmoothGaussian(dd, Range[n],  beta = 2.5 * NBINS * (0.7/2.0) )
-                    counts[element[symbol]][n] += val
-                    if not symbol == "H":  counts[5][n] += val
+                symbols.append(symbol)
+                dist.append(dd)
+
+    counts = SmearedHistogram(dist, symbols, Range, beta = 2.5 * NBINS * (0.7/2.0))
 
     #if nn > 0:
     #    meanM /= nn
 
-    for f in range(N):
-        # print("CCC", atom, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        # print("")
+    return counts
     #print(mm, MM, meanM, sep=",", end=",")
 
 
@@ -869,68 +1275,42 @@ def GetNeighborsCharges(atom, exclude, at_symbols, coordinates, neighbors):
     Nbins = 15
     Range = linspace(-.75, .75, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-
-    mm = 100
-    MM = -100
-    meanM = 0
-    nn = 0
 
+    symbols = []
+    charges = []
     for i in neighbors[atom]:
         if i not in exclude:
-            symbol = at_symbols[i]
-            for n in range(Nbins):
-                val = SmoothGaussian(coordinates[i][3],Range[n], beta= 17.5)
-                counts[element[symbol]][n] += val
-                if not symbol == "H": counts[5][n] += val
+            symbols.append(at_symbols[i])
+            charges.append(coordinates[i][3])
 
-    for f in range(N):
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
+    counts = SmearedHistogram(charges, symbols, Range, beta= 17.5)
+    return counts
 
 
 def Get2ndLevelNeighborsCharges(atom, at_symbols, coordinates, neighbors):
     Nbins = 15
     Range = linspace(-.75, .75, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-
-    mm = 100
-    MM = -100
-    meanM = 0
-    nn = 0
 
+    symbols = []
+    charges = []
     for i in neighbors[atom]:
         for j in neighbors[i]:
             if not j==atom:
-                symbol = at_symbols[j]
-                for n in range(Nbins):
-                    val = SmoothGaussian(coordinates[j][3],Range[n], beta= 17.5)
-                    counts[element[symbol]][n] += val
-                    if not symbol == "H": counts[5][n] += val
+                symbols.append(at_symbols[j])
+                charges.append(coordinates[j][3])
 
-    for f in range(N):
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
+    counts = SmearedHistogram(charges, symbols, Range, beta= 17.5)
+    return counts
 
 
-def GetChargeArrayOfCloseAtoms3(atom, at_symbols, coordinates, neighbors):
+def GetChargeArrayOfCloseAtoms3(atom, at_symbols, coordinates, neighbors, grid=None):
     Nbins = 15
     Range = linspace(-.75, .75, Nbins)
     # print Range
-    element = {"H": 0, "C": 1, "N": 2, "F": 3, "O": 4, "all": 5}
-    rev_element = {0: "H", 1: "C", 2: "N", 3: "F", 4: "O", 5: "all"}
 
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
+    symbols = []
+    charges = []
 
     # get 1st and 2nd level neighbors
     neighbors2 = dict()
@@ -939,32 +1319,30 @@ def GetChargeArrayOfCloseAtoms3(atom, at_symbols, coordinates, neighbors):
         for j in neighbors[i]:
             neighbors2[j] = 1
 
-    # for all atoms in the molecule
-    for i in range(len(coordinates)):
+    # for all atoms in the molecule (only those within the cutoff if a cell list is given)
+    if grid is None:
+        candidates = range(len(coordinates))
+    else:
+        candidates = grid.query(atom, 3.0)[0]
+    for i in candidates:
         # exclude self, 1st and 2nd order neighbors ... this actually might not be a good idea
         if not (i in neighbors2 or i == atom):
             dd = getdist(coordinates[atom], coordinates[i])
             if dd < 3.0:
-                symbol = at_symbols[i]
-                for n in range(Nbins):
-                    val = SmoothGaussian(coordinates[i][3],Range[n], beta= 17.5)
-                    counts[element[symbol]][n] += val
-                    if not symbol == "H": counts[5][n] += val
+                symbols.append(at_symbols[i])
+                charges.append(coordinates[i][3])
 
-    for f in range(N):
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
+    counts = SmearedHistogram(charges, symbols, Range, beta= 17.5)
+    return counts
 
 
-def GetChargeArrayOfCloseAtoms5(atom, at_symbols, coordinates, neighbors):
+def GetChargeArrayOfCloseAtoms5(atom, at_symbols, coordinates, neighbors, grid=None):
     Nbins = 15
     Range = linspace(-.75, .75, Nbins)
     # print Range
-    element = {"H": 0, "C": 1, "N": 2, "F": 3, "O": 4, "all": 5}
-    rev_element = {0: "H", 1: "C", 2: "N", 3: "F", 4: "O", 5: "all"}
 
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
+    symbols = []
+    charges = []
 
     # get 1st and 2nd level neighbors
     neighbors2 = dict()
@@ -973,32 +1351,30 @@ def GetChargeArrayOfCloseAtoms5(atom, at_symbols, coordinates, neighbors):
         for j in neighbors[i]:
             neighbors2[j] = 1
 
-    # for all atoms in the molecule
-    for i in range(len(coordinates)):
+    # for all atoms in the molecule (only those within the cutoff if a cell list is given)
+    if grid is None:
+        candidates = range(len(coordinates))
+    else:
+        candidates = grid.query(atom, 5.0)[0]
+    for i in candidates:
         # exclude self, 1st and 2nd order neighbors ... this actually might not be a good idea
         if not (i in neighbors2 or i == atom):
             dd = getdist(coordinates[atom], coordinates[i])
             if dd < 5.0:
-                symbol = at_symbols[i]
-                for n in range(Nbins):
-                    val = SmoothGaussian(coordinates[i][3], Range[n], beta=17.5)
-                    counts[element[symbol]][n] += val
-                    if not symbol == "H": counts[5][n] += val
+                symbols.append(at_symbols[i])
+                charges.append(coordinates[i][3])
 
-    for f in range(N):
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
+    counts = SmearedHistogram(charges, symbols, Range, beta=17.5)
+    return counts
 
 
 def GetNeighborsDistances(atom, exclude, at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(0.9, 1.6, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-    
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
+
+    symbols = []
+    dist = []
 
     mm = 100
     MM = -100
@@ -1012,20 +1388,15 @@ def GetNeighborsDistances(atom, exclude, at_symbols, coordinates, neighbors):
             MM = max(MM, dd)
             nn += 1
             meanM += dd
-            symbol = at_symbols[i]
-            for n in range(Nbins):
-                val = SmoothGaussian(dd,Range[n])
-                counts[element[symbol]][n] += val
-                if not symbol == "H": counts[5][n] += val
+            symbols.append(at_symbols[i])
+            dist.append(dd)
+
+    counts = SmearedHistogram(dist, symbols, Range, beta=100//40*NBINS)
 
     if nn>0:
         meanM /= nn
 
-    for f in range(N):
-        #print("CCC", atom, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    return counts
     # print(mm,MM, meanM, sep=",", end=",")   this did not help for 1JNH
 
 
@@ -1033,139 +1404,71 @@ def GetNeighborsAngles(atom1,atom2,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(40, 180, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-    
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-    
-    for i in neighbors[atom2]:
-        if i!=atom1:
-            symbol = at_symbols[i]
-            dd = getangle(coordinates[atom1],coordinates[atom2],coordinates[i])
-            for n in range(Nbins):
-                val = SmoothGaussian(dd,Range[n], beta=0.5 * NBINS/40)
-                counts[element[symbol]][n] += val
-                if not symbol == "H": counts[5][n] += val
 
-    for f in range(N):
-        #print("DDD", atom1, atom2, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    others = [i for i in neighbors[atom2] if i!=atom1]
+    symbols = [at_symbols[i] for i in others]
+    angles = getangles(coordinates, [(atom1,atom2,i) for i in others])
+
+    counts = SmearedHistogram(angles, symbols, Range, beta=0.5 * NBINS/40)
+    return counts
 
 
 def GetNeighborsMaxAngles(atom1,atom2,atomX,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(40, 180, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-    
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-    
-    for i in neighbors[atomX]:
-        if i!=atom1 and i!=atom2:
-            dd1 = getangle(coordinates[atom1],coordinates[atomX],coordinates[i])
-            dd2 = getangle(coordinates[atom2],coordinates[atomX],coordinates[i])
-            dd = max(dd1, dd2)
-            symbol = at_symbols[i]
-            for n in range(Nbins):
-                val = SmoothGaussian(dd,Range[n], beta=0.5 * NBINS/40)
-                counts[element[symbol]][n] += val
-                if not symbol == "H": counts[5][n] += val
 
-    for f in range(N):
-        #print("DDD", atom1, atom2, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    others = [i for i in neighbors[atomX] if i!=atom1 and i!=atom2]
+    symbols = [at_symbols[i] for i in others]
+    dd1 = getangles(coordinates, [(atom1,atomX,i) for i in others])
+    dd2 = getangles(coordinates, [(atom2,atomX,i) for i in others])
+    angles = maximum(dd1, dd2)
+
+    counts = SmearedHistogram(angles, symbols, Range, beta=0.5 * NBINS/40)
+    return counts
 
 
 def GetNeighborsMinAngles(atom1,atom2,atomX,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(40, 180, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
 
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
+    others = [i for i in neighbors[atomX] if i!=atom1 and i!=atom2]
+    symbols = [at_symbols[i] for i in others]
+    dd1 = getangles(coordinates, [(atom1,atomX,i) for i in others])
+    dd2 = getangles(coordinates, [(atom2,atomX,i) for i in others])
+    angles = minimum(dd1, dd2)
 
-    for i in neighbors[atomX]:
-        if i!=atom1 and i!=atom2:
-            dd1 = getangle(coordinates[atom1],coordinates[atomX],coordinates[i])
-            dd2 = getangle(coordinates[atom2],coordinates[atomX],coordinates[i])
-            dd = min(dd1, dd2)
-            symbol = at_symbols[i]
-            for n in range(Nbins):
-                val = SmoothGaussian(dd,Range[n], beta=0.5*NBINS/40)
-                counts[element[symbol]][n] += val
-                if symbol ==  "H": counts[5][n] += val
-
-    for f in range(N):
-        #print("DDD", atom1, atom2, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    # NB: the last row of this descriptor has always collected the H atoms, not the heavy ones
+    hydrogens = array([symbol == "H" for symbol in symbols], bool)
+    counts = SmearedHistogram(angles, symbols, Range, beta=0.5*NBINS/40, heavy=hydrogens)
+    return counts
 
 
 def GetNeighborsTorsions(atom1,atom2,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(0, 180, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-    
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-    
-    for i in neighbors[atom2]:
-        if i!=atom1:
-            for j in neighbors[i]:
-                if j!=atom2:
-                    symbol = at_symbols[j]
-                    dd = abs(gettors(coordinates[atom1],coordinates[atom2],coordinates[i],coordinates[j]))
-                    #print atom1, atom2, i, j, dd
-                    for n in range(Nbins):
-                        val = SmoothGaussian(dd,Range[n], beta=0.35 * NBINS/40)
-                        counts[element[symbol]][n] += val
-                        if not symbol == "H": counts[5][n] += val
 
-    for f in range(N):
-        #print("EEE", atom1, atom2, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    quadruples = [(atom1,atom2,i,j) for i in neighbors[atom2] if i!=atom1 for j in neighbors[i] if j!=atom2]
+    symbols = [at_symbols[q[3]] for q in quadruples]
+    torsions = abs(gettorsions(coordinates, quadruples))
+
+    counts = SmearedHistogram(torsions, symbols, Range, beta=0.35 * NBINS/40)
+    return counts
 
 
 def GetNeighborsTorsions2(atom1,atom2,atom3,at_symbols, coordinates, neighbors):
     Nbins = NBINS
     Range = linspace(0, 180, Nbins)
     #print Range
-    element =  { "H":0, "C":1, "N":2, "F":3, "O":4, "all":5 }
-    rev_element =  { 0:"H", 1:"C", 2:"N", 3:"F", 4:"O", 5:"all" }
-    
-    N = 6
-    counts = [[0] * Nbins for i in range(N)]
-    
-    for i in neighbors[atom3]:
-        if i!=atom2:
-            symbol = at_symbols[i]
-            dd = abs(gettors(coordinates[atom1],coordinates[atom2],coordinates[atom3],coordinates[i]))
-            #print atom1, atom2, i, j, dd
-            for n in range(Nbins):
-                val = SmoothGaussian(dd,Range[n], beta=0.35 * NBINS/40)
-                counts[element[symbol]][n] += val
-                if not symbol=="H":
-                    counts[5][n] += val
 
-    for f in range(N):
-        #print("FFF", atom1, atom2, atom3, rev_element[f], end=",")
-        for n in range(Nbins):
-            print("%.2f" % counts[f][n], end=",")
-        #print("")
+    others = [i for i in neighbors[atom3] if i!=atom2]
+    symbols = [at_symbols[i] for i in others]
+    torsions = abs(gettorsions(coordinates, [(atom1,atom2,atom3,i) for i in others]))
+
+    counts = SmearedHistogram(torsions, symbols, Range, beta=0.35 * NBINS/40)
+    return counts
 
 
 def Get2ndLevelNeighborsCount(atom,at_symbols, neighbors):
@@ -1178,9 +1481,7 @@ def Get2ndLevelNeighborsCount(atom,at_symbols, neighbors):
                 if not symbol == "H": counts["all"]+=1
 
     #print("BBB", atom,end=",")
-    for f in counts:
-        print(counts[f], end=",")
-    #print("")
+    return [counts[f] for f in COUNTORDER]
 
 
 def GetMinMaxMeanNeighborsCharges(atom, exclude, coordinates, neighbors):
@@ -1199,7 +1500,7 @@ def GetMinMaxMeanNeighborsCharges(atom, exclude, coordinates, neighbors):
     if nnn>0:
         mmm /= nnn
 
-    print(mm, MM, mmm, sep=",", end=",")  # min, max and average charge of neighbors of atom
+    return [mm, MM, mmm]  # min, max and average charge of neighbors of atom
 
 
 def CountCyclicNeighbors(atom, neighbors, cyclicAtoms):
@@ -1217,392 +1518,1522 @@ def IsAtomCyclic(atom, cyclicAtoms):
     return isAtomCyclic
 
 
-def GetCoulombMatrixRow(atom, coordinates, neighbors):
-    result = zeros(29)
+def GetCoulombMatrix(coordinates):
+    ''' charge weighted Coulomb matrix q_i*q_j/|ij| of the molecule (0 on the diagonal)
+    '''
+    distances = GetDistanceMatrix(coordinates)
+    fill_diagonal(distances, 1.0)
+    charges = coordinates[:,3]
+    matrix = charges[:,newaxis]*charges[newaxis,:]/distances
+    fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def GetSortedCoulombRows(coordinates, width=COULOMBWIDTH):
+    ''' every row of the Coulomb matrix sorted, padded with zeros to width values.
+    For molecules with more than width atoms only the width values largest in
+    absolute value are kept, and the error log is warned of it: raise COULOMBWIDTH
+    to keep whole rows.
+    '''
+    matrix = GetCoulombMatrix(coordinates)
+    N = len(matrix)
+    if N < width:
+        matrix = concatenate([matrix, zeros((N, width-N))], axis=1)
+    elif N > width:
+        errorlog.write("Warning: %d atoms, the Coulomb matrix rows are cut to the %d values largest in absolute value"
+                       % (N, width))
+        keep = argsort(-abs(matrix), axis=1, kind='mergesort')[:,:width]
+        matrix = matrix[arange(N)[:,newaxis], keep]
+    return sort(matrix, axis=1)
+
+
+def GetCoulombMatrixRow(atom, coordinates, neighbors, rows=None):
+    ''' sorted row of the Coulomb matrix of atom; rows are the GetSortedCoulombRows
+    of the molecule, if already computed
+    '''
+    if rows is None:
+        rows = GetSortedCoulombRows(coordinates)
+    return rows[atom]
 
-    for i in range(len(coordinates)):
-        if not (atom==i): # or i in neighbors[atom]):
-            result[i] = coordinates[atom][3]*coordinates[i][3]/getdist(coordinates[i],coordinates[atom])
-    #print("A")
-    result = sort(result)
+def GetDistanceMatrix(coordinates):
+    ''' distances between all pairs of atoms as a (N x N) matrix
+    '''
+    xyz = coordinates[:,:3]
+    diff = xyz[newaxis,:,:] - xyz[:,newaxis,:]
+    # same summation order as getdist, so that the values are identical
+    return sqrt(power2(diff[:,:,0]) + power2(diff[:,:,1]) + power2(diff[:,:,2]))
+
+
+def GetBonds(coordinates, at_symbols, distances=None, grid=None):
+    ''' find all covalent bonds of the molecule at once: two atoms are bonded
+    when they are closer than the sum of their covalent radii.
+    For large (or periodic) systems pass a CellList as grid, then only the
+    atoms in the surrounding cells are tested.
+    Returns neighbors[i][j] = |ij| for every bonded pair (keys in increasing order)
+    '''
+    radii = array([covalentR[symbol] for symbol in at_symbols])
+    neighbors = [dict() for x in range(len(coordinates))]
 
-    for i in range(29):
-        print(result[i], sep=",", end=",")
-    #print("B")
+    if grid is not None:
+        maxbond = 2*max(covalentR.values())
+        for i in range(len(coordinates)):
+            close, dists = grid.query(i, maxbond)
+            for j, dd in zip(close, dists):
+                if j != i and dd < radii[i] + radii[j]:
+                    neighbors[i][int(j)] = dd
+        return neighbors
+
+    if distances is None:
+        distances = GetDistanceMatrix(coordinates)
+    bonded = distances < radii[:,newaxis] + radii[newaxis,:]
+    fill_diagonal(bonded, False)
+
+    for i, j in zip(*nonzero(bonded)):
+        neighbors[i][int(j)] = distances[i][j]
+    return neighbors
+
+
+class CellList(object):
+    ''' spatial index for radius queries. The atoms are sorted into cells at
+    least cutoff wide, so a query only has to look at the 27 cells around
+    an atom and the cost grows linearly with the number of atoms.
+    If a PeriodicCell (or the unit cell parameters, as for -u/--unitcell) is given
+    the cells follow the periodic cell and the distances are computed
+    with the minimum image convention (cutoff must not exceed half the cell).
+    '''
+    def __init__(self, coordinates, cutoff, cell=None):
+        self.xyz = coordinates[:,:3]
+        self.cutoff = cutoff
+        self.periodic = cell is not None
+        if self.periodic:
+            if not isinstance(cell, PeriodicCell):
+                cell = PeriodicCell(cell)
+            self.cell = cell
+            frac = cell.fractional(self.xyz)
+            self.frac = frac - floor(frac) # wrap all atoms into the unit cell
+            self.ncells = maximum(floor(cell.widths/cutoff), 1).astype(int)
+            cells = floor(self.frac*self.ncells).astype(int)
+            cells = cells % self.ncells
+        else:
+            origin = self.xyz.min(axis=0)
+            cells = floor((self.xyz - origin)/cutoff).astype(int)
+            self.ncells = cells.max(axis=0) + 1
+        self.cells = cells
+
+        # atoms sorted by cell, start[c]:start[c+1] are the atoms in cell c
+        index = self.CellIndex(cells)
+        self.order = argsort(index, kind="mergesort")
+        self.start = searchsorted(index[self.order], range(self.ncells.prod()+1))
+
+    def CellIndex(self, cells):
+        return (cells[...,0]*self.ncells[1] + cells[...,1])*self.ncells[2] + cells[...,2]
+
+    def query(self, atom, radius):
+        ''' atoms closer than radius to atom (including the atom itself),
+        returns their indices (sorted) and distances
+        '''
+        if radius > self.cutoff:
+            raise ValueError("query radius %g is larger than the cell list cutoff %g" % (radius, self.cutoff))
+        around = []
+        for dx in (-1,0,1):
+            for dy in (-1,0,1):
+                for dz in (-1,0,1):
+                    around.append(self.cells[atom] + (dx,dy,dz))
+        around = array(around)
+        if self.periodic:
+            around = around % self.ncells
+        else:
+            inside = ((around >= 0) & (around < self.ncells)).all(axis=1)
+            around = around[inside]
+        around = unique(self.CellIndex(around))  # small periodic cells can repeat
+        candidates = sort(concatenate([self.order[self.start[c]:self.start[c+1]] for c in around]))
+
+        if self.periodic:
+            tvec = self.frac[candidates] - self.frac[atom]
+            diff = self.cell.cartesian(tvec - floor(tvec + 0.5))
+        else:
+            diff = self.xyz[candidates] - self.xyz[atom]
+        dists = sqrt(power2(diff[:,0]) + power2(diff[:,1]) + power2(diff[:,2]))
+        close = dists < radius
+        return candidates[close], dists[close]
+
+
+class Topology(object):
+    ''' everything of a molecule which depends on the bond graph only, computed once
+    and shared by all its couplings:
+    neighbors   the bonds, as returned by GetBonds
+    distances   (N x N) number of bonds between every two atoms (1000 if not connected)
+    cyclic      heavy atoms belonging to a ring (cyclic[i]=1)
+    ringsize    size of the smallest ring through every atom (0 if none)
+    It can be saved to and loaded from a .npz file (see --topocache), together with
+    the coordinates, the atomic symbols and the periodic cell it was computed for.
+    '''
+    def __init__(self, coordinates, at_symbols, grid=None, neighbors=None):
+        self.coordinates = coordinates
+        self.at_symbols = list(at_symbols)
+        # unit cell parameters, None for open systems
+        self.cellparam = grid.cell.cellparam if grid is not None and grid.periodic else None
+        if neighbors is None:
+            neighbors = GetBonds(coordinates, at_symbols, grid=grid)
+        self.neighbors = neighbors
+
+        self.distances = GetTopologicalDistances(neighbors)
+
+        self.cyclic = GetCyclicAtoms(neighbors, at_symbols)
+
+        self.ringsize = zeros(len(coordinates), int64)
+        for i in self.cyclic:
+            self.ringsize[i] = self.SmallestRing(i, at_symbols)
+
+    def SmallestRing(self, atom, at_symbols):
+        ''' size of the smallest ring of heavy atoms through atom: breadth first
+        search from atom back to one of its neighbors without using their bond
+        '''
+        neighbors = self.neighbors
+        best = 0
+        for first in neighbors[atom]:
+            if at_symbols[first] == "H":
+                continue
+            depth = {first: 1}
+            frontier = [first]
+            while len(frontier) > 0 and atom not in depth:
+                newfrontier = []
+                for i in frontier:
+                    for j in neighbors[i]:
+                        if at_symbols[j] == "H" or j in depth or (i == first and j == atom):
+                            continue
+                        depth[j] = depth[i] + 1
+                        newfrontier.append(j)
+                frontier = newfrontier
+            if atom in depth and (best == 0 or depth[atom] < best):
+                best = depth[atom]
+        return best
+
+    def save(self, filename):
+        # increasing keys, the order GetBonds fills the neighbors dicts in
+        bonds = [(i, j, self.neighbors[i][j]) for i in range(len(self.neighbors)) for j in sorted(self.neighbors[i])]
+        savez(filename,
+              coordinates = self.coordinates,
+              symbols = array(self.at_symbols, str),
+              cell = zeros(0) if self.cellparam is None else array(self.cellparam, float64),
+              bonds = array([b[:2] for b in bonds], int64).reshape((len(bonds), 2)),
+              bondlengths = array([b[2] for b in bonds], float64),
+              distances = self.distances,
+              cyclic = array(sorted(self.cyclic), int64),
+              ringsize = self.ringsize)
+
+    @classmethod
+    def load(cls, filename, coordinates, at_symbols, pbc=None):
+        ''' the topology saved in filename, None if there is none or if it was
+        computed for other coordinates, atomic symbols or periodic cell (pbc as for write_features)
+        '''
+        if not path.isfile(filename):
+            return None
+        data = load(filename)
+        if [k for k in ["symbols", "cell", "ringsize"] if k not in data.files]: # written before they were kept
+            return None
+        if data["coordinates"].shape != coordinates.shape or not (data["coordinates"] == coordinates).all():
+            return None
+        if data["symbols"].astype(str).tolist() != list(at_symbols):
+            return None
+        cellparam = None
+        if pbc is not None:
+            cellparam = pbc.cellparam if isinstance(pbc, PeriodicCell) else PeriodicCell(pbc).cellparam
+        if (cellparam is None) != (len(data["cell"]) == 0) or \
+                (cellparam is not None and tuple(data["cell"].tolist()) != cellparam):
+            return None
+        topology = cls.__new__(cls)
+        topology.coordinates = coordinates
+        topology.at_symbols = list(at_symbols)
+        topology.cellparam = cellparam
+        # same insertion order as GetBonds, so that the neighbors dicts iterate the same way
+        topology.neighbors = [dict() for x in range(len(coordinates))]
+        for (i, j), dd in zip(data["bonds"].tolist(), data["bondlengths"]):
+            topology.neighbors[i][j] = dd
+        topology.distances = data["distances"]
+        topology.cyclic = dict((i, 1) for i in data["cyclic"].tolist())
+        topology.ringsize = data["ringsize"]
+        return topology
+
+
+class DescriptorCache(object):
+    ''' descriptors already computed for the current molecule, so that those of an
+    atom shared by several couplings are computed only once.
+    descriptors(GetXxx, args...) returns GetXxx(args...); the result is kept under the
+    descriptor and its atom and exclusion set arguments (integers, sets, None), the other
+    arguments (symbols, coordinates, neighbors...) must be those of the molecule.
+    Use a new cache for every molecule.
+    '''
+    def __init__(self):
+        self.values = dict()
+
+    def __call__(self, descriptor, *args, **kwargs):
+        key = (descriptor,) + tuple(self.Key(a) for a in args) + tuple((k, self.Key(kwargs[k])) for k in sorted(kwargs))
+        if key not in self.values:
+            self.values[key] = descriptor(*args, **kwargs)
+        return self.values[key]
+
+    def Key(self, value):
+        ''' atoms and exclusion sets tell apart the calls of a descriptor, the data
+        of the molecule (anything else) is the same for all of them
+        '''
+        if isinstance(value, (set, frozenset)):
+            return frozenset(value)
+        if value is None or isinstance(value, (int, integer)):
+            return value
+        return "molecule"
 
-def run(infile,tasklist,fformat,outfiles,pbc=None):
+    def clear(self):
+        self.values.clear()
 
-    structfile=safeopen(infile,'r')
-    trainFile=safeopen(infile+".train",'r')
-    if structfile == None: #if file not found, print error and quit
-        print("\nWhooooaaaa! Cannot file "+infile+"... I'm out of here\n")
-        exit(10)
-    if trainFile == None: #if file not found, print error and quit
-        print("\nWhooooaaaa! Cannot file "+infile+".train ... I'm out of here\n")
-        exit(10)
+
+# python types of the values printed with str(), by their code in FeatureRow.kinds
+# (0: printed with a format, 255: something else)
+TEXTTYPES = [None, int, float, float64, bool, int64, float32, int32, bool_]
+TEXTKINDS = dict([(t, k) for k, t in enumerate(TEXTTYPES) if t is not None])
+
+
+class FeatureRow(object):
+    ''' features of one coupling: the values (for the binary output) and how each of
+    them is printed (for the csv output), allocated for the width of the row (see
+    CouplingSpec.width). The text is made only when a sink prints the row (see text):
+    kinds tells how every value is written (see TEXTTYPES), so that it can be written
+    from the value alone.
+    '''
+    def __init__(self, width):
+        self.values = zeros(width)
+        self.fmt = [None]*width
+        self.kinds = zeros(width, uint8)
+        self.strings = dict() # text of the values of kind 255, by column
+        self.size = 0
+
+    def add(self, values, fmt=None):
+        ''' append values (list or array, arrays are flattened); fmt is the
+        format string of the text output (None means str), or a list with one format per value
+        '''
+        if hasattr(values, "ravel"):
+            values = values.ravel()
+        if not isinstance(fmt, list):
+            fmt = [fmt]*len(values)
+        start = self.size
+        self.size += len(values)
+        self.values[start:self.size] = values
+        self.fmt[start:self.size] = fmt
+        self.kinds[start:self.size] = [0 if f is not None else TEXTKINDS.get(type(v), 255) for v, f in zip(values, fmt)]
+        for j in (self.kinds[start:self.size] == 255).nonzero()[0].tolist():
+            self.strings[start+j] = str(values[j])
+
+    def restore(self, values, kinds, fmt=None):
+        ''' append values written before by add, with the kinds add gave them '''
+        if not isinstance(fmt, list):
+            fmt = [fmt]*len(values)
+        start = self.size
+        self.size += len(values)
+        self.values[start:self.size] = values
+        self.fmt[start:self.size] = fmt
+        self.kinds[start:self.size] = kinds
+
+    def string(self, j):
+        ''' the text of value j '''
+        return self.format(self.values.item(j), int(self.kinds[j]), self.fmt[j], j)
+
+    def text(self):
+        ''' the text of every value '''
+        return [self.format(v, k, f, j) for j, (v, k, f) in enumerate(zip(self.values.tolist(), self.kinds.tolist(), self.fmt))]
+
+    def format(self, v, k, f, j):
+        if f is not None:
+            return f % v
+        if k == 255:
+            return self.strings[j]
+        return str(TEXTTYPES[k](v))
+
+    def __len__(self):
+        return len(self.values)
+
+
+def ElementColumns(template, nbins=None, order=None):
+    ''' column names of a descriptor with one value (or nbins values) per element,
+    in the order of ELEMENTS unless given: {mol} stands for the element, {bin} for the bin (from 1)
+    '''
+    if order is None:
+        order = sorted(ELEMENTS, key=ELEMENTS.get)
+    if nbins is None:
+        return [template.replace("{mol}", e) for e in order]
+    return [template.replace("{mol}", e).replace("{bin}", str(n+1)) for e in order for n in range(nbins)]
+
+
+def G2Columns():
+    ''' column names of GetG2descriptorB '''
+    names = []
+    for e in sorted(ELEMENTS, key=ELEMENTS.get):
+        for n in range(G2BINS):
+            names += ["{0}: G2 descriptor for %s at distance %.2fA" % (e, G2RANGE[n]),
+                      "{0}: G2b descriptor for %s at distance %.2fA along {1}{0}" % (e, G2RANGE2[n]),
+                      "{0}: G2c descriptor for %s at distance %.2fA across {1}{0}" % (e, G2RANGE[n])]
+        names += ["{0}: G1:5A descriptor for %s" % e,
+                  "{0}: G1b:5A descriptor for %s" % e,
+                  "{0}: G1c:5A descriptor for %s" % e]
+        names += ["{0}: Min distance-1 for %s" % e,
+                  "{0}: Min distanceB-1 for %s" % e,
+                  "{0}: Min distanceC-1 for %s" % e,
+                  "{0}: Min distanceD-1 for %s" % e,
+                  "{0}: Charge-1 of min distance %s" % e]
+    return names
+
+
+class FeatureBlock(object):
+    ''' a descriptor of the feature registry (FEATURES): compute(context, atoms, ignore)
+    returns its width values for the atoms of a coupling (a list), ignore being the set of
+    atoms left out of its neighbors. fmt is the text format of the values (None for str,
+    a format string or one per value), names the templates of the column names, where
+    {0}, {1}... stand for the labels of the atoms (H, C, X...)
+    '''
+    def __init__(self, width, compute, names, fmt=None):
+        if len(names) != width or (isinstance(fmt, list) and len(fmt) != width):
+            raise ValueError("feature block of width %d with %d names" % (width, len(names)))
+        self.width = width
+        self.compute = compute
+        self.names = names
+        self.fmt = fmt
+
+    def columns(self, labels):
+        return [name.format(*labels) for name in self.names]
+
+
+class FeatureContext(object):
+    ''' what the features of the couplings of one structure are computed from.
+    The cell list, the topology (if not given) and the Coulomb rows are computed
+    the first time they are needed, not at all when every block comes from the BlockCache.
+    '''
+    def __init__(self, coordinates, at_symbols, topology=None, pbc=None):
+        self.coordinates = coordinates
+        self.at_symbols = at_symbols
+        self.pbc = pbc
+        self.lazy = dict()
+        if topology is not None:
+            self.lazy["topology"] = topology
+        # the descriptors of an atom are computed once for all its couplings
+        self.descriptors = DescriptorCache()
+
+    def Lazy(self, name, compute):
+        if name not in self.lazy:
+            self.lazy[name] = compute()
+        return self.lazy[name]
+
+    @property
+    def grid(self):
+        return self.Lazy("grid", lambda: cell_list(self.coordinates, self.pbc))
+
+    @property
+    def topology(self):
+        return self.Lazy("topology", lambda: Topology(self.coordinates, self.at_symbols, self.grid))
+
+    @property
+    def neighbors(self):
+        return self.topology.neighbors
+
+    @property
+    def cyclic(self):
+        return self.topology.cyclic
+
+    @property
+    def coulomb(self):
+        return self.Lazy("coulomb", lambda: GetSortedCoulombRows(self.coordinates))
+
+    def dist(self, a, b):
+        return getdist(self.coordinates[a], self.coordinates[b])
+
+    def angle(self, a, b, c):
+        return getangle(self.coordinates[a], self.coordinates[b], self.coordinates[c])
+
+    def tors(self, a, b, c, d):
+        return gettors(self.coordinates[a], self.coordinates[b], self.coordinates[c], self.coordinates[d])
+
+
+def Geometry2JHH(m, i, j, X):
+    d1, d2 = m.neighbors[i][X], m.neighbors[j][X]
+    return [min(d1, d2), max(d1, d2), m.dist(i, j), m.angle(i, X, j)]
+
+
+def Distances3JHH(m, i, j, X, Y):
+    d1, d2 = m.neighbors[i][X], m.neighbors[j][Y]
+    a1, a2 = m.dist(X, j), m.dist(Y, i)
+    return [min(d1, d2), max(d1, d2), min(a1, a2), max(a1, a2), m.dist(i, j), m.dist(X, Y)]
+
+
+def Angles3JHH(m, i, j, X, Y):
+    ang1, ang2 = m.angle(i, X, Y), m.angle(j, Y, X)
+    return [min(ang1, ang2), max(ang1, ang2), abs(m.tors(i, X, Y, j))]
+
+
+# the feature registry: every block of features a coupling row can be made of.
+# The geometry blocks are specific to a coupling type, the others are descriptors of
+# one atom (or a few), computed once per molecule when they do not depend on the coupling
+FEATURES = {
+    "geometry1J": FeatureBlock(1, lambda m, a, ignore: [m.neighbors[a[0]][a[1]]],
+                               ["distance {0}{1}"]),
+    "geometry2J": FeatureBlock(4, lambda m, a, ignore: [m.neighbors[a[0]][a[2]], m.neighbors[a[1]][a[2]],
+                                                        m.dist(a[0], a[1]), m.angle(a[0], a[2], a[1])],
+                               ["distance {0}{2}", "distance {1}{2}", "distance {0}{1}", "angle {0}{2}{1}"]),
+    "distances3J": FeatureBlock(6, lambda m, a, ignore: [m.neighbors[a[0]][a[2]], m.neighbors[a[2]][a[3]], m.neighbors[a[3]][a[1]],
+                                                         m.dist(a[0], a[3]), m.dist(a[1], a[2]), m.dist(a[0], a[1])],
+                                ["distance {0}{2}", "distance {2}{3}", "distance {3}{1}",
+                                 "distance {0}{3}", "distance {1}{2}", "distance {0}{1}"]),
+    "angles3J": FeatureBlock(3, lambda m, a, ignore: [m.angle(a[0], a[2], a[3]), m.angle(a[2], a[3], a[1]),
+                                                      abs(m.tors(a[0], a[2], a[3], a[1]))],
+                             ["angle {0}{2}{3}", "angle {2}{3}{1}", "|torsion {0}{2}{3}{1}|"]),
+    "geometry2JHH": FeatureBlock(4, lambda m, a, ignore: Geometry2JHH(m, *a),
+                                 ["min distance {0}{2},{1}{2}", "max distance {0}{2},{1}{2}",
+                                  "distance {0}{1}", "angle {0}{2}{1}"]),
+    "distances3JHH": FeatureBlock(6, lambda m, a, ignore: Distances3JHH(m, *a),
+                                  ["min distance {0}{2},{1}{3}", "max distance {0}{2},{1}{3}",
+                                   "min distance {0}{3},{1}{2}", "max distance {0}{3},{1}{2}",
+                                   "distance {0}{1}", "distance {2}{3}"]),
+    "angles3JHH": FeatureBlock(3, lambda m, a, ignore: Angles3JHH(m, *a),
+                               ["min angle {0}{2}{3},{1}{3}{2}", "max angle {0}{2}{3},{1}{3}{2}",
+                                "|torsion {0}{2}{3}{1}|"]),
+    "charge": FeatureBlock(1, lambda m, a, ignore: [m.coordinates[a[0]][3]],
+                           ["charge {0}"]),
+    "identity": FeatureBlock(5, lambda m, a, ignore: GetIdentity(*[m.at_symbols[k] for k in a]),
+                             ElementColumns("{0}={mol}", order=["H", "C", "N", "F", "O"])),
+    "identity2": FeatureBlock(5, lambda m, a, ignore: GetIdentity(*[m.at_symbols[k] for k in a]),
+                              ElementColumns("{0},{1}={mol}", order=["H", "C", "N", "F", "O"])),
+    "cyclic": FeatureBlock(2, lambda m, a, ignore: [IsAtomCyclic(a[0], m.cyclic), CountCyclicNeighbors(a[0], m.neighbors, m.cyclic)],
+                           ["Is {0} cyclic", "Number of cyclic neighbors of {0}"]),
+    "neighborcharges3": FeatureBlock(3, lambda m, a, ignore: m.descriptors(GetMinMaxMeanNeighborsCharges, a[0], ignore, m.coordinates, m.neighbors),
+                                     ["min charge of {0} neighbors", "max charge of {0} neighbors", "mean charge of {0} neighbors"]),
+    "G2": FeatureBlock(6*(3*G2BINS+8), lambda m, a, ignore: m.descriptors(GetG2descriptorB, a[0], a[1], m.at_symbols, m.coordinates, m.neighbors, m.topology)[0],
+                       G2Columns(), (["%.2f"]*3*G2BINS + [None]*8)*6),
+    "neighborcount": FeatureBlock(6, lambda m, a, ignore: m.descriptors(GetNeighborsCount, a[0], m.at_symbols, m.neighbors, ignore),
+                                  ElementColumns("{0}: number of neighbors of type {mol}", order=COUNTORDER)),
+    "neighbor2count": FeatureBlock(6, lambda m, a, ignore: m.descriptors(Get2ndLevelNeighborsCount, a[0], m.at_symbols, m.neighbors),
+                                   ElementColumns("{0}: number of 2nd level neighbors of type {mol}", order=COUNTORDER)),
+    "neighbordistances": FeatureBlock(6*NBINS, lambda m, a, ignore: m.descriptors(GetNeighborsDistances, a[0], ignore, m.at_symbols, m.coordinates, m.neighbors),
+                                      ElementColumns("{0}: distance bins to neighbors of type {mol}, bin nr. {bin}", NBINS), "%.2f"),
+    "neighborangles": FeatureBlock(6*NBINS, lambda m, a, ignore: GetNeighborsAngles(a[0], a[1], m.at_symbols, m.coordinates, m.neighbors),
+                                   ElementColumns("angle {0}{1}-{mol} bin nr. {bin}", NBINS), "%.2f"),
+    "neighborminangles": FeatureBlock(6*NBINS, lambda m, a, ignore: GetNeighborsMinAngles(a[0], a[1], a[2], m.at_symbols, m.coordinates, m.neighbors),
+                                      # the last row collects the H atoms (see GetNeighborsMinAngles)
+                                      ElementColumns("min angle {0}{2}-{mol},{1}{2}-{mol} bin nr. {bin}", NBINS, ["H", "C", "N", "F", "O", "H"]), "%.2f"),
+    "neighbormaxangles": FeatureBlock(6*NBINS, lambda m, a, ignore: GetNeighborsMaxAngles(a[0], a[1], a[2], m.at_symbols, m.coordinates, m.neighbors),
+                                      ElementColumns("max angle {0}{2}-{mol},{1}{2}-{mol} bin nr. {bin}", NBINS), "%.2f"),
+    "neighbortorsions": FeatureBlock(6*NBINS, lambda m, a, ignore: GetNeighborsTorsions(a[0], a[1], m.at_symbols, m.coordinates, m.neighbors),
+                                     ElementColumns("torsion {0}{1}-*-{mol} bin nr. {bin}", NBINS), "%.2f"),
+    "neighbortorsions2": FeatureBlock(6*NBINS, lambda m, a, ignore: GetNeighborsTorsions2(a[0], a[1], a[2], m.at_symbols, m.coordinates, m.neighbors),
+                                      ElementColumns("torsion {0}{1}{2}-{mol} bin nr. {bin}", NBINS), "%.2f"),
+    "distances2nd": FeatureBlock(6*NBINS, lambda m, a, ignore: m.descriptors(Get2ndLevelDistances, a[0], m.at_symbols, m.coordinates, m.neighbors),
+                                 ElementColumns("{0}: distances to its 2nd level {mol} neighbors, bin nr. {bin}", NBINS), "%.2f"),
+    "neighborcharges": FeatureBlock(6*15, lambda m, a, ignore: m.descriptors(GetNeighborsCharges, a[0], ignore, m.at_symbols, m.coordinates, m.neighbors),
+                                    ElementColumns("{0}: charges of its {mol} neighbors, bin nr. {bin}", 15), "%.2f"),
+    "closecharges3": FeatureBlock(6*15, lambda m, a, ignore: m.descriptors(GetChargeArrayOfCloseAtoms3, a[0], m.at_symbols, m.coordinates, m.neighbors, m.grid),
+                                  ElementColumns("{0}: charges of atoms {mol} within 3A, bin nr. {bin}", 15), "%.2f"),
+    "closecharges5": FeatureBlock(6*15, lambda m, a, ignore: m.descriptors(GetChargeArrayOfCloseAtoms5, a[0], m.at_symbols, m.coordinates, m.neighbors, m.grid),
+                                  ElementColumns("{0}: charges of atoms {mol} within 5A, bin nr. {bin}", 15), "%.2f"),
+    "coulomb": FeatureBlock(COULOMBWIDTH, lambda m, a, ignore: GetCoulombMatrixRow(a[0], m.coordinates, m.neighbors, m.coulomb),
+                            ["{0}: Coulomb matrix, item %d" % (n+1) for n in range(COULOMBWIDTH)]),
+}
+
+
+def CouplingAtoms1J(m, a0, a1):
+    ''' i the H atom, j the other one '''
+    if m.at_symbols[a1] == "H":
+        a0, a1 = a1, a0
+    return {"i": a0, "j": a1}
+
+
+def CouplingAtoms2J(m, a0, a1):
+    ''' i the H atom, j the other one, X the atom bonded to H '''
+    atoms = CouplingAtoms1J(m, a0, a1)
+    atoms["X"] = next(iter(m.neighbors[atoms["i"]]))
+    return atoms
+
+
+def CouplingAtoms3J(m, a0, a1):
+    ''' i the H atom, j the other one, i-X-Y-j the bonds between them '''
+    atoms = CouplingAtoms2J(m, a0, a1)
+    Y = None
+    for y in m.neighbors[atoms["X"]]:
+        if y in m.neighbors[atoms["j"]]:
+            Y = y
+    if Y == None:
+        raise MolgeomError("Error, Y not found for the coupling %d-%d" % (a0, a1))
+    atoms["Y"] = Y
+    return atoms
+
+
+def CouplingAtoms2JHH(m, a0, a1):
+    ''' symmetry is broken by charge: i is the H atom with the smaller Mulliken charge,
+    X the atom bonded to i '''
+    if m.coordinates[a0][3] > m.coordinates[a1][3]:
+        a0, a1 = a1, a0
+    return {"i": a0, "j": a1, "X": next(iter(m.neighbors[a0]))}
+
+
+def CouplingAtoms3JHH(m, a0, a1):
+    ''' as CouplingAtoms2JHH, Y the atom bonded to j '''
+    atoms = CouplingAtoms2JHH(m, a0, a1)
+    atoms["Y"] = next(iter(m.neighbors[atoms["j"]]))
+    return atoms
+
+
+class CouplingSpec(object):
+    ''' the features of a coupling type: atoms(context, atom0, atom1) finds the atoms of a
+    coupling by role (i, j, X, Y), labels names them in the column names and blocks
+    lists the row as (FEATURES block, roles of its atoms, roles of the ignored atoms).
+    Every method takes the names of the FEATURES blocks to keep (None for all).
+    '''
+    def __init__(self, atoms, labels, blocks):
+        self.atoms = atoms
+        self.labels = labels
+        self.blocks = blocks
+        self.keys = dict()
+
+    def selected(self, keep=None):
+        return [b for b in self.blocks if keep is None or b[0] in keep]
+
+    def width(self, keep=None):
+        return sum([FEATURES[b[0]].width for b in self.selected(keep)])
+
+    def columns(self, keep=None):
+        ''' (block, column name) of every feature of the row '''
+        columns = []
+        for name, roles, ignore in self.selected(keep):
+            columns += [(name, c) for c in FEATURES[name].columns([self.labels[r] for r in roles])]
+        return columns
+
+    def BlockKey(self, entry):
+        ''' what the values of a block of the row depend on, besides the molecule (see BlockCache):
+        the block, its atoms and the code of the functions computing them (see Fingerprint)
+        '''
+        if entry not in self.keys:
+            name, roles, ignore = entry
+            self.keys[entry] = md5(Fingerprint([name, roles, ignore, FEATURES[name].compute, FEATURES[name].fmt,
+                                                self.atoms, FeatureContext, Topology, CellList]).encode("utf-8")).hexdigest()
+        return self.keys[entry]
+
+    def row(self, context, atom0, atom1, keep=None, cache=None):
+        ''' the FeatureRow of the coupling atom0-atom1; the blocks found in the BlockCache
+        for the coupling are taken from there, those computed are added to it
+        '''
+        coupling = (int(atom0), int(atom1))
+        atoms = None
+        row = FeatureRow(self.width(keep))
+        for entry in self.selected(keep):
+            name, roles, ignore = entry
+            block = FEATURES[name]
+            saved = None
+            if cache is not None:
+                key = self.BlockKey(entry)
+                saved = cache.get(key, coupling)
+            if saved is not None:
+                row.restore(saved[0], saved[1], block.fmt)
+                continue
+            if atoms is None:
+                atoms = self.atoms(context, atom0, atom1)
+            start = row.size
+            row.add(block.compute(context, [atoms[r] for r in roles], set([atoms[r] for r in ignore])), block.fmt)
+            if cache is not None:
+                cache.put(key, coupling, row.values[start:row.size], row.kinds[start:row.size])
+        if row.size != len(row):
+            raise MolgeomError("the blocks of a %d-%d coupling do not have the declared widths" % (atom0, atom1))
+        return row
+
+
+# the row of each coupling type, as (block, atoms, ignored atoms)
+FEATURES1J = [("geometry1J", "ij", ""), ("charge", "i", ""), ("charge", "j", ""),
+              ("neighborcharges3", "j", "i"), ("cyclic", "j", ""),
+              ("G2", "ij", ""), ("G2", "ji", ""),   # exclude 1. & 2. lev. neighbors, project into ij plane
+              ("neighborcount", "j", "i"), ("neighbor2count", "j", ""), ("neighbordistances", "j", "i"),
+              ("neighborangles", "ij", ""), ("neighbortorsions", "ij", ""),
+              ("distances2nd", "j", ""), ("distances2nd", "i", ""), ("neighborcharges", "j", "i"),
+              ("closecharges3", "i", ""), ("closecharges3", "j", ""), ("closecharges5", "i", ""), ("closecharges5", "j", ""),
+              ("coulomb", "i", ""), ("coulomb", "j", "")]
+
+FEATURES2J = [("geometry2J", "ijX", ""), ("charge", "i", ""), ("charge", "j", ""), ("charge", "X", ""),
+              ("identity", "X", ""),
+              ("neighborcount", "X", "ij"), ("neighborcount", "j", "X"), ("neighbor2count", "j", ""),
+              ("neighbordistances", "j", "X"), ("neighbordistances", "X", "ij"),
+              ("neighborangles", "iX", ""), ("neighborangles", "jX", ""), ("neighbortorsions2", "iXj", ""),
+              ("neighborcharges3", "j", "X"), ("neighborcharges3", "X", "ij"), ("cyclic", "j", ""), ("cyclic", "X", ""),
+              ("G2", "iX", ""), ("G2", "jX", ""), ("G2", "Xi", ""),
+              ("closecharges3", "i", ""), ("closecharges3", "j", ""), ("closecharges3", "X", ""),
+              ("closecharges5", "i", ""), ("closecharges5", "j", ""), ("closecharges5", "X", ""),
+              ("distances2nd", "i", ""), ("distances2nd", "j", ""), ("distances2nd", "X", ""),
+              ("neighborcharges", "j", "X"), ("neighborcharges", "X", "ij")]
+
+FEATURES3J = [("identity", "X", ""), ("identity", "Y", ""), ("distances3J", "ijXY", ""),
+              ("charge", "i", ""), ("charge", "j", ""), ("charge", "X", ""), ("charge", "Y", ""),
+              ("angles3J", "ijXY", ""),
+              ("neighborcount", "j", "Y"), ("neighborcount", "X", "Yi"), ("neighborcount", "Y", "Xj"),
+              ("neighbordistances", "X", "iY"), ("neighbordistances", "Y", "Xj"), ("neighbordistances", "j", "Y"),
+              ("neighborangles", "iX", ""), ("neighborangles", "XY", ""), ("neighborangles", "Yj", ""),
+              ("neighbortorsions2", "XYj", ""), ("neighbortorsions2", "iXY", ""), ("neighbortorsions2", "jYX", ""),
+              ("neighborcharges3", "j", "Y"), ("neighborcharges3", "X", "iY"), ("neighborcharges3", "Y", "jX"),
+              ("cyclic", "j", ""), ("cyclic", "X", ""), ("cyclic", "Y", ""),
+              ("G2", "iX", ""), ("G2", "jY", ""), ("G2", "Xi", ""), ("G2", "Yj", ""),
+              ("closecharges3", "i", ""), ("closecharges3", "j", ""), ("closecharges3", "X", ""), ("closecharges3", "Y", ""),
+              ("closecharges5", "i", ""), ("closecharges5", "j", ""), ("closecharges5", "X", ""), ("closecharges5", "Y", ""),
+              ("distances2nd", "i", ""), ("distances2nd", "j", ""), ("distances2nd", "X", ""), ("distances2nd", "Y", ""),
+              ("neighborcharges", "j", "Y"), ("neighborcharges", "X", "iY"), ("neighborcharges", "Y", "Xj")]
+
+FEATURES2JHH = [("geometry2JHH", "ijX", ""), ("identity", "X", ""),
+                ("neighborcount", "X", "ij"), ("neighbordistances", "X", "ij"),
+                ("neighborminangles", "ijX", ""), ("neighbormaxangles", "ijX", ""),
+                ("charge", "i", ""), ("charge", "j", ""), ("charge", "X", ""),
+                ("neighborcharges3", "X", "ij"), ("cyclic", "X", ""),
+                ("G2", "iX", ""), ("G2", "jX", ""), ("G2", "Xi", ""),
+                ("closecharges3", "i", ""), ("closecharges3", "j", ""), ("closecharges3", "X", ""),
+                ("closecharges5", "i", ""), ("closecharges5", "j", ""), ("closecharges5", "X", ""),
+                ("distances2nd", "i", ""), ("distances2nd", "j", ""), ("distances2nd", "X", ""),
+                ("neighborcharges", "X", "ij")]
+
+FEATURES3JHH = [("distances3JHH", "ijXY", ""), ("angles3JHH", "ijXY", ""), ("identity2", "XY", ""),
+                ("neighborcount", "X", "Yi"), ("neighborcount", "Y", "Xj"),
+                ("neighbordistances", "X", "iY"), ("neighbordistances", "Y", "jX"),
+                ("charge", "i", ""), ("charge", "j", ""), ("charge", "X", ""), ("charge", "Y", ""),
+                ("neighborcharges3", "X", "iY"), ("neighborcharges3", "Y", "jX"), ("cyclic", "X", ""), ("cyclic", "Y", ""),
+                ("G2", "iX", ""), ("G2", "jY", ""), ("G2", "Xi", ""), ("G2", "Yj", ""),
+                ("closecharges3", "i", ""), ("closecharges3", "j", ""), ("closecharges3", "X", ""), ("closecharges3", "Y", ""),
+                ("closecharges5", "i", ""), ("closecharges5", "j", ""), ("closecharges5", "X", ""), ("closecharges5", "Y", ""),
+                ("distances2nd", "i", ""), ("distances2nd", "j", ""), ("distances2nd", "X", ""), ("distances2nd", "Y", ""),
+                ("neighborcharges", "X", "iY"), ("neighborcharges", "Y", "Xj")]
+
+COUPLINGTYPES = {
+    "1JHC": CouplingSpec(CouplingAtoms1J, {"i": "H", "j": "C"}, FEATURES1J),
+    "1JHN": CouplingSpec(CouplingAtoms1J, {"i": "H", "j": "N"}, FEATURES1J),
+    "2JHC": CouplingSpec(CouplingAtoms2J, {"i": "H", "j": "C", "X": "X"}, FEATURES2J),
+    "2JHN": CouplingSpec(CouplingAtoms2J, {"i": "H", "j": "N", "X": "X"}, FEATURES2J),
+    "3JHC": CouplingSpec(CouplingAtoms3J, {"i": "H", "j": "C", "X": "X", "Y": "Y"}, FEATURES3J),
+    "3JHN": CouplingSpec(CouplingAtoms3J, {"i": "H", "j": "N", "X": "X", "Y": "Y"}, FEATURES3J),
+    "2JHH": CouplingSpec(CouplingAtoms2JHH, {"i": "H1", "j": "H2", "X": "X"}, FEATURES2JHH),
+    "3JHH": CouplingSpec(CouplingAtoms3JHH, {"i": "H1", "j": "H2", "X": "X", "Y": "Y"}, FEATURES3JHH),
+}
+
+# all the coupling types (--types all), in the order of the per-type outputs
+ALLTYPES = ["1JHC", "1JHN", "2JHC", "2JHN", "2JHH", "3JHC", "3JHN", "3JHH"]
+
+# coupling types written unless --types says otherwise
+FEATURETYPES = ["1JHC", "1JHN"]
+
+# the columns before the features
+IDCOLUMNS = ["id", "atom_index_0", "atom_index_1", "type", "target"]
+
+
+def Fingerprint(value, seen=None):
+    ''' text standing for what value computes: for the functions (and classes) of molgeom
+    their code, constants and default arguments and, recursively, those of the functions
+    and the values of the module constants they use; for data its representation
+    '''
+    if seen is None:
+        seen = set()
+    if isinstance(value, (list, tuple)):
+        return "(" + ",".join([Fingerprint(v, seen) for v in value]) + ")"
+    if isinstance(value, ndarray):
+        return repr(value.tolist())
+    if hasattr(value, "__code__"):
+        return Fingerprint([value.__code__, value.__defaults__], seen)
+    if hasattr(value, "co_code"):
+        names = []
+        for name in value.co_names:
+            g = globals().get(name)
+            if g is None or name in seen:
+                continue
+            if getattr(g, "__module__", None) == __name__ and (hasattr(g, "__code__") or isinstance(g, type)):
+                seen.add(name)
+                names.append(name + "=" + Fingerprint(g, seen))
+            elif isinstance(g, (int, float, str, list, tuple, dict, ndarray)):
+                seen.add(name)
+                names.append(name + "=" + (repr(sorted(g.items())) if isinstance(g, dict) else Fingerprint(g, seen)))
+        consts = [Fingerprint(c, seen) if hasattr(c, "co_code") else repr(c) for c in value.co_consts]
+        return "code(%s;%s;%s)" % (md5(value.co_code).hexdigest(), ",".join(consts), ",".join(names))
+    if isinstance(value, type):
+        methods = [value.__dict__[n] for n in sorted(value.__dict__)]
+        methods = [m.fget if isinstance(m, property) else m for m in methods]
+        return value.__name__ + Fingerprint([m for m in methods if hasattr(m, "__code__")], seen)
+    return repr(value)
+
+
+class BlockCache(object):
+    ''' the blocks of the coupling rows of a molecule computed by earlier runs, kept in
+    directory in a file named by the hash of the molecule (coordinates, charges, symbols
+    and cell). Every block is stored under its key (see CouplingSpec.BlockKey) with the
+    atom pairs of the couplings and the values and kinds of its rows (see FeatureRow), so that changing a
+    descriptor, or a constant it uses, only invalidates the blocks of that descriptor.
+    The blocks of old keys are kept: remove the directory to reclaim the space.
+    '''
+    def __init__(self, directory, coordinates, at_symbols, pbc=None):
+        content = md5(coordinates.astype(float64).tobytes())
+        content.update(" ".join(at_symbols).encode("ascii"))
+        content.update(repr(pbc).encode("ascii"))
+        self.filename = path.join(directory, content.hexdigest()+".blocks.npz")
+        self.blocks = dict()
+        self.new = dict()
+        if path.isfile(self.filename):
+            data = load(self.filename)
+            for name in data.files:
+                if name.endswith(".ids"):
+                    key = name[:-4]
+                    ids = data[name]
+                    pairs = [tuple(pair) for pair in ids.tolist()]
+                    self.blocks[key] = (dict(zip(pairs, range(len(pairs)))), data[key+".values"], data[key+".kinds"])
+
+    def get(self, key, coupling):
+        ''' values and kinds of the block key of the coupling (atom pair), None if not there '''
+        if key in self.blocks and coupling in self.blocks[key][0]:
+            k = self.blocks[key][0][coupling]
+            return self.blocks[key][1][k], self.blocks[key][2][k]
+        if key in self.new and coupling in self.new[key]:
+            return self.new[key][coupling]
+        return None
+
+    def put(self, key, coupling, values, kinds):
+        if (kinds == 255).any(): # values whose text cannot be written again
+            return
+        self.new.setdefault(key, dict())[coupling] = (values.copy(), kinds.copy())
+
+    def save(self):
+        ''' write the file again if blocks were added (renamed in place, for the other processes) '''
+        if len(self.new) == 0:
+            return
+        arrays = dict()
+        for key in set(self.blocks) | set(self.new):
+            rows = dict()
+            if key in self.blocks:
+                index, values, kinds = self.blocks[key]
+                for coupling in index:
+                    rows[coupling] = (values[index[coupling]], kinds[index[coupling]])
+            rows.update(self.new.get(key, {}))
+            ids = sorted(rows)
+            arrays[key+".ids"] = array(ids, int64).reshape(-1, 2)
+            arrays[key+".values"] = array([rows[c][0] for c in ids], float64)
+            arrays[key+".kinds"] = array([rows[c][1] for c in ids], uint8)
+        temporary = "%s.%d.npz" % (self.filename[:-4], getpid())
+        savez_compressed(temporary, **arrays)
+        rename(temporary, self.filename)
+        self.new = dict()
+
+
+def write_schema(types, keep=None, stream=stdout):
+    ''' the columns of the rows of the coupling types, one per line: type, column
+    number (from 1, as cut and awk count them), block and name
+    '''
+    for t in types:
+        columns = [("id", c) for c in IDCOLUMNS] + COUPLINGTYPES[t].columns(keep)
+        for n, (block, name) in enumerate(columns):
+            stream.write("%s\t%d\t%s\t%s\n" % (t, n+1, block, name))
+
+
+class TextSink(object):
+    ''' write every coupling as one line of comma separated values
+    (ids first, every value followed by a comma), the original output of molgeom
+    '''
+    def __init__(self, stream=stdout):
+        self.stream = stream
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        self.stream.write(",".join([str(x) for x in ids] + row.text()) + ",\n")
+
+    def close(self):
+        self.stream.flush()
+
+
+def IdArrays(rows):
+    ''' the ids of the couplings as the arrays id, atom_index_0, atom_index_1, type
+    and target (NaN for the test set)
+    '''
+    target = [nan if ids[4] == "X" else ids[4] for ids in rows]
+    return dict(id = array([int(ids[0]) for ids in rows], int64),
+                atom_index_0 = array([ids[1] for ids in rows], int64),
+                atom_index_1 = array([ids[2] for ids in rows], int64),
+                type = array([ids[3] for ids in rows], str),
+                target = array(target, float64))
+
+
+class ArraySink(object):
+    ''' collect the features in a preallocated float32 array; arrays() returns them
+    as the arrays id, atom_index_0, atom_index_1, type, target (NaN for the test set)
+    and features (one row per coupling). All rows must have the same length.
+    '''
+    def __init__(self):
+        self.ids = []
+        self.features = None
+        self.nrows = 0
+        self.capacity = 0
+
+    def reserve(self, nrows):
+        ''' make space for nrows more rows (allocated when the row length is known) '''
+        self.capacity = max(self.capacity, self.nrows + nrows)
+
+    def write(self, ids, row):
+        if self.features is None:
+            self.features = zeros((max(self.capacity, 1), len(row)), float32)
+        if len(row) != self.features.shape[1]:
+            raise ValueError("coupling %s has %d features, expected %d" % (ids[0], len(row), self.features.shape[1]))
+        if self.nrows == len(self.features): # out of space, double it
+            self.features = concatenate([self.features, zeros(self.features.shape, float32)])
+        self.features[self.nrows] = row.values
+        self.ids.append(ids)
+        self.nrows += 1
+
+    def arrays(self):
+        width = 0
+        if self.features is not None:
+            width = self.features.shape[1]
+        arrays = IdArrays(self.ids)
+        arrays["features"] = zeros((0, width), float32) if self.features is None else self.features[:self.nrows]
+        return arrays
+
+    def close(self):
+        pass
+
+
+class NpzSink(object):
+    ''' save the arrays of ArraySink in the .npz file filename, as numpy.savez, without
+    keeping them in memory: the features are written to a temporary file every NPZSHARD
+    rows, and copied into the .npz file when closing
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.shard = None
+        self.ids = []
+        self.nrows = 0
+        self.width = None
+        self.features = None
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        if self.width is None:
+            self.width = len(row)
+        if len(row) != self.width:
+            raise ValueError("coupling %s has %d features, expected %d" % (ids[0], len(row), self.width))
+        if self.shard is None:
+            self.shard = ArraySink()
+            self.shard.reserve(NPZSHARD)
+        self.shard.write(ids, row)
+        if self.shard.nrows == NPZSHARD:
+            self.flush()
+
+    def flush(self):
+        ''' write the rows of the shard and start a new one '''
+        if self.shard is None:
+            return
+        arrays = self.shard.arrays()
+        if self.features is None:
+            self.features = open("%s.%d.features" % (self.filename, getpid()), 'wb')
+        self.features.write(arrays.pop("features").tobytes())
+        self.ids.append(arrays)
+        self.nrows += self.shard.nrows
+        self.shard = None
+
+    def close(self):
+        self.flush()
+        arrays = IdArrays([])
+        if self.ids:
+            arrays = dict([(key, concatenate([ids[key] for ids in self.ids])) for key in arrays])
+        archive = ZipFile(self.filename, 'w', ZIP_STORED, allowZip64=True)
+        for key in sorted(arrays):
+            data = BytesIO()
+            write_array(data, arrays[key])
+            archive.writestr(key + ".npy", data.getvalue())
+        # the header of the features, then their rows as written
+        temporary = "%s.%d.npy" % (self.filename, getpid())
+        stream = open(temporary, 'wb')
+        write_array_header_1_0(stream, dict(descr=dtype_to_descr(dtype(float32)), fortran_order=False,
+                                            shape=(self.nrows, self.width or 0)))
+        if self.features is not None:
+            self.features.close()
+            self.features = open(self.features.name, 'rb')
+            copyfileobj(self.features, stream)
+            self.features.close()
+            remove(self.features.name)
+            self.features = None
+        stream.close()
+        archive.write(temporary, "features.npy")
+        archive.close()
+        remove(temporary)
+
+
+def SparseColumns(row):
+    ''' columns of the FeatureRow which are not zero as printed (a value written 0.00
+    is a zero, as awk reads the text output)
+    '''
+    return [j for j in row.values.nonzero()[0].tolist() if float(row.string(j)) != 0]
+
+
+class SvmlightSink(object):
+    ''' write every coupling as one svmlight line: the target (0 for the test set),
+    the index:value pairs of its non-zero features (indices from 1, values printed
+    as in the text output) and, after a #, the ids of the coupling as in the text output
+    (the target X for the test set). The non-zero count of every feature over the train
+    rows is written into countfile when closing, one "index count" line per feature.
+    '''
+    def __init__(self, stream=stdout, countfile=None):
+        self.stream = stream
+        self.countfile = countfile
+        self.nonzero = zeros(0, int64)
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        columns = SparseColumns(row)
+        if len(self.nonzero) < len(row):
+            self.nonzero = concatenate([self.nonzero, zeros(len(row)-len(self.nonzero), int64)])
+        if ids[4] != "X":
+            self.nonzero[columns] += 1
+        label = "0" if ids[4] == "X" else str(ids[4])
+        self.stream.write(label + "".join([" %d:%s" % (j+1, row.string(j)) for j in columns]) +
+                          " # " + ",".join([str(x) for x in ids]) + "\n")
+
+    def close(self):
+        self.stream.flush()
+        if self.countfile is not None:
+            counts = open(self.countfile, 'w')
+            for j, n in enumerate(self.nonzero.tolist()):
+                counts.write("%d %d\n" % (j+1, n))
+            counts.close()
+
+
+class SparseArraySink(object):
+    ''' collect the non-zero features (see SparseColumns) in compressed sparse row form;
+    arrays() returns the id arrays of ArraySink with the features as the CSR arrays
+    data, indices, indptr and shape (scipy.sparse.csr_matrix((data, indices, indptr), shape))
+    and nonzero, the number of train rows in which every feature is not zero.
+    '''
+    def __init__(self):
+        self.ids = []
+        self.data = []
+        self.indices = []
+        self.indptr = [0]
+        self.nonzero = None
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        if self.nonzero is None:
+            self.nonzero = zeros(len(row), int64)
+        if len(row) != len(self.nonzero):
+            raise ValueError("coupling %s has %d features, expected %d" % (ids[0], len(row), len(self.nonzero)))
+        columns = SparseColumns(row)
+        if ids[4] != "X":
+            self.nonzero[columns] += 1
+        self.indices.append(array(columns, int32))
+        self.data.append(row.values[columns].astype(float32))
+        self.indptr.append(self.indptr[-1] + len(columns))
+        self.ids.append(ids)
+
+    def arrays(self):
+        arrays = IdArrays(self.ids)
+        nonzero = zeros(0, int64) if self.nonzero is None else self.nonzero
+        arrays.update(data = concatenate(self.data + [zeros(0, float32)]),
+                      indices = concatenate(self.indices + [zeros(0, int32)]),
+                      indptr = array(self.indptr, int64),
+                      shape = array([len(self.indptr) - 1, len(nonzero)], int64),
+                      nonzero = nonzero)
+        return arrays
+
+    def close(self):
+        pass
+
+
+class SparseNpzSink(SparseArraySink):
+    ''' collect the features as SparseArraySink and save the arrays with numpy.savez '''
+    def __init__(self, filename):
+        SparseArraySink.__init__(self)
+        self.filename = filename
+
+    def close(self):
+        savez(self.filename, **self.arrays())
+
+
+class RowBuffer(object):
+    ''' keep the rows of one structure, so that they reach the real sink
+    only once the whole structure has been processed
+    '''
+    def __init__(self):
+        self.rows = []
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        self.rows.append((ids, row))
+
+    def flush(self, sink):
+        sink.reserve(len(self.rows))
+        for ids, row in self.rows:
+            sink.write(ids, row)
+        self.rows = []
+
+
+class TypeSink(object):
+    ''' send the rows of every coupling type to a sink of its own, opened when the
+    first row of the type comes: the file pattern with {type} replaced by the type, an
+    NpzSink if it ends with .npz, a TextSink otherwise (SparseNpzSink and SvmlightSink
+    if sparse). With the sinks of a factory instead of a pattern (factory(type) returns
+    the sink) nothing is opened.
+    '''
+    def __init__(self, pattern=None, factory=None, sparse=False):
+        self.pattern = pattern
+        self.factory = factory
+        self.sparse = sparse
+        self.sinks = dict()
+        self.streams = []
+
+    def sink(self, kind):
+        if kind not in self.sinks:
+            if self.factory is not None:
+                self.sinks[kind] = self.factory(kind)
+            elif self.pattern.endswith(".npz"):
+                filename = self.pattern.replace("{type}", kind)
+                self.sinks[kind] = SparseNpzSink(filename) if self.sparse else NpzSink(filename)
+            else:
+                filename = self.pattern.replace("{type}", kind)
+                self.streams.append(open(filename, 'w'))
+                if self.sparse:
+                    self.sinks[kind] = SvmlightSink(self.streams[-1], filename+".nonzero")
+                else:
+                    self.sinks[kind] = TextSink(self.streams[-1])
+        return self.sinks[kind]
+
+    def reserve(self, nrows):
+        pass
+
+    def write(self, ids, row):
+        self.sink(ids[3]).write(ids, row)
+
+    def close(self):
+        for kind in self.sinks:
+            self.sinks[kind].close()
+        for stream in self.streams:
+            stream.close()
+
+
+def read_manifest(manifest):
+    ''' list of structure files to process in batch: either a glob pattern
+    or a file with one structure file per line (# comments)
+    '''
+    if len(set(manifest) & set("*?[")) > 0:
+        return sorted(glob(manifest))
+    file=safeopen(manifest,'r')
+    if file == None:
+        raise MolgeomError("Cannot find the manifest "+manifest)
+    files=[]
+    for line in file:
+        line=line.strip()
+        if len(line) > 0 and line[0] != "#":
+            files.append(line)
+    file.close()
+    return files
+
+
+def ChunkBySize(files, nchunks):
+    ''' split the list of structure files (keeping the order) into about nchunks
+    pieces of similar work, the work of a structure being estimated as the square
+    of its file size. No piece is longer than BATCHCHUNK files.
+    '''
+    cost = [path.getsize(f)**2 if path.isfile(f) else 1 for f in files]
+    target = sum(cost)/float(max(nchunks, 1))
+    chunks = []
+    work = 0
+    for f, c in zip(files, cost):
+        if len(chunks) == 0 or work >= target or len(chunks[-1]) >= BATCHCHUNK:
+            chunks.append([])
+            work = 0
+        chunks[-1].append(f)
+        work += c
+    return chunks
+
+
+def init_worker(couplingfiles, storedirectory):
+    ''' load the coupling table and open the structure store of the batch in a worker
+    process of run_batch, unless the worker inherited those of the main process
+    (see run_batch), as forked workers do; the others (spawn and forkserver start
+    methods) do not share its memory
+    '''
+    global couplingtable, structurestore
+    if couplingtable is None and couplingfiles is not None:
+        couplingtable = CouplingTable(couplingfiles)
+    if structurestore is None and storedirectory is not None:
+        structurestore = StructureStore(storedirectory)
+
+
+def process_chunk(task):
+    ''' features of a list of structures, for run_batch (also in worker processes).
+    Returns for each structure its rows, its error log lines and whether it failed
+    '''
+    files, fformat, pbc, topocache, types, blocks, blockcache = task
+    results = []
+    for infile in files:
+        errorlog.structure = infile
+        errorlog.messages = []
+        rows = RowBuffer()
+        failed = False
+        try:
+            run(infile,[],fformat,[],pbc,rows,couplingtable,structurestore,topocache,types,blocks,blockcache)
+        except Exception as e:
+            errorlog.write("%s: %s" % (type(e).__name__, e))
+            rows = RowBuffer()
+            failed = True
+        results.append((rows, errorlog.messages, failed))
+    errorlog.structure = None
+    errorlog.messages = None
+    return results
+
+
+def run_batch(files,fformat,pbc=None,sink=None,jobs=1,couplings=None,store=None,topocache=None,types=None,blocks=None,
+              blockcache=None):
+    ''' process many structures in one go, all the features end up in the same sink.
+    With jobs>1 the structures are shared among a pool of processes: they are cut in
+    small chunks of similar work, which the free workers pick up one after the other,
+    and the results are written in the order of the files.
+    A structure which fails is reported in the error log and skipped.
+    Returns the number of failed structures.
+    '''
+    global couplingtable, structurestore
+    if sink is None:
+        sink=TextSink()
+    couplingtable=couplings
+    structurestore=store
+    tasks=[(chunk,fformat,pbc,topocache,types,blocks,blockcache) for chunk in ChunkBySize(files, 16*jobs)]
+    pool=None
+    if jobs > 1:
+        pool=Pool(jobs, init_worker, (None if couplings is None else couplings.filenames,
+                                      None if store is None else store.directory))
+        results=pool.imap(process_chunk, tasks)
+    else:
+        results=(process_chunk(task) for task in tasks)
+
+    failed=0
+    for chunk in results:
+        for rows, messages, bad in chunk:
+            for line in messages:
+                errorlog.stream.write(line)
+            rows.flush(sink)
+            failed+=bad
+        errorlog.stream.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return failed
+
+
+def frame_reader(fformat):
+    ''' the function reading one frame of a file in the given format '''
+    if fformat.lower() == "arc":
+        return read_arc
+    elif fformat.lower() == "xyz":
+        return read_xyz
+    raise MolgeomError("Unknown format "+fformat)
+
+
+def frames(structfile, fformat, offsets=None):
+    ''' generator over the frames of a trajectory (or single structure) file in the
+    given format, yields the coordinates of one frame at a time: all the frames
+    one after the other, or those starting at the given byte offsets (see build_frame_index)
+    '''
+    read=frame_reader(fformat)
     offset=None
-    at1=array([0,0,0],float)
-    at2=array([0,0,0],float)
-    at3=array([0,0,0],float)
-    at4=array([0,0,0],float)
-    F_DISTS=None
-    F_ANGS=None
-    F_TORS=None
-
-    #main loop
-    while 1:
-        #get format file structure
-        if lower(fformat) == "arc":
-            retdata=read_arc(structfile,offset)
-        elif lower(fformat) == "xyz":
-            retdata=read_xyz(structfile,offset)
-            moments=read_moments(trainFile)
-        else:
-            pass
-                
+    while offsets is None:
+        retdata=read(structfile,offset)
         if retdata=="EOF":
+            return
+        offset=retdata[1]
+        yield retdata[0]
+    for offset in offsets:
+        yield read(structfile,int(offset))[0]
+
+
+def build_frame_index(infile, fformat):
+    ''' byte offset and number of atoms of every frame of a trajectory, found by
+    scanning it once (only the atom count of each frame is parsed). The index is
+    kept in the sidecar file infile.frames.npz and reused while the trajectory
+    keeps the same size, modification time and header lines of the first frame;
+    it is built again otherwise.
+    '''
+    extra=2 # lines of a frame besides the atoms: count and comment (xyz), count and title (arc)
+    if frame_reader(fformat) is read_arc:
+        extra=1
+    structfile=open(infile,'r')
+    header="".join([structfile.readline() for k in range(extra)])
+    structfile.seek(0)
+    indexfile=infile+".frames.npz"
+    size=path.getsize(infile)
+    mtime=path.getmtime(infile)
+    if path.isfile(indexfile):
+        data=load(indexfile)
+        if "mtime" in data.files and "header" in data.files and int(data["size"]) == size and \
+           float(data["mtime"]) == mtime and str(data["header"]) == header:
+            structfile.close()
+            return data["offsets"], data["natoms"]
+
+    offsets=[]
+    natoms=[]
+    while 1:
+        offset=structfile.tell()
+        line=structfile.readline()
+        if len(line)==0:
             break
-        else:
-            coordinates=retdata[0]  #always in 1st position if not EOF
-            offset=retdata[1]       #always in 2nd position if not EOF
-            at_symbols=retdata[2]
-
-        neighbors = [dict() for x in range(len(coordinates))]
-
-        # get all bonds
-        for i in range(len(coordinates)-1):
-            for j in range(i+1,len(coordinates)):
-                dd = getdist(coordinates[i],coordinates[j])
-                if dd < covalentR[at_symbols[i]]+covalentR[at_symbols[j]]:
-                        neighbors[i][j] = dd
-                        neighbors[j][i] = dd
-
-        #check cyclic
-        cyclic = dict()
-        for i in range(len(coordinates)):
-            if not at_symbols[i] == "H":
-                val = IsCyclic(i,i,i,dict(),neighbors,at_symbols)
-                if val:
-                    cyclic[i]=1
+        n=int(line.split()[0])
+        for k in range(n+extra-1):
+            structfile.readline()
+        offsets.append(offset)
+        natoms.append(n)
+    structfile.close()
+    offsets=array(offsets,int64)
+    natoms=array(natoms,int64)
+    savez(indexfile, offsets=offsets, natoms=natoms, size=size, mtime=mtime, header=header)
+    return offsets, natoms
 
-        '''
-        # Print all neighbors
-        for i in range(len(coordinates)):
-            for j in neighbors[i]:
-                print("BOND",i,j, at_symbols[i],at_symbols[j], len(neighbors[i])-1,len(neighbors[j])-1,neighbors[i][j])
-                #for k in neighbors[i]:
-                #    if k!=j:
-                #        print
 
-        # Print angles:
-        for i in range(len(coordinates)):
-            for j in neighbors[i]:
-                for k in neighbors[i]:
-                    if j!=k: print("ANGLE",j,i,k, at_symbols[j],at_symbols[i],at_symbols[k], getangle(coordinates[j],coordinates[i],coordinates[k]))
-        
-        #Print dihedrals
-        for i in range(len(coordinates)):
-            for j in neighbors[i]:
-                if i<j:  # get dihedrals for i-j bond
-                    for k in neighbors[i]:
-                        if k!=j:
-                            for l in neighbors[j]:
-                                if l!=i:
-                                    print("TORS",k,i,j,l, at_symbols[k],at_symbols[i],at_symbols[j],at_symbols[l],gettors(coordinates[k],coordinates[i],coordinates[j],coordinates[l]))
-        '''
+def select_frames(spec, nframes):
+    ''' frames (counted from 0) selected by spec "start:stop:step" or "frame", where the
+    frames are numbered from 1 as in the output files; stop is excluded and empty
+    fields stand for the first frame, after the last one and 1
+    '''
+    fields=[f.strip() for f in spec.split(":")]
+    try:
+        fields=[int(f) if len(f) > 0 else None for f in fields]
+    except ValueError:
+        raise MolgeomError("Cannot understand the frame selection "+spec)
+    if len(fields) == 1 and fields[0] is not None:
+        fields=[fields[0], fields[0]+1]
+    if len(fields) > 3 or min([f for f in fields if f is not None] or [1]) < 1:
+        raise MolgeomError("Cannot understand the frame selection "+spec)
+    start, stop, step=(fields+[None, None])[:3]
+    return list(range(nframes))[slice(None if start is None else start-1, None if stop is None else stop-1, step)]
+
+
+class TaskList(object):
+    ''' the distances, angles and torsions to measure along a trajectory, as read
+    by read_filedata or given by -d/-a/-t (atoms numbered from 1, torsions with
+    their periodicity). Every kind of task is measured all at once in a frame.
+    '''
+    def __init__(self, tasklist, pbc=None):
+        self.cell=None
+        if pbc is not None:
+            self.cell=PeriodicCell(pbc)
+        # atom indices (from 0) of every kind of task
+        self.indices=[None]*3
+        if tasklist[0] is not None:
+            self.indices[0]=array(tasklist[0],int)[:,:2]-1
+        if tasklist[1] is not None:
+            self.indices[1]=array(tasklist[1],int)[:,:3]-1
+        if tasklist[2] is not None:
+            self.indices[2]=array(tasklist[2],int)[:,:4]-1
+            self.periods=array(tasklist[2],int)[:,4]
+
+    def header(self, k):
+        return "# frame "+" ".join(["-".join([str(a+1) for a in task]) for task in self.indices[k]])+"\n"
+
+    def measure(self, k, coordinates):
+        indices=self.indices[k]
+        if len(indices) > 0 and (indices.max() >= len(coordinates) or indices.min() < 0):
+            raise MolgeomError("atoms of the tasks must be between 1 and %d" % len(coordinates))
+        if k == 0:
+            return getdists(coordinates,indices,self.cell)
+        elif k == 1:
+            return getangles(coordinates,indices,self.cell)
+        return getdihs(coordinates,indices,self.periods,self.cell)
+
+    def lines(self, frame, coordinates):
+        ''' the output line of every kind of task for a frame (numbered from 1), None for no tasks '''
+        lines=[None]*3
+        for k in range(3):
+            if self.indices[k] is not None:
+                lines[k]="%d" % frame + "".join(["%12.4f" % v for v in self.measure(k, coordinates)]) + "\n"
+        return lines
+
+
+def measure_frames(task):
+    ''' output lines of some frames of a trajectory, for run_tasks (also in worker processes) '''
+    infile, fformat, offsets, numbers, tasks = task
+    structfile=open(infile,'r')
+    lines=[tasks.lines(frame, coordinates) for frame, coordinates in zip(numbers, frames(structfile, fformat, offsets))]
+    structfile.close()
+    return lines
+
+
+def run_tasks(infile,tasklist,fformat,outfiles,pbc=None,selection=None,jobs=1):
+    ''' measure the distances, angles and torsions of the tasklist (see TaskList)
+    along the trajectory, one frame at a time. Each file of outfiles gets one line
+    per frame: the frame number and the measures in the order of the tasks. Old files
+    are backed up (see backup_file).
+    With a selection of frames ("start:stop:step", see select_frames) or jobs>1 the
+    frames are found through the frame index (build_frame_index); with jobs>1 they are
+    shared among a pool of processes, the lines are written in the order of the frames.
+    Returns the number of frames.
+    '''
+    structfile=safeopen(infile,'r')
+    if structfile == None:
+        raise MolgeomError("Whooooaaaa! Cannot file "+infile+"... I'm out of here")
+    tasks=TaskList(tasklist,pbc)
+
+    outstreams=[None]*3
+    for k in range(3):
+        if tasks.indices[k] is not None:
+            backup_file(outfiles[k])
+            outstreams[k]=open(outfiles[k],'w')
+            outstreams[k].write(tasks.header(k))
+
+    pool=None
+    if selection is None and jobs <= 1:
+        results=[(tasks.lines(frame, coordinates) for frame, coordinates in enumerate(frames(structfile, fformat), 1))]
+    else:
+        offsets, natoms=build_frame_index(infile, fformat)
+        selected=select_frames(selection or ":", len(offsets))
+        size=max(1, min(BATCHCHUNK, len(selected)//(16*jobs)))
+        chunks=[(infile, fformat, offsets[selected[k:k+size]], [n+1 for n in selected[k:k+size]], tasks)
+                for k in range(0, len(selected), size)]
+        if jobs > 1:
+            pool=Pool(jobs)
+            results=pool.imap(measure_frames, chunks)
+        else:
+            results=(measure_frames(chunk) for chunk in chunks)
+
+    nframes=0
+    for lines in results:
+        for frame in lines:
+            for k in range(3):
+                if frame[k] is not None:
+                    outstreams[k].write(frame[k])
+            nframes+=1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for stream in outstreams:
+        if stream is not None:
+            stream.close()
+    structfile.close()
+    return nframes
+
 
-        # start building features
-        for m in sorted(moments):
-            # 1JHC and 1JHN features
-            if moments[m][2]=="1JHC" or moments[m][2]=="1JHN":
-                i=moments[m][0]  #H
-                j=moments[m][1]
-                #print("III",m,moments[m])
-                print(m,moments[m][0],moments[m][1],moments[m][2],moments[m][3],sep=',',end=",")  # IDs from the input
-                # let i be always the H atom
-                if at_symbols[j]=="H":
-                    i=moments[m][1]
-                    j=moments[m][0]
-
-                print(neighbors[i][j],end=",")   # distance |ij|
-                print(coordinates[i][3],coordinates[j][3],sep=",",end=",")  # charges of i and j
-
-                GetMinMaxMeanNeighborsCharges(j, {i}, coordinates, neighbors)
-
-                print(IsAtomCyclic(j, cyclic), CountCyclicNeighbors(j, neighbors, cyclic), sep=",", end=",")
-
-                GetG2descriptorB(i, j, at_symbols, coordinates, neighbors) # exclude 1. & 2. lev. neighbors, project into ij plane
-                GetG2descriptorB(j, i, at_symbols, coordinates, neighbors)
-
-                GetNeighborsCount(j,at_symbols, neighbors, {i}) # how many neighbors (of each type) j has
-                Get2ndLevelNeighborsCount(j, at_symbols, neighbors) # how many 2nd level neighbors (of each type) j has
-                GetNeighborsDistances(j, {i}, at_symbols, coordinates, neighbors) # distances between j and its neighbours (excluding i)
-                GetNeighborsAngles(i,j,at_symbols, coordinates, neighbors)  # angles ijX
-                GetNeighborsTorsions(i,j,at_symbols, coordinates, neighbors) # torsions ijXY
-                Get2ndLevelDistances(j, at_symbols, coordinates, neighbors)  # distances between j and its 2nd level neighbors
-                Get2ndLevelDistances(i, at_symbols, coordinates, neighbors)  # distances between i and its 2nd level neighbors
-                GetNeighborsCharges(j, {i}, at_symbols, coordinates, neighbors) # get charges of neighbors of N/C
-                #Get2ndLevelNeighborsCharges(j, at_symbols, coordinates, neighbors) # get charges of 2nd level neighbors of N/C
-                GetChargeArrayOfCloseAtoms3(i, at_symbols, coordinates, neighbors) #H
-                GetChargeArrayOfCloseAtoms3(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(i, at_symbols, coordinates, neighbors) #H
-                GetChargeArrayOfCloseAtoms5(j, at_symbols, coordinates, neighbors)
-
-                GetCoulombMatrixRow(i, coordinates, neighbors)
-                GetCoulombMatrixRow(j, coordinates, neighbors)
-                print("")
-
-            '''''
-            #2JHC  and 2JHN features...
-            if moments[m][2]=="2JHC" or moments[m][2]=="2JHN":
-                i=moments[m][0]
-                j=moments[m][1]
-
-                print(m,moments[m][0],moments[m][1],moments[m][2],moments[m][3],sep=',',end=",") # IDs from the input
-                if at_symbols[j]=="H":
-                    i=moments[m][1]  # H
-                    j=moments[m][0]  # C or N
-
-                X = next(iter(neighbors[i])) # the only bonded atom to H
-                print(neighbors[i][X], neighbors[j][X], getdist(coordinates[i],coordinates[j]), # distances and the angle
-                      getangle(coordinates[i], coordinates[X], coordinates[j]), sep=',',end=",")
-
-                print(coordinates[i][3], coordinates[j][3], coordinates[X][3], sep=",", end=",")  # charges of i, j, and X
-
-                GetIdentity(at_symbols[X])
-                GetNeighborsCount(X, at_symbols, neighbors, {i,j}) # get X neighbors
-                GetNeighborsCount(j, at_symbols, neighbors, {X}) # get C neighbors
-                Get2ndLevelNeighborsCount(j, at_symbols, neighbors)  # get C 2nd level neighbors counts
-                GetNeighborsDistances(j, {X}, at_symbols, coordinates, neighbors)
-                GetNeighborsDistances(X, {i,j}, at_symbols, coordinates, neighbors)
-                GetNeighborsAngles(i,X,at_symbols, coordinates, neighbors)
-                GetNeighborsAngles(j,X,at_symbols, coordinates, neighbors)
-                GetNeighborsTorsions2(i,X,j,at_symbols, coordinates, neighbors)
-
-                GetMinMaxMeanNeighborsCharges(j, {X}, coordinates, neighbors)
-                GetMinMaxMeanNeighborsCharges(X, {i,j}, coordinates, neighbors)
-
-                print(IsAtomCyclic(j, cyclic), CountCyclicNeighbors(j, neighbors, cyclic), sep=",", end=",")
-                print(IsAtomCyclic(X, cyclic), CountCyclicNeighbors(X, neighbors, cyclic), sep=",", end=",")
-
-                GetG2descriptorB(i, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(j, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(X, i, at_symbols, coordinates, neighbors)
-
-                GetChargeArrayOfCloseAtoms3(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(X, at_symbols, coordinates, neighbors)
-
-                Get2ndLevelDistances(i, at_symbols, coordinates, neighbors)  # distances between H and its 2nd level neighbors
-                Get2ndLevelDistances(j, at_symbols, coordinates, neighbors)  # distances between C/N and its 2nd level neighbors
-                Get2ndLevelDistances(X, at_symbols, coordinates, neighbors)  # distances between X and its 2nd level neighbors
-
-                GetNeighborsCharges(j, {X}, at_symbols, coordinates, neighbors) # get charges of neighbors of N/C
-                GetNeighborsCharges(X, {i,j}, at_symbols, coordinates, neighbors)  # get charges of neighbors of X
-
-
-            #3JHC  and 3JHN features...
-            if moments[m][2]=="3JHC" or moments[m][2]=="3JHN":
-                i=moments[m][0]
-                j=moments[m][1]
-                print(m,moments[m][0],moments[m][1],moments[m][2],moments[m][3],sep=',',end=",") # IDs from the input
-                if at_symbols[j]=="H":
-                    i=moments[m][1]  # H
-                    j=moments[m][0]  # C or N
-                X = next(iter(neighbors[i]))
-
-                Y = None
-                for y in neighbors[X]:
-                    if y in neighbors[j]:
-                        Y = y
-                if Y == None:
-                    print("Error, Y not found in "+infile,file=stderr)
-                    exit(10)
-
-                GetIdentity(at_symbols[X])
-                GetIdentity(at_symbols[Y])
-                print(neighbors[i][X], neighbors[X][Y], neighbors[Y][j],
-                      getdist(coordinates[i],coordinates[Y]),
-                      getdist(coordinates[j],coordinates[X]),
-                      getdist(coordinates[i],coordinates[j]), sep=',',end=",")  # distances between iX, XY, Yj, iY, jX, ij
-
-                print(coordinates[i][3], coordinates[j][3], coordinates[X][3], coordinates[Y][3], sep=",", end=",")  # charges of i, j, X, and Y
-
-                print(getangle(coordinates[i], coordinates[X], coordinates[Y]),
-                      getangle(coordinates[X], coordinates[Y], coordinates[j]),
-                      abs(gettors(coordinates[i], coordinates[X], coordinates[Y], coordinates[j])), sep=',',end=",") # angles and torsion
-
-                GetNeighborsCount(j, at_symbols, neighbors, ignore = {Y}) # get C neighbors)
-                GetNeighborsCount(X, at_symbols, neighbors, ignore={Y,i}) # get X neighbors
-                GetNeighborsCount(Y, at_symbols, neighbors, {X,j}) # get Y neighbors
-
-                GetNeighborsDistances(X, {i, Y}, at_symbols, coordinates, neighbors)  # distances from X
-                GetNeighborsDistances(Y, {X, j}, at_symbols, coordinates, neighbors)  # distances from Y
-                GetNeighborsDistances(j, {Y}, at_symbols, coordinates, neighbors)  # distances from j
-
-                GetNeighborsAngles(i,X,at_symbols, coordinates, neighbors)
-                GetNeighborsAngles(X,Y,at_symbols, coordinates, neighbors)
-                GetNeighborsAngles(Y,j,at_symbols, coordinates, neighbors)
-                GetNeighborsTorsions2(X,Y,j,at_symbols, coordinates, neighbors)
-                GetNeighborsTorsions2(i,X,Y,at_symbols, coordinates, neighbors)
-                GetNeighborsTorsions2(j,Y,X,at_symbols, coordinates, neighbors)
-
-                GetMinMaxMeanNeighborsCharges(j, {Y}, coordinates, neighbors)
-                GetMinMaxMeanNeighborsCharges(X, {i, Y}, coordinates, neighbors)
-                GetMinMaxMeanNeighborsCharges(Y, {j, X}, coordinates, neighbors)
-
-                print(IsAtomCyclic(j, cyclic), CountCyclicNeighbors(j, neighbors, cyclic), sep=",", end=",")
-                print(IsAtomCyclic(X, cyclic), CountCyclicNeighbors(X, neighbors, cyclic), sep=",", end=",")
-                print(IsAtomCyclic(Y, cyclic), CountCyclicNeighbors(Y, neighbors, cyclic), sep=",", end=",")
-
-                GetG2descriptorB(i, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(j, Y, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(X, i, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(Y, j, at_symbols, coordinates, neighbors)
-
-                GetChargeArrayOfCloseAtoms3(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(Y, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(Y, at_symbols, coordinates, neighbors)
-
-                Get2ndLevelDistances(i, at_symbols, coordinates,
-                                     neighbors)  # distances between i and its 2nd level neighbors
-                Get2ndLevelDistances(j, at_symbols, coordinates,
-                                     neighbors)  # distances between j and its 2nd level neighbors
-                Get2ndLevelDistances(X, at_symbols, coordinates,
-                                     neighbors)  # distances between X and its 2nd level neighbors
-                Get2ndLevelDistances(Y, at_symbols, coordinates,
-                                     neighbors)  # distances between Y and its 2nd level neighbors
-
-                GetNeighborsCharges(j, {Y}, at_symbols, coordinates, neighbors) # get charges of neighbors of N/C
-                GetNeighborsCharges(X, {i,Y}, at_symbols, coordinates, neighbors)  # get charges of neighbors of X
-                GetNeighborsCharges(Y, {X,j}, at_symbols, coordinates, neighbors)  # get charges of neighbors of Y
-
-            #2JHH features
-            if moments[m][2]=="2JHH":
-                i=moments[m][0]
-                j=moments[m][1]
-
-                # symmetry is broken by charge  i is the Hydrogen atom with smaller mulliken charge
-                ci = coordinates[i][3] # charge of i
-                cj = coordinates[j][3] # charge of j
-                if ci>cj:
-                    kk = i
-                    i = j
-                    j = kk
-
-                print(m,moments[m][0],moments[m][1],moments[m][2],moments[m][3],sep=',',end=",")  # get IDs from the input
-                X = next(iter(neighbors[i]))
-                print(min(neighbors[i][X], neighbors[j][X]), max(neighbors[i][X], neighbors[j][X]), getdist(coordinates[i],coordinates[j]), getangle(coordinates[i], coordinates[X], coordinates[j]),sep=',',end=",")
-                GetIdentity(at_symbols[X])
-                GetNeighborsCount(X, at_symbols, neighbors, {i,j}) # get X neighbors
-                GetNeighborsDistances(X, {i,j}, at_symbols, coordinates, neighbors)
-                GetNeighborsMinAngles(i,j,X,at_symbols, coordinates, neighbors)
-                GetNeighborsMaxAngles(i,j,X,at_symbols, coordinates, neighbors)  # experiment with replacing for normal angles (instead of min/max)
-
-                print(coordinates[i][3], coordinates[j][3], coordinates[X][3], sep=",", end=",")  # charges of i, j, and X
-
-                GetMinMaxMeanNeighborsCharges(X, {i, j}, coordinates, neighbors)
-
-                print(IsAtomCyclic(X, cyclic), CountCyclicNeighbors(X, neighbors, cyclic), sep=",", end=",")
-
-                GetG2descriptorB(i, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(j, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(X, i, at_symbols, coordinates, neighbors)
-
-                GetChargeArrayOfCloseAtoms3(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(X, at_symbols, coordinates, neighbors)
-
-                Get2ndLevelDistances(i, at_symbols, coordinates,
-                                     neighbors)  # distances between i and its 2nd level neighbors
-                Get2ndLevelDistances(j, at_symbols, coordinates,
-                                     neighbors)  # distances between j and its 2nd level neighbors
-                Get2ndLevelDistances(X, at_symbols, coordinates,
-                                     neighbors)  # distances between X and its 2nd level neighbors
-
-                GetNeighborsCharges(X, {i,j}, at_symbols, coordinates, neighbors)  # get charges of neighbors of X
-
-            #3JHH features
-            if moments[m][2]=="3JHH":
-                i=moments[m][0]
-                j=moments[m][1]
-
-                # symmetry is broken by charge  i is the Hydrogen atom with smaller mulliken charge
-                ci = coordinates[i][3]  # charge of i
-                cj = coordinates[j][3]  # charge of j
-                if ci > cj:
-                    kk = i
-                    i = j
-                    j = kk
-
-                print(m,moments[m][0],moments[m][1],moments[m][2],moments[m][3],sep=',',end=",") # IDs from the input
-                X = next(iter(neighbors[i]))
-                Y = next(iter(neighbors[j]))
-                a1 = getdist(coordinates[X],coordinates[j])
-                a2 = getdist(coordinates[Y],coordinates[i])
-                ang1 = getangle(coordinates[i], coordinates[X], coordinates[Y])
-                ang2 = getangle(coordinates[j], coordinates[Y], coordinates[X])
-                print(min(neighbors[i][X], neighbors[j][Y]), max(neighbors[i][X], neighbors[j][Y]), min(a1,a2), max(a1,a2), getdist(coordinates[i],coordinates[j]), getdist(coordinates[X],coordinates[Y]),sep=',',end=",")
-                print(min(ang1, ang2), max(ang1, ang2), abs(gettors(coordinates[i], coordinates[X], coordinates[Y], coordinates[j])),sep=',',end=",")
-                GetIdentity(at_symbols[X], at_symbols[Y])
-                GetNeighborsCount(X, at_symbols, neighbors, {Y, i}) # get X neighbors
-                GetNeighborsCount(Y, at_symbols, neighbors, {X, j}) # get Y neighbors
-
-                GetNeighborsDistances(X, {i, Y}, at_symbols, coordinates, neighbors)
-                GetNeighborsDistances(Y, {j, X}, at_symbols, coordinates, neighbors)
-
-                print(coordinates[i][3], coordinates[j][3], coordinates[X][3], coordinates[Y][3], sep=",", end=",")  # charges of i, j, X, and Y
-
-                #TODO: possibly missing some angle and torsion features
-
-
-                GetMinMaxMeanNeighborsCharges(X, {i, Y}, coordinates, neighbors)
-                GetMinMaxMeanNeighborsCharges(Y, {j, X}, coordinates, neighbors)
-
-                print(IsAtomCyclic(X, cyclic), CountCyclicNeighbors(X, neighbors, cyclic), sep=",", end=",")
-                print(IsAtomCyclic(Y, cyclic), CountCyclicNeighbors(Y, neighbors, cyclic), sep=",", end=",")
-
-                GetG2descriptorB(i, X, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(j, Y, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(X, i, at_symbols, coordinates, neighbors)
-                GetG2descriptorB(Y, j, at_symbols, coordinates, neighbors)
-
-                GetChargeArrayOfCloseAtoms3(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms3(Y, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(i, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(j, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(X, at_symbols, coordinates, neighbors)
-                GetChargeArrayOfCloseAtoms5(Y, at_symbols, coordinates, neighbors)
-
-                Get2ndLevelDistances(i, at_symbols, coordinates,
-                                     neighbors)  # distances between i and its 2nd level neighbors
-                Get2ndLevelDistances(j, at_symbols, coordinates,
-                                     neighbors)  # distances between j and its 2nd level neighbors
-                Get2ndLevelDistances(X, at_symbols, coordinates,
-                                     neighbors)  # distances between X and its 2nd level neighbors
-                Get2ndLevelDistances(Y, at_symbols, coordinates,
-                                     neighbors)  # distances between X and its 2nd level neighbors
-
-                GetNeighborsCharges(X, {i,Y}, at_symbols, coordinates, neighbors)  # get charges of neighbors of X
-                GetNeighborsCharges(Y, {X,j}, at_symbols, coordinates, neighbors)  # get charges of neighbors of Y
-                '''
-            #print("")
-
-        break   # read only 1st structure
+def load_structure(infile, fformat="xyz", store=None):
+    ''' coordinates (x,y,z and Mulliken charge for xyz files) and atomic symbols of
+    the (first) structure of infile, or of the molecule named as infile in the StructureStore
+    '''
+    if store is not None:
+        retdata=store.read(path.splitext(path.basename(infile))[0])
+        return retdata[0], retdata[2]
+    structfile=safeopen(infile,'r')
+    if structfile == None: #if file not found, give up on this structure
+        raise MolgeomError("Whooooaaaa! Cannot file "+infile+"... I'm out of here")
+    retdata=frame_reader(fformat)(structfile)
     structfile.close()
+    if retdata=="EOF":
+        raise MolgeomError("No structure in "+infile)
+    return retdata[0], retdata[2]
+
+
+def cell_list(coordinates, pbc=None):
+    ''' large and periodic systems go through the cell list (largest cutoff used is 5A),
+    None for small molecules '''
+    if pbc is not None or len(coordinates) > GRIDATOMS:
+        return CellList(coordinates, 5.0, pbc)
+    return None
+
+
+def perceive_bonds(coordinates, at_symbols, pbc=None):
+    ''' bonds, rings and topological distances of a structure (see Topology) '''
+    return Topology(coordinates, at_symbols, cell_list(coordinates, pbc))
+
+
+def write_features(coordinates, at_symbols, moments, sink, pbc=None, topology=None, types=None, blocks=None, blockcache=None):
+    ''' features of the couplings moments (see read_moments) of a structure,
+    written to sink one FeatureRow per coupling, in the order of the coupling ids.
+    Only the couplings of the given types are written (FEATURETYPES if None), their rows
+    made of the FEATURES blocks given (all if None), as declared in COUPLINGTYPES; all the
+    types are done in the same pass, sharing the descriptors of the atoms (see TypeSink to
+    keep them apart). A coupling whose atoms cannot be found is reported and skipped.
+    The topology is perceived if not given (and needed).
+    With the directory blockcache the blocks computed before for the same molecule are
+    reused, and the new ones saved there (see BlockCache).
+    '''
+    if types is None:
+        types = FEATURETYPES
+    context = FeatureContext(coordinates, at_symbols, topology, pbc)
+    cache = None
+    if blockcache is not None:
+        cache = BlockCache(blockcache, coordinates, at_symbols, pbc)
+
+    sink.reserve(len(moments))
+    for m in sorted(moments):
+        atom0, atom1, kind, target = moments[m]
+        if kind in types:
+            ids = (m, atom0, atom1, kind, target)  # IDs from the input
+            try:
+                row = COUPLINGTYPES[kind].row(context, atom0, atom1, blocks, cache)
+            except MolgeomError as e:
+                # the other couplings of the structure are still good
+                errorlog.write("coupling %s (%s): %s" % (m, kind, e))
+                continue
+            sink.write(ids, row)
+    if cache is not None:
+        cache.save()
+
+
+def compute_features(coordinates, at_symbols, moments, pbc=None, topology=None, types=None, blocks=None):
+    ''' features of the couplings moments (see read_moments, CouplingTable.moments) of
+    a structure, returned as the arrays written by --npz (see ArraySink).
+    types and blocks select the couplings and the features as in write_features.
+    '''
+    sink = ArraySink()
+    write_features(coordinates, at_symbols, moments, sink, pbc, topology, types, blocks)
+    return sink.arrays()
+
+
+def compute_features_by_type(coordinates, at_symbols, moments, pbc=None, topology=None, types=ALLTYPES, blocks=None):
+    ''' same as compute_features for several coupling types at once, returns the arrays
+    of each type found in moments (type -> arrays)
+    '''
+    sinks = dict()
+    def factory(kind):
+        sinks[kind] = ArraySink()
+        return sinks[kind]
+    write_features(coordinates, at_symbols, moments, TypeSink(factory=factory), pbc, topology, types, blocks)
+    return dict([(kind, sinks[kind].arrays()) for kind in sinks])
+
+
+def run(infile,tasklist,fformat,outfiles,pbc=None,sink=None,couplings=None,store=None,topocache=None,types=None,blocks=None,
+        blockcache=None):
+    ''' features of the couplings of one structure. The couplings come from the
+    CouplingTable if given, otherwise from the infile.train file. The structure
+    comes from the StructureStore if given (looked up by molecule name), otherwise from infile.
+    The Topology of the molecule is kept in the directory topocache, if given.
+    types and blocks select the couplings and the features, the feature blocks are kept
+    in the directory blockcache, if given (see write_features).
+    '''
+    if sink is None:
+        sink=TextSink()
+    molecule=path.splitext(path.basename(infile))[0]
+    if store is None and not path.isfile(infile):
+        raise MolgeomError("Whooooaaaa! Cannot file "+infile+"... I'm out of here")
+    if couplings is None:
+        trainFile=safeopen(infile+".train",'r')
+        if trainFile == None: #if file not found, give up on this structure
+            raise MolgeomError("Whooooaaaa! Cannot file "+infile+".train ... I'm out of here")
+        moments=read_moments(trainFile)
+    else:
+        moments=couplings.moments(molecule)
+    coordinates, at_symbols = load_structure(infile, fformat, store)
+
+    # bonds, rings and topological distances, possibly from the cache
+    topology = None
+    if topocache is not None:
+        topofile = path.join(topocache, molecule+".topo.npz")
+        topology = Topology.load(topofile, coordinates, at_symbols, pbc)
+        if topology is None:
+            topology = perceive_bonds(coordinates, at_symbols, pbc)
+            topology.save(topofile)
+    write_features(coordinates, at_symbols, moments, sink, pbc, topology, types, blocks, blockcache)
     return
 
 def main():
@@ -1663,8 +3094,52 @@ def main():
             outfiles.append(None)
             outfiles.append('torscml.dat')
     
+    if options.pertype:
+        sink=TypeSink(options.pertype,sparse=options.sparse)
+    elif options.npz and options.sparse:
+        sink=SparseNpzSink(options.npz)
+    elif options.npz:
+        sink=NpzSink(options.npz)
+    elif options.sparse:
+        sink=SvmlightSink(countfile=options.nonzero)
+    else:
+        sink=TextSink()
+
+    if options.errorlog:
+        errorlog.stream=open(options.errorlog,'w')
+
     # run calculation
-    run(infile,tasklist,fformat,outfiles,pbc)
+    try:
+        if options.buildstore:
+            build_store(read_manifest(infile),options.buildstore)
+            return
+        couplings=None
+        if options.couplings:
+            couplings=CouplingTable(options.couplings)
+        store=None
+        if options.store:
+            store=StructureStore(options.store)
+        if options.topocache and not path.isdir(options.topocache):
+            makedirs(options.topocache)
+        if options.blockcache and not path.isdir(options.blockcache):
+            makedirs(options.blockcache)
+        if options.batch:
+            files=read_manifest(infile)
+            failed=run_batch(files,fformat,pbc,sink,options.jobs,couplings,store,options.topocache,
+                             options.types,options.blocks,options.blockcache)
+            if failed > 0 and failed == len(files):
+                errorlog.structure=infile
+                raise MolgeomError("none of the %d structures could be processed" % failed)
+        elif len(tasklist) > 0:
+            run_tasks(infile,tasklist,fformat,outfiles,pbc,options.frames,options.jobs)
+        else:
+            errorlog.structure=infile
+            run(infile,tasklist,fformat,outfiles,pbc,sink,couplings,store,options.topocache,
+                options.types,options.blocks,options.blockcache)
+    except MolgeomError as e:
+        errorlog.write(e)
+        exit(10)
+    sink.close()
     return
 
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+'''
+Turn the feature rows written by molgeom (comma separated: id, atom_index_0,
+atom_index_1, type, target or X for the test set, features; or the svmlight lines
+of molgeom --sparse, with these ids after a #) into the svmlight
+files the models are trained on, OUTDIR/TYPE.data.train and OUTDIR/TYPE.data.test:
+    - the rows are split by coupling type and into train and test set
+    - only the features which are not zero in more than MINSUPPORT train rows of
+      the type are kept, numbered from 1 in the order of the columns
+    - the label is the target (0 for the test set)
+and the non-zero count of every column over the train rows into TYPE.xxx
+("column count" lines, columns numbered from 1, count empty if 0), as the awk
+of postprocess_data.sh wrote it.
+
+The input files are read only once: the non-zero features of every row go into
+binary files (column indices and float64 values, per type and set) in a temporary
+directory while the columns are counted, then the svmlight files are written
+from those. Only BUFFERROWS rows per type and set are kept in memory.
+'''
+
+from __future__ import print_function
+from sys import argv, exit, stderr
+from os import path, makedirs, remove, rmdir
+from tempfile import mkdtemp
+try:
+    from optparse import OptionParser as OP
+except:
+    print("Optparse not installed or not in python path. I give up...")
+    exit(10)
+try:
+    from numpy import array, zeros, concatenate, float64, int32, int64, fromfile, cumsum
+except:
+    print("Numpy not installed or not in python path. I give up...")
+    exit(10)
+
+IDFIELDS=5        # id, atom_index_0, atom_index_1, type, target
+MINSUPPORT=100    # a feature is kept if it is not zero in more than this many train rows
+BUFFERROWS=10000  # rows of a type and set kept in memory before they are written out
+SETS=["train", "test"]
+
+
+def nonzero(text):
+    ''' whether the field is not zero for awk: a number different from 0 or a text '''
+    try:
+        return float(text) != 0
+    except ValueError:
+        return True
+
+
+class SpillFile(object):
+    ''' the non-zero features of the rows of one type and set, kept in the files
+    base.len (number of non-zero features of every row, int32), base.idx (their
+    columns, int32), base.val (their values, float64) and base.lab (the labels, float64)
+    '''
+    def __init__(self, base):
+        self.base = base
+        self.lengths = []
+        self.indices = []
+        self.values = []
+        self.labels = []
+        self.nrows = 0
+        for ext in ["len", "idx", "val", "lab"]:
+            open(base+"."+ext, 'wb').close()
+
+    def append(self, label, indices, values):
+        self.lengths.append(len(indices))
+        self.indices.append(indices)
+        self.values.append(values)
+        self.labels.append(label)
+        self.nrows += 1
+        if len(self.lengths) == BUFFERROWS:
+            self.flush()
+
+    def flush(self):
+        if len(self.lengths) == 0:
+            return
+        for ext, data in [("len", array(self.lengths, int32)),
+                          ("idx", concatenate(self.indices).astype(int32)),
+                          ("val", concatenate(self.values).astype(float64)),
+                          ("lab", array(self.labels, float64))]:
+            stream = open(self.base+"."+ext, 'ab')
+            data.tofile(stream)
+            stream.close()
+        self.lengths, self.indices, self.values, self.labels = [], [], [], []
+
+    def rows(self):
+        ''' the rows (label, columns, values) as they were appended, BUFFERROWS at a time '''
+        self.flush()
+        streams = dict([(ext, open(self.base+"."+ext, 'rb')) for ext in ["len", "idx", "val", "lab"]])
+        done = 0
+        while done < self.nrows:
+            lengths = fromfile(streams["len"], int32, BUFFERROWS)
+            labels = fromfile(streams["lab"], float64, len(lengths))
+            indices = fromfile(streams["idx"], int32, int(lengths.sum()))
+            values = fromfile(streams["val"], float64, len(indices))
+            ends = cumsum(lengths)
+            for n in range(len(lengths)):
+                yield labels[n], indices[ends[n]-lengths[n]:ends[n]], values[ends[n]-lengths[n]:ends[n]]
+            done += len(lengths)
+        for ext in streams:
+            streams[ext].close()
+
+    def remove(self):
+        for ext in ["len", "idx", "val", "lab"]:
+            remove(self.base+"."+ext)
+
+
+class TypeData(object):
+    ''' the rows of one coupling type: the non-zero count of every column over the
+    train rows and the SpillFile of the train and of the test rows
+    '''
+    def __init__(self, kind, tmpdir):
+        self.kind = kind
+        self.nonzero = zeros(0, int64)
+        self.spills = dict([(s, SpillFile(path.join(tmpdir, kind+"."+s))) for s in SETS])
+
+    def add(self, fields):
+        ''' add a row, as the list of its text fields '''
+        values = array(fields[IDFIELDS:], float64)
+        columns = values.nonzero()[0]
+        self.add_sparse(fields[:IDFIELDS], columns, values[columns], len(fields))
+
+    def add_sparse(self, ids, columns, values, width):
+        ''' add a row given by its id fields, the feature columns (from 0) which are not
+        zero and their values; width is the number of fields of the whole row
+        '''
+        # sized by every row, so that the columns of the test rows have a count (0 if
+        # they never are in the train rows, or when the type has no train rows at all)
+        if len(self.nonzero) < width:
+            self.nonzero = concatenate([self.nonzero, zeros(width-len(self.nonzero), int64)])
+        train = ids[4] != "X"
+        if train:
+            # the ids and the target are counted as awk did, for TYPE.xxx
+            for i in range(IDFIELDS):
+                if nonzero(ids[i]):
+                    self.nonzero[i] += 1
+            self.nonzero[IDFIELDS + columns] += 1
+        self.spills["train" if train else "test"].append(float(ids[4]) if train else 0.0, columns, values)
+
+    def kept(self, minsupport=MINSUPPORT):
+        ''' new index (from 1) of every feature column, 0 for those left out '''
+        support = self.nonzero[IDFIELDS:] > minsupport
+        return cumsum(support) * support
+
+    def write_counts(self, filename):
+        counts = open(filename, 'w')
+        for i, n in enumerate(self.nonzero.tolist()):
+            counts.write("%d %s\n" % (i+1, n if n > 0 else ""))
+        counts.close()
+
+    def write_svmlight(self, outdir, minsupport=MINSUPPORT):
+        index = self.kept(minsupport)
+        for s in SETS:
+            out = open(path.join(outdir, self.kind+".data."+s), 'w')
+            for label, columns, values in self.spills[s].rows():
+                new = index[columns]
+                out.write("%r" % float(label) + "".join([" %d:%r" % (j, v) for j, v in zip(new.tolist(), values.tolist()) if j > 0]) + "\n")
+            out.close()
+            self.spills[s].remove()
+
+
+def sparse_width(infile):
+    ''' number of features of the svmlight rows of infile, from the non-zero counts
+    molgeom writes next to it (infile.nonzero), None if there are none
+    '''
+    if not path.isfile(infile+".nonzero"):
+        return None
+    stream = open(infile+".nonzero", 'r')
+    width = len(stream.readlines())
+    stream.close()
+    return width
+
+
+def split_rows(infiles, tmpdir, types=None):
+    ''' read the rows of the infiles once, into a TypeData per coupling type
+    (only the types given, if any); returns type -> TypeData.
+    The rows are the comma separated lines of molgeom, or the svmlight lines of
+    molgeom --sparse (label, index:value pairs and the ids after a #)
+    '''
+    data = dict()
+    for infile in infiles:
+        width = sparse_width(infile)
+        stream = open(infile, 'r')
+        for line in stream:
+            if "#" in line:
+                pairs, ids = line.split("#", 1)
+                ids = ids.strip().split(",")
+                pairs = [pair.split(":") for pair in pairs.split()[1:]]
+                columns = array([int(k)-1 for k, v in pairs], int64)
+                values = array([float(v) for k, v in pairs], float64)
+                fields = None
+            else:
+                fields = line.rstrip("\n").rstrip(",").split(",")
+                if len(fields) <= IDFIELDS:
+                    continue
+                ids = fields
+            kind = ids[3]
+            if types is not None and kind not in types:
+                continue
+            if kind not in data:
+                data[kind] = TypeData(kind, tmpdir)
+            if fields is None:
+                rowwidth = IDFIELDS + (width if width is not None else (columns.max()+1 if len(columns) else 0))
+                data[kind].add_sparse(ids, columns, values, rowwidth)
+            else:
+                data[kind].add(fields)
+        stream.close()
+    return data
+
+
+def parsecmd():
+    usage = "usage: %prog [options] feature_files"
+    parser = OP(usage=usage)
+    parser.add_option('--types',dest='types',nargs=1,
+                     help='comma separated coupling types to keep [default: all the types found]')
+    parser.add_option('--outdir',dest='outdir',nargs=1,default="data2",
+                     help='directory of the svmlight files TYPE.data.train and TYPE.data.test [default: %default]')
+    parser.add_option('--countdir',dest='countdir',nargs=1,default=".",
+                     help='directory of the TYPE.xxx files with the non-zero count of every column [default: %default]')
+    parser.add_option('--minsupport',dest='minsupport',type='int',default=MINSUPPORT,
+                     help='keep the features which are not zero in more than this many train rows [default: %default]')
+    parser.add_option('--tmpdir',dest='tmpdir',nargs=1,
+                     help='where to keep the binary rows between the two passes [default: a new directory in outdir]')
+    (options, args) = parser.parse_args(argv[1:])
+    if len(args) == 0:
+        parser.exit(parser.print_help())
+    if options.types is not None:
+        options.types = options.types.split(",")
+    return options, args
+
+
+def main():
+    (options, args) = parsecmd()
+    for d in [options.outdir, options.countdir]:
+        if not path.isdir(d):
+            makedirs(d)
+    tmpdir = mkdtemp(dir=options.tmpdir or options.outdir)
+    data = split_rows(args, tmpdir, options.types)
+    for kind in sorted(data):
+        data[kind].write_counts(path.join(options.countdir, kind+".xxx"))
+        data[kind].write_svmlight(options.outdir, options.minsupport)
+        print(kind+" is done", file=stderr)
+    rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
+    exit(0)
@@ -1,16 +1,18 @@
 # clean all data
 rm -Rf ddd
 mkdir ddd
-rm errors
+rm -f errors
 
 cp molgeom.py molgeom_local.py
 
-for MOLECULES in struct.*; do
-
-  # parallel execution here
-  (for f in $(cat $MOLECULES); do 
-     python2.7 ./molgeom_local.py -f XYZ structures2/$f 2>>errors |  sed -e s/0\\.00,/0,/g  > ddd/$f.data; 
-     # echo $f; 
-  done) & 
-
-done
+# parallel execution here: the molecules of all the lists are shared among JOBS processes,
+# the rows come out in the order of the lists
+JOBS=$(ls struct.* | wc -l)
+cat struct.* | sed -e s,^,structures2/, > manifest
+# the couplings are read once from the kaggle tables (no need to split them with parseTrain.py)
+# all the coupling types in one pass over the structures, the rows of each type go to ddd/TYPE.svm
+# as svmlight lines of the non-zero features (the ids after a #), with the non-zero count of
+# every feature in ddd/TYPE.svm.nonzero
+# the feature blocks are kept in blocks/ (not cleaned): after a change of molgeom only the
+# blocks whose code changed are computed again (rm -Rf blocks to start over)
+python3 ./molgeom_local.py -f XYZ --batch --jobs $JOBS --types all --sparse --pertype 'ddd/{type}.svm' --couplings train.csv --couplings test.csv --blockcache blocks --errorlog errors manifest
@@ -0,0 +1,85 @@
+'''
+Shared helpers of the molgeom tests. The molecules in data/ are three QM9
+structures with their couplings (.train files, and train.csv/test.csv with a few
+couplings of dsgdb9nsd_000007 moved to the test set). data/baseline/ holds the rows
+written for them by the original molgeom (all coupling types, from the .train files).
+'''
+
+import gzip
+import os
+import subprocess
+import sys
+
+import numpy
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+DATA = os.path.join(TESTS, "data")
+MOLGEOM = os.path.join(ROOT, "molgeom.py")
+MOLECULES = ["dsgdb9nsd_000001", "dsgdb9nsd_000005", "dsgdb9nsd_000007"]
+ALLTYPES = "1JHC,1JHN,2JHC,2JHN,2JHH,3JHC,3JHN,3JHH"
+
+sys.path.insert(0, ROOT)
+
+
+def structure(molecule):
+    return os.path.join(DATA, molecule + ".xyz")
+
+
+def baseline(molecule, types=None):
+    ''' the rows of the original molgeom for the molecule (of the types given) '''
+    with gzip.open(os.path.join(DATA, "baseline", molecule + ".csv.gz"), "rt") as f:
+        lines = f.read().splitlines()
+    return [l for l in lines if types is None or l.split(",")[3] in types]
+
+
+def run_molgeom(args, cwd=None, check=True):
+    ''' run molgeom.py with args, returns the CompletedProcess (text stdout/stderr) '''
+    result = subprocess.run([sys.executable, MOLGEOM] + list(args), cwd=cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if check and result.returncode != 0:
+        raise AssertionError("molgeom %s failed (%d):\n%s" % (" ".join(args), result.returncode, result.stderr))
+    return result
+
+
+def assert_rows_match(rows, expected, rtol=1e-9):
+    ''' the csv rows are those expected: same text, or the same numbers within rtol
+    (numpy 2 under Python 3 may differ from the baseline in the last bit)
+    '''
+    assert len(rows) == len(expected)
+    for row, ref in zip(rows, expected):
+        if row == ref:
+            continue
+        fields, reffields = row.split(","), ref.split(",")
+        assert len(fields) == len(reffields), "%s: %d columns, expected %d" % (fields[0], len(fields), len(reffields))
+        for n, (a, b) in enumerate(zip(fields, reffields)):
+            if a != b:
+                assert abs(float(a) - float(b)) <= rtol * max(1.0, abs(float(b))), \
+                    "coupling %s column %d: %s, expected %s" % (fields[0], n + 1, a, b)
+
+
+def assert_arrays_match_rows(arrays, rows):
+    ''' the arrays of --npz (or of the API) hold the rows, lists of the csv fields '''
+    assert arrays["id"].tolist() == [int(r[0]) for r in rows]
+    assert arrays["atom_index_0"].tolist() == [int(r[1]) for r in rows]
+    assert arrays["atom_index_1"].tolist() == [int(r[2]) for r in rows]
+    assert arrays["type"].tolist() == [r[3] for r in rows]
+    target = [numpy.nan if r[4] == "X" else float(r[4]) for r in rows]
+    assert numpy.array_equal(arrays["target"], numpy.array(target), equal_nan=True)
+    features = numpy.array([[float(x) for x in r[5:]] for r in rows], numpy.float32)
+    # the text of %.2f values is rounded
+    assert numpy.allclose(arrays["features"], features, rtol=1e-6, atol=0.005)
+
+
+@pytest.fixture
+def molecules(tmp_path):
+    ''' a copy of the test molecules and tables in a temporary directory, and a manifest '''
+    for name in os.listdir(DATA):
+        if os.path.isfile(os.path.join(DATA, name)):
+            with open(os.path.join(DATA, name)) as src, open(str(tmp_path / name), "w") as dst:
+                dst.write(src.read())
+    with open(str(tmp_path / "manifest"), "w") as f:
+        for m in MOLECULES:
+            f.write(m + ".xyz\n")
+    return tmp_path
@@ -0,0 +1,171 @@
+'''
+Batch mode: many structures in one process, or shared among a pool of processes.
+'''
+
+import io
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+from conftest import MOLECULES, baseline, run_molgeom, assert_rows_match
+
+import molgeom
+
+
+def single_runs(cwd, extra=[]):
+    out = []
+    for m in MOLECULES:
+        out += run_molgeom(["-f", "XYZ"] + extra + [m + ".xyz"], cwd=cwd).stdout.splitlines()
+    return out
+
+
+def test_batch_matches_single_runs(molecules):
+    cwd = str(molecules)
+    out = run_molgeom(["-f", "XYZ", "-b", "manifest"], cwd=cwd).stdout.splitlines()
+    assert out == single_runs(cwd)
+
+
+def test_batch_skips_missing_structures(molecules):
+    with open(str(molecules / "manifest"), "a") as f:
+        f.write("missing.xyz\n")
+    result = run_molgeom(["-f", "XYZ", "-b", "manifest"], cwd=str(molecules))
+    assert result.stdout.splitlines() == single_runs(str(molecules))
+    assert "missing.xyz: MolgeomError" in result.stderr
+
+
+def test_batch_of_a_glob_pattern(molecules):
+    cwd = str(molecules)
+    out = run_molgeom(["-f", "XYZ", "-b", "dsgdb9nsd_*.xyz"], cwd=cwd).stdout.splitlines()
+    assert out == single_runs(cwd)
+
+
+@pytest.mark.parametrize("jobs", ["2", "3"])
+def test_pool_keeps_the_order_of_the_files(molecules, jobs):
+    cwd = str(molecules)
+    with open(str(molecules / "manifest"), "a") as f:
+        f.write("missing.xyz\n")
+        for m in reversed(MOLECULES):
+            f.write(m + ".xyz\n")
+    serial = run_molgeom(["-f", "XYZ", "-b", "manifest"], cwd=cwd)
+    parallel = run_molgeom(["-f", "XYZ", "-b", "-j", jobs, "manifest"], cwd=cwd)
+    assert parallel.stdout == serial.stdout
+    assert parallel.stderr == serial.stderr
+
+
+def table_rows(molecules):
+    ''' the baseline rows of the test molecules as read from train.csv and test.csv '''
+    test = set([l.split(",")[0] for l in open(str(molecules / "test.csv")).read().splitlines()[1:]])
+    rows = []
+    for m in MOLECULES:
+        for row in baseline(m, ["1JHC", "1JHN"]):
+            fields = row.split(",")
+            if fields[0] in test:
+                fields[4] = "X"
+            rows.append(",".join(fields))
+    return rows
+
+
+def remove_train_files(molecules):
+    for m in MOLECULES:
+        os.remove(str(molecules / (m + ".xyz.train")))
+
+
+def test_coupling_table_replaces_train_files(molecules):
+    remove_train_files(molecules)
+    out = run_molgeom(["-f", "XYZ", "-b", "--couplings", "train.csv", "--couplings", "test.csv", "manifest"],
+                      cwd=str(molecules)).stdout
+    assert_rows_match(out.splitlines(), table_rows(molecules))
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn", "forkserver"])
+def test_pool_workers_load_the_coupling_table(molecules, monkeypatch, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip("no %s start method here" % method)
+    remove_train_files(molecules)
+    monkeypatch.chdir(str(molecules))
+    monkeypatch.setattr(molgeom, "Pool", multiprocessing.get_context(method).Pool)
+    out = io.StringIO()
+    couplings = molgeom.CouplingTable(["train.csv", "test.csv"])
+    files = [m + ".xyz" for m in MOLECULES]
+    failed = molgeom.run_batch(files, "XYZ", sink=molgeom.TextSink(out), jobs=2, couplings=couplings)
+    assert failed == 0
+    assert_rows_match(out.getvalue().splitlines(), table_rows(molecules))
+
+
+def test_batch_fails_when_no_structure_can_be_processed(molecules):
+    with open(str(molecules / "manifest"), "w") as f:
+        f.write("missing.xyz\nmissing2.xyz\n")
+    result = run_molgeom(["-f", "XYZ", "-b", "-j", "2", "manifest"], cwd=str(molecules), check=False)
+    assert result.returncode != 0
+    assert result.stdout == ""
+    assert "none of the 2 structures could be processed" in result.stderr
+
+
+def test_store_holds_the_structures(molecules):
+    files = [str(molecules / (m + ".xyz")) for m in MOLECULES]
+    assert molgeom.build_store(files, str(molecules / "store")) == len(MOLECULES)
+    store = molgeom.StructureStore(str(molecules / "store"))
+    for m, f in zip(MOLECULES, files):
+        coordinates, at_symbols = molgeom.load_structure(f, "XYZ")
+        stored = store.read(m)
+        assert (stored[0] == coordinates).all()
+        assert stored[2] == at_symbols
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn", "forkserver"])
+def test_pool_workers_open_the_store(molecules, monkeypatch, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip("no %s start method here" % method)
+    run_molgeom(["-f", "XYZ", "-b", "--buildstore", "store", "manifest"], cwd=str(molecules))
+    for m in MOLECULES:
+        os.remove(str(molecules / (m + ".xyz")))
+    remove_train_files(molecules)
+    monkeypatch.chdir(str(molecules))
+    monkeypatch.setattr(molgeom, "Pool", multiprocessing.get_context(method).Pool)
+    out = io.StringIO()
+    couplings = molgeom.CouplingTable(["train.csv", "test.csv"])
+    store = molgeom.StructureStore("store")
+    files = [m + ".xyz" for m in MOLECULES]
+    failed = molgeom.run_batch(files, "XYZ", sink=molgeom.TextSink(out), jobs=2, couplings=couplings, store=store)
+    assert failed == 0
+    assert_rows_match(out.getvalue().splitlines(), table_rows(molecules))
+
+
+def test_forked_workers_keep_the_table_of_the_batch(molecules, monkeypatch):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("no fork start method here")
+    remove_train_files(molecules)
+    expected = table_rows(molecules)
+    monkeypatch.chdir(str(molecules))
+    monkeypatch.setattr(molgeom, "Pool", multiprocessing.get_context("fork").Pool)
+    couplings = molgeom.CouplingTable(["train.csv", "test.csv"])
+    # the workers could not load it again
+    for name in ["train.csv", "test.csv"]:
+        os.remove(name)
+    out = io.StringIO()
+    failed = molgeom.run_batch([m + ".xyz" for m in MOLECULES], "XYZ", sink=molgeom.TextSink(out), jobs=2,
+                               couplings=couplings)
+    assert failed == 0
+    assert_rows_match(out.getvalue().splitlines(), expected)
+
+
+def test_forked_workers_keep_the_store_of_the_batch(molecules, monkeypatch):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("no fork start method here")
+    run_molgeom(["-f", "XYZ", "-b", "--buildstore", "store", "manifest"], cwd=str(molecules))
+    for m in MOLECULES:
+        os.remove(str(molecules / (m + ".xyz")))
+    remove_train_files(molecules)
+    monkeypatch.chdir(str(molecules))
+    monkeypatch.setattr(molgeom, "Pool", multiprocessing.get_context("fork").Pool)
+    couplings = molgeom.CouplingTable(["train.csv", "test.csv"])
+    store = molgeom.StructureStore("store")
+    # the workers could not open it again
+    shutil.rmtree("store")
+    out = io.StringIO()
+    failed = molgeom.run_batch([m + ".xyz" for m in MOLECULES], "XYZ", sink=molgeom.TextSink(out), jobs=2,
+                               couplings=couplings, store=store)
+    assert failed == 0
+    assert_rows_match(out.getvalue().splitlines(), table_rows(molecules))
@@ -0,0 +1,82 @@
+'''
+The block cache: runs reusing the blocks of earlier ones, and recomputing only the
+blocks of a descriptor whose constants changed.
+'''
+
+import os
+import subprocess
+import sys
+
+import numpy
+
+from conftest import MOLECULES, ALLTYPES, MOLGEOM, baseline, assert_rows_match
+
+import molgeom
+
+
+def cached_keys(directory):
+    keys = set()
+    for name in os.listdir(directory):
+        keys |= set([k[:-4] for k in numpy.load(os.path.join(directory, name)).files if k.endswith(".ids")])
+    return keys
+
+
+def modification_times(directory):
+    return dict([(name, os.path.getmtime(os.path.join(directory, name))) for name in os.listdir(directory)])
+
+
+def cached_run(cwd, script=MOLGEOM, blockcache="blocks"):
+    args = ["-f", "XYZ", "-b", "--types", ALLTYPES, "manifest"]
+    if blockcache is not None:
+        args = ["--blockcache", blockcache] + args
+    result = subprocess.run([sys.executable, script] + args, cwd=cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.splitlines()
+
+
+def all_baseline():
+    rows = []
+    for m in MOLECULES:
+        rows += baseline(m)
+    return rows
+
+
+def test_second_run_reuses_the_blocks(molecules):
+    cwd = str(molecules)
+    first = cached_run(cwd)
+    assert_rows_match(first, all_baseline())
+    times = modification_times(str(molecules / "blocks"))
+    assert len(times) == len(MOLECULES)
+    assert cached_run(cwd) == first
+    # nothing was computed again, so nothing was written
+    assert modification_times(str(molecules / "blocks")) == times
+
+
+def test_changed_constant_recomputes_only_its_blocks(molecules):
+    cwd = str(molecules)
+    first = cached_run(cwd)
+    keys = cached_keys(str(molecules / "blocks"))
+    kinds = set([row.split(",")[3] for row in first])
+    g2keys = set([molgeom.COUPLINGTYPES[t].BlockKey(e) for t in kinds for e in molgeom.COUPLINGTYPES[t].selected() if e[0] == "G2"])
+    assert g2keys <= keys
+
+    # the same molgeom with other G2 bins
+    source = open(MOLGEOM).read()
+    assert "G2RANGE=linspace(1, 5.5, G2BINS)" in source
+    with open(str(molecules / "molgeom_g2.py"), "w") as f:
+        f.write(source.replace("G2RANGE=linspace(1, 5.5, G2BINS)", "G2RANGE=linspace(1.5, 6, G2BINS)"))
+    changed = cached_run(cwd, str(molecules / "molgeom_g2.py"))
+    assert changed == cached_run(cwd, str(molecules / "molgeom_g2.py"), blockcache=None)
+    assert changed != first
+    # new keys for the G2 blocks only, one per G2 block of every type
+    new = cached_keys(str(molecules / "blocks")) - keys
+    assert len(new) == len(g2keys)
+
+    # and only the G2 columns differ
+    for row, ref in zip(changed, first):
+        fields, reffields = row.split(","), ref.split(",")
+        columns = molgeom.COUPLINGTYPES[fields[3]].columns()
+        for (block, name), a, b in zip(columns, fields[5:], reffields[5:]):
+            if block != "G2":
+                assert a == b
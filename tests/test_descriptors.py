@@ -0,0 +1,137 @@
+'''
+The descriptor kernels against the loops they replaced and the baseline rows.
+'''
+
+import math
+
+import numpy
+import pytest
+
+from conftest import MOLECULES, ALLTYPES, baseline, run_molgeom, assert_rows_match, structure
+
+import molgeom
+
+
+def baseline_blocks(molecule, blocks):
+    ''' the id columns and the columns of the feature blocks of the baseline rows '''
+    rows = []
+    for row in baseline(molecule):
+        fields = row.rstrip(",").split(",")
+        columns = molgeom.COUPLINGTYPES[fields[3]].columns()
+        rows.append(",".join(fields[:5] + [x for x, (block, name) in zip(fields[5:], columns) if block in blocks]) + ",")
+    return rows
+
+
+def block_rows(cwd, molecule, blocks):
+    args = ["-f", "XYZ", "--types", ALLTYPES, "--blocks", ",".join(blocks), molecule + ".xyz"]
+    return run_molgeom(args, cwd=cwd).stdout.splitlines()
+
+
+def histogram_loop(values, symbols, Range, beta, weights=None):
+    counts = numpy.zeros((6, len(Range)))
+    for n, (v, s) in enumerate(zip(values, symbols)):
+        for k, r in enumerate(Range):
+            g = math.exp(-(beta * (v - r))**2) * (1 if weights is None else weights[n])
+            counts[molgeom.ELEMENTS[s]][k] += g
+            if s != "H":
+                counts[molgeom.ELEMENTS["all"]][k] += g
+    return counts
+
+
+def test_smeared_histogram_matches_loop():
+    r = numpy.random.RandomState(3)
+    values = r.rand(40) * 5
+    symbols = [["H", "C", "N", "O", "F"][i] for i in r.randint(0, 5, 40)]
+    Range = numpy.linspace(0, 5, molgeom.NBINS)
+    expected = histogram_loop(values, symbols, Range, 2.0)
+    assert numpy.allclose(molgeom.SmearedHistogram(values, symbols, Range, 2.0), expected, rtol=1e-12, atol=0)
+
+
+def test_smeared_histogram_weights_and_heavy_mask():
+    values = [1.0, 1.5, 2.5]
+    symbols = ["H", "C", "O"]
+    weights = [0.5, -1.0, 2.0]
+    Range = numpy.linspace(0, 3, 4)
+    counts = molgeom.SmearedHistogram(values, symbols, Range, 1.5, weights, heavy=numpy.array([True, False, False]))
+    expected = histogram_loop(values, symbols, Range, 1.5, weights)
+    assert numpy.allclose(counts[:5], expected[:5])
+    # the last row sums the atoms of the mask only
+    assert numpy.allclose(counts[5], expected[0])
+
+
+def test_smeared_histogram_of_nothing_is_zero():
+    assert (molgeom.SmearedHistogram([], [], numpy.linspace(0, 1, 5), 1.0) == 0).all()
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_g2_descriptors_match_baseline(molecules, molecule):
+    assert_rows_match(block_rows(str(molecules), molecule, ["G2"]), baseline_blocks(molecule, ["G2"]))
+
+
+def test_descriptor_cache_computes_each_atom_once():
+    calls = []
+    def descriptor(atom, exclude, symbols):
+        calls.append((atom, exclude))
+        return [atom, len(exclude)]
+    cache = molgeom.DescriptorCache()
+    symbols = ["C", "H"]
+    assert cache(descriptor, 1, set([2, 3]), symbols) == [1, 2]
+    assert cache(descriptor, 1, set([3, 2]), symbols) == [1, 2]
+    assert cache(descriptor, 1, set([2]), symbols) == [1, 1]
+    assert cache(descriptor, 0, set([2]), symbols) == [0, 1]
+    assert len(calls) == 3
+    cache.clear()
+    cache(descriptor, 1, set([2, 3]), symbols)
+    assert len(calls) == 4
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_memoized_rows_of_all_types_match_baseline(molecules, molecule):
+    out = run_molgeom(["-f", "XYZ", "--types", ALLTYPES, molecule + ".xyz"], cwd=str(molecules)).stdout
+    assert_rows_match(out.splitlines(), baseline(molecule))
+
+
+def coulomb_row_loop(atom, coordinates, width):
+    row = numpy.zeros(max(width, len(coordinates)))
+    for j in range(len(coordinates)):
+        if j != atom:
+            row[j] = coordinates[atom][3] * coordinates[j][3] / molgeom.getdist(coordinates[atom], coordinates[j])
+    return numpy.sort(row)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_sorted_coulomb_rows_match_loop(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    rows = molgeom.GetSortedCoulombRows(coordinates)
+    for atom in range(len(coordinates)):
+        assert numpy.allclose(rows[atom], coulomb_row_loop(atom, coordinates, molgeom.COULOMBWIDTH), rtol=1e-12, atol=0)
+
+
+def test_sorted_coulomb_rows_of_large_molecule_keep_the_largest_values(monkeypatch):
+    monkeypatch.setattr(molgeom.errorlog, "messages", [])
+    r = numpy.random.RandomState(5)
+    coordinates = numpy.concatenate([r.rand(40, 3) * 10, r.randint(1, 9, (40, 1))], axis=1)
+    rows = molgeom.GetSortedCoulombRows(coordinates, width=29)
+    assert rows.shape == (40, 29)
+    # the cut is not silent
+    assert len(molgeom.errorlog.messages) == 1
+    assert "40 atoms" in molgeom.errorlog.messages[0] and "29 values" in molgeom.errorlog.messages[0]
+    molgeom.GetSortedCoulombRows(coordinates[:29], width=29)
+    assert len(molgeom.errorlog.messages) == 1
+    for atom in range(40):
+        full = coulomb_row_loop(atom, coordinates, 29)
+        largest = full[numpy.argsort(-abs(full), kind="mergesort")[:29]]
+        assert numpy.allclose(rows[atom], numpy.sort(largest))
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_coulomb_rows_match_baseline(molecules, molecule):
+    assert_rows_match(block_rows(str(molecules), molecule, ["coulomb"]), baseline_blocks(molecule, ["coulomb"]))
+
+
+ANGLEBLOCKS = ["neighborangles", "neighborminangles", "neighbormaxangles", "neighbortorsions", "neighbortorsions2"]
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_angle_and_torsion_descriptors_match_baseline(molecules, molecule):
+    assert_rows_match(block_rows(str(molecules), molecule, ANGLEBLOCKS), baseline_blocks(molecule, ANGLEBLOCKS))
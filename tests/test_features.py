@@ -0,0 +1,84 @@
+'''
+The feature rows of the test molecules against those of the original molgeom.
+'''
+
+import pytest
+
+from conftest import MOLECULES, ALLTYPES, baseline, run_molgeom, assert_rows_match, assert_arrays_match_rows, structure
+
+import molgeom
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_default_types_match_baseline(molecules, molecule):
+    out = run_molgeom(["-f", "XYZ", molecule + ".xyz"], cwd=str(molecules)).stdout
+    assert_rows_match(out.splitlines(), baseline(molecule, ["1JHC", "1JHN"]))
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_bonds_match_pairwise_loop(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    neighbors = molgeom.GetBonds(coordinates, at_symbols)
+    for i in range(len(coordinates)):
+        expected = [j for j in range(len(coordinates)) if j != i and
+                    molgeom.getdist(coordinates[i], coordinates[j]) <
+                    molgeom.covalentR[at_symbols[i]] + molgeom.covalentR[at_symbols[j]]]
+        assert sorted(neighbors[i]) == expected
+        assert list(neighbors[i]) == expected # increasing keys, the order the descriptors iterate in
+
+
+def moments(molecule):
+    with open(structure(molecule) + ".train") as f:
+        return molgeom.read_moments(f)
+
+
+def baseline_fields(molecule, types=None):
+    return [row.rstrip(",").split(",") for row in baseline(molecule, types)]
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_compute_features_matches_baseline(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    arrays = molgeom.compute_features(coordinates, at_symbols, moments(molecule))
+    assert_arrays_match_rows(arrays, baseline_fields(molecule, ["1JHC", "1JHN"]))
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_compute_features_by_type_matches_baseline(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    topology = molgeom.perceive_bonds(coordinates, at_symbols)
+    by_type = molgeom.compute_features_by_type(coordinates, at_symbols, moments(molecule), topology=topology)
+    rows = baseline_fields(molecule)
+    assert sorted(by_type) == sorted(set([r[3] for r in rows]))
+    for kind in by_type:
+        assert_arrays_match_rows(by_type[kind], [r for r in rows if r[3] == kind])
+
+
+def schema(args):
+    columns = dict()
+    for line in run_molgeom(["--schema"] + args).stdout.splitlines():
+        kind, number, block, name = line.split("\t")
+        columns.setdefault(kind, []).append((int(number), block, name))
+    return columns
+
+
+def test_schema_of_all_types_matches_baseline_rows():
+    columns = schema(["--types", "all"])
+    assert sorted(columns) == sorted(ALLTYPES.split(","))
+    for m in MOLECULES:
+        for row in baseline_fields(m):
+            assert len(columns[row[3]]) == len(row)
+    for kind in columns:
+        assert [c[0] for c in columns[kind]] == list(range(1, len(columns[kind]) + 1))
+        assert [c[2] for c in columns[kind][:5]] == molgeom.IDCOLUMNS
+
+
+@pytest.mark.parametrize("blocks", ["G2", "coulomb,cyclic", "identity,neighborangles"])
+def test_schema_of_blocks_matches_rows(molecules, blocks):
+    columns = schema(["--types", ALLTYPES, "--blocks", blocks])
+    for m in MOLECULES:
+        out = run_molgeom(["-f", "XYZ", "--types", ALLTYPES, "--blocks", blocks, m + ".xyz"], cwd=str(molecules)).stdout
+        for row in out.splitlines():
+            fields = row.rstrip(",").split(",")
+            assert len(columns[fields[3]]) == len(fields)
+            assert set([c[1] for c in columns[fields[3]][5:]]) <= set(blocks.split(","))
@@ -0,0 +1,146 @@
+'''
+Neighbor searches and geometry primitives against plain loops.
+'''
+
+import math
+
+import numpy
+import pytest
+
+from conftest import MOLECULES, structure
+
+import molgeom
+
+
+def random_atoms(n, size, seed=1):
+    return numpy.random.RandomState(seed).rand(n, 3) * size
+
+
+def test_cell_list_query_matches_brute_force():
+    xyz = random_atoms(400, 20.0)
+    grid = molgeom.CellList(xyz, 3.0)
+    for atom in range(0, 400, 7):
+        close, dists = grid.query(atom, 2.5)
+        d = numpy.sqrt(((xyz - xyz[atom])**2).sum(axis=1))
+        assert close.tolist() == numpy.nonzero(d < 2.5)[0].tolist()
+        assert numpy.allclose(dists, d[close])
+
+
+def test_periodic_cell_list_uses_minimum_image():
+    size = numpy.array([12.0, 13.0, 14.0])
+    xyz = random_atoms(300, size) - 3.0  # also atoms outside the unit cell
+    grid = molgeom.CellList(xyz, 4.0, (12.0, 13.0, 14.0, 90.0, 90.0, 90.0))
+    for atom in range(0, 300, 11):
+        diff = xyz - xyz[atom]
+        diff -= size * numpy.round(diff / size)
+        d = numpy.sqrt((diff**2).sum(axis=1))
+        close, dists = grid.query(atom, 3.5)
+        assert close.tolist() == numpy.nonzero(d < 3.5)[0].tolist()
+        assert numpy.allclose(dists, d[close])
+
+
+def test_query_beyond_cutoff_is_refused():
+    grid = molgeom.CellList(random_atoms(10, 5.0), 2.0)
+    with pytest.raises(ValueError):
+        grid.query(0, 3.0)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_bonds_through_cell_list_are_the_same(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    grid = molgeom.CellList(coordinates, 5.0)
+    assert molgeom.GetBonds(coordinates, at_symbols, grid=grid) == molgeom.GetBonds(coordinates, at_symbols)
+
+
+def measured_atoms(seed=2):
+    ''' random atoms, plus collinear and coincident ones for the degenerate angles '''
+    xyz = random_atoms(30, 6.0, seed)
+    xyz[1] = xyz[0] + (xyz[2] - xyz[0]) * 0.5
+    xyz[3] = xyz[0]
+    return numpy.concatenate([xyz, numpy.ones((30, 1))], axis=1)
+
+
+def index_rows(n, size, seed=3):
+    r = numpy.random.RandomState(seed)
+    rows = [r.choice(size, n, replace=False) for k in range(200)]
+    return numpy.array(rows[:4] + [[0, 1, 2, 3][:n], [3, 0, 1, 2][:n]] + rows[4:])
+
+
+def test_getdists_matches_getdist():
+    xyz = measured_atoms()
+    pairs = index_rows(2, len(xyz))
+    expected = [molgeom.getdist(xyz[i], xyz[j]) for i, j in pairs]
+    assert molgeom.getdists(xyz, pairs).tolist() == expected
+
+
+def test_getangles_matches_getangle():
+    xyz = measured_atoms()
+    triples = index_rows(3, len(xyz))
+    expected = [molgeom.getangle(xyz[i][:3], xyz[j][:3], xyz[k][:3]) for i, j, k in triples]
+    assert numpy.allclose(molgeom.getangles(xyz, triples), expected, rtol=1e-12, atol=1e-9)
+
+
+def test_gettorsions_and_getdihs_match_scalar_versions():
+    xyz = measured_atoms()
+    quadruples = index_rows(4, len(xyz))
+    expected = [molgeom.gettors(*[xyz[a][:3] for a in q]) for q in quadruples]
+    assert numpy.allclose(molgeom.gettorsions(xyz, quadruples), expected, rtol=1e-12, atol=1e-9)
+    for period in [360, 180, 120]:
+        expected = [molgeom.getdih(*([xyz[a][:3] for a in q] + [period])) for q in quadruples]
+        periods = numpy.full(len(quadruples), period)
+        assert numpy.allclose(molgeom.getdihs(xyz, quadruples, periods), expected, rtol=1e-12, atol=1e-9)
+
+
+def test_geometry_of_no_atoms_is_empty():
+    xyz = measured_atoms()
+    assert len(molgeom.getdists(xyz, numpy.zeros((0, 2), int))) == 0
+    assert len(molgeom.getangles(xyz, numpy.zeros((0, 3), int))) == 0
+    assert len(molgeom.gettorsions(xyz, numpy.zeros((0, 4), int))) == 0
+
+
+TRICLINIC = (9.0, 10.0, 11.0, 80.0, 95.0, 105.0)
+
+
+def minimage_loop(vector, cellparam):
+    ''' the minimum image as the original getpbcdist computed it (setpbc at every call,
+    vector times matrix loops, nearest integer by modf)
+    '''
+    A, B = molgeom.setpbc(cellparam)
+    tvec = [sum([vector[i]*B[i][j] for i in range(3)]) for j in range(3)]
+    tvec = [t - (math.modf(t)[1] + (1 if math.modf(t)[0] >= 0.5 else 0)) for t in tvec]
+    return numpy.array([sum([tvec[i]*A[i][j] for i in range(3)]) for j in range(3)])
+
+
+def test_minimage_matches_original_loop():
+    cell = molgeom.PeriodicCell(TRICLINIC)
+    r = numpy.random.RandomState(4)
+    # the original rounding truncated components below -0.5 toward zero, so compare above
+    frac = r.rand(100, 3) * 1.9 - 0.45
+    vectors = cell.cartesian(frac)
+    expected = numpy.array([minimage_loop(v, TRICLINIC) for v in vectors])
+    assert numpy.allclose(cell.minimage(vectors), expected, rtol=1e-12, atol=1e-12)
+    assert numpy.allclose(cell.minimage(vectors[0]), expected[0], rtol=1e-12, atol=1e-12)
+
+
+def test_minimage_is_within_half_a_cell_in_every_direction():
+    cell = molgeom.PeriodicCell(TRICLINIC)
+    vectors = cell.cartesian(numpy.random.RandomState(6).rand(200, 3) * 6 - 3)
+    frac = cell.fractional(cell.minimage(vectors))
+    assert (abs(frac) <= 0.5 + 1e-12).all()
+    assert numpy.allclose(frac - cell.fractional(vectors), numpy.round(frac - cell.fractional(vectors)))
+
+
+def test_periodic_measurements_reuse_the_cell():
+    cell = molgeom.PeriodicCell(TRICLINIC)
+    xyz = measured_atoms()
+    xyz[:, :3] = cell.cartesian(numpy.random.RandomState(7).rand(30, 3) * 2 - 0.5)
+    pairs = index_rows(2, len(xyz))
+    triples = index_rows(3, len(xyz))
+    quadruples = index_rows(4, len(xyz))
+    for c in [cell, TRICLINIC]:
+        assert numpy.allclose(molgeom.getdists(xyz, pairs, cell),
+                              [molgeom.getpbcdist(xyz[i][:3], xyz[j][:3], c) for i, j in pairs])
+        assert numpy.allclose(molgeom.getangles(xyz, triples, cell),
+                              [molgeom.getpbcangle(xyz[i][:3], xyz[j][:3], xyz[k][:3], c) for i, j, k in triples])
+        assert numpy.allclose(molgeom.getdihs(xyz, quadruples, numpy.full(len(quadruples), 360), cell),
+                              [molgeom.getpbctors(*([xyz[a][:3] for a in q] + [360, c])) for q in quadruples])
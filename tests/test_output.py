@@ -0,0 +1,176 @@
+'''
+The output formats of the feature rows against the text output.
+'''
+
+import numpy
+import pytest
+
+from conftest import MOLECULES, run_molgeom, assert_arrays_match_rows, structure
+
+import molgeom
+
+
+def text_rows(cwd, args):
+    return [l.rstrip(",").split(",") for l in run_molgeom(args, cwd=cwd).stdout.splitlines()]
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_npz_matches_text(molecules, molecule):
+    cwd = str(molecules)
+    run_molgeom(["-f", "XYZ", "--npz", "out.npz", molecule + ".xyz"], cwd=cwd)
+    arrays = numpy.load(str(molecules / "out.npz"))
+    assert_arrays_match_rows(arrays, text_rows(cwd, ["-f", "XYZ", molecule + ".xyz"]))
+
+
+def test_npz_of_test_set_has_nan_targets(molecules):
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--couplings", "train.csv", "--couplings", "test.csv", "manifest"]
+    run_molgeom(args + ["--npz", "out.npz"], cwd=cwd)
+    arrays = numpy.load(str(molecules / "out.npz"))
+    rows = text_rows(cwd, args)
+    assert "X" in [r[4] for r in rows]
+    assert_arrays_match_rows(arrays, rows)
+
+
+@pytest.mark.parametrize("sparse", [[], ["--sparse"]])
+def test_npz_of_types_of_different_widths_is_refused(molecules, sparse):
+    result = run_molgeom(["-f", "XYZ", "--types", "all", "--npz", "out.npz"] + sparse + ["manifest"],
+                         cwd=str(molecules), check=False)
+    assert result.returncode == 2
+    assert "--pertype" in result.stderr
+    assert not (molecules / "out.npz").exists()
+
+
+def test_npz_of_all_types_per_type_matches_text(molecules):
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--types", "all", "manifest"]
+    run_molgeom(args + ["--pertype", "out_{type}.npz"], cwd=cwd)
+    rows = text_rows(cwd, args)
+    kinds = sorted(set([r[3] for r in rows]))
+    assert len(kinds) > 2
+    for kind in kinds:
+        arrays = numpy.load(str(molecules / ("out_%s.npz" % kind)))
+        assert_arrays_match_rows(arrays, [r for r in rows if r[3] == kind])
+
+
+@pytest.mark.parametrize("pattern", ["out.npz", "out.data", "out_type.svm"])
+def test_pattern_without_type_is_refused(molecules, pattern):
+    args = ["-f", "XYZ", "-b", "--types", "all", "--pertype", pattern, "manifest"]
+    result = run_molgeom(args + (["--sparse"] if pattern.endswith(".svm") else []), cwd=str(molecules), check=False)
+    assert result.returncode == 2
+    assert "{type}" in result.stderr
+    assert not (molecules / pattern).exists()
+
+
+def test_npz_of_types_of_the_same_width(molecules):
+    # the rows of these types are made of two cyclic blocks (4 columns)
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--types", "2JHC,2JHN,3JHH", "--blocks", "coulomb,cyclic", "manifest"]
+    run_molgeom(args + ["--npz", "out.npz"], cwd=cwd)
+    assert_arrays_match_rows(numpy.load(str(molecules / "out.npz")), text_rows(cwd, args))
+
+
+def svmlight_rows(lines):
+    ''' (label, {column: text}, ids) of every svmlight line of molgeom --sparse '''
+    rows = []
+    for line in lines:
+        pairs, ids = line.split(" # ")
+        pairs = pairs.split()
+        rows.append((pairs[0], dict([(int(p.split(":")[0]), p.split(":")[1]) for p in pairs[1:]]), ids.split(",")))
+    return rows
+
+
+def assert_svmlight_matches_rows(lines, counts, rows):
+    assert len(lines) == len(rows)
+    for (label, pairs, ids), r in zip(svmlight_rows(lines), rows):
+        assert ids == r[:5]
+        assert label == ("0" if r[4] == "X" else r[4])
+        assert pairs == dict([(j + 1, x) for j, x in enumerate(r[5:]) if float(x) != 0])
+    expected = [sum([1 for r in rows if r[4] != "X" and float(r[5 + j]) != 0]) for j in range(len(rows[0]) - 5)]
+    assert counts == ["%d %d" % (j + 1, n) for j, n in enumerate(expected)]
+
+
+def test_svmlight_matches_text(molecules):
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--couplings", "train.csv", "--couplings", "test.csv", "manifest"]
+    lines = run_molgeom(args + ["--sparse", "--nonzero", "counts"], cwd=cwd).stdout.splitlines()
+    rows = text_rows(cwd, args)
+    assert "X" in [r[4] for r in rows]
+    assert_svmlight_matches_rows(lines, open(str(molecules / "counts")).read().splitlines(), rows)
+
+
+def test_svmlight_of_all_types_per_type_matches_text(molecules):
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--types", "all", "--couplings", "train.csv", "--couplings", "test.csv", "manifest"]
+    run_molgeom(args + ["--sparse", "--pertype", "out_{type}.svm"], cwd=cwd)
+    rows = text_rows(cwd, args)
+    for kind in sorted(set([r[3] for r in rows])):
+        lines = open(str(molecules / ("out_%s.svm" % kind))).read().splitlines()
+        counts = open(str(molecules / ("out_%s.svm.nonzero" % kind))).read().splitlines()
+        assert_svmlight_matches_rows(lines, counts, [r for r in rows if r[3] == kind])
+
+
+def test_svmlight_of_types_of_different_widths_is_refused(molecules):
+    result = run_molgeom(["-f", "XYZ", "--types", "all", "--sparse", "manifest"], cwd=str(molecules), check=False)
+    assert result.returncode == 2
+    assert "--pertype" in result.stderr
+    result = run_molgeom(["-f", "XYZ", "--nonzero", "counts", "manifest"], cwd=str(molecules), check=False)
+    assert result.returncode == 2
+
+
+def test_sparse_npz_matches_text(molecules):
+    cwd = str(molecules)
+    args = ["-f", "XYZ", "-b", "--couplings", "train.csv", "--couplings", "test.csv", "manifest"]
+    run_molgeom(args + ["--sparse", "--npz", "out.npz"], cwd=cwd)
+    arrays = dict(numpy.load(str(molecules / "out.npz")))
+    rows = text_rows(cwd, args)
+    features = numpy.zeros(arrays["shape"], numpy.float32)
+    for n in range(len(arrays["indptr"]) - 1):
+        start, stop = arrays["indptr"][n], arrays["indptr"][n + 1]
+        features[n, arrays["indices"][start:stop]] = arrays["data"][start:stop]
+    arrays["features"] = features
+    assert_arrays_match_rows(arrays, rows)
+    nonzero = [sum([1 for r in rows if r[4] != "X" and float(r[5 + j]) != 0]) for j in range(len(rows[0]) - 5)]
+    assert arrays["nonzero"].tolist() == nonzero
+
+
+@pytest.mark.parametrize("shard", [1, 3, 1000])
+def test_npz_written_in_shards_matches_the_arrays(tmp_path, monkeypatch, shard):
+    monkeypatch.setattr(molgeom, "NPZSHARD", shard)
+    molecule = MOLECULES[1]
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    with open(structure(molecule) + ".train") as f:
+        moments = molgeom.read_moments(f)
+    filename = str(tmp_path / "out.npz")
+    sink = molgeom.NpzSink(filename)
+    molgeom.write_features(coordinates, at_symbols, moments, sink, types=["2JHC"])
+    # no more than a shard of rows is kept
+    assert sink.shard is None or sink.shard.nrows < shard
+    sink.close()
+    expected = molgeom.compute_features(coordinates, at_symbols, moments, types=["2JHC"])
+    arrays = numpy.load(filename)
+    assert sorted(arrays.files) == sorted(expected)
+    assert len(expected["id"]) > 3
+    for key in expected:
+        assert arrays[key].dtype == expected[key].dtype
+        assert numpy.array_equal(arrays[key], expected[key], equal_nan=key == "target")
+    assert not [name for name in tmp_path.iterdir() if name.name != "out.npz"]
+
+
+def test_npz_without_rows(tmp_path):
+    sink = molgeom.NpzSink(str(tmp_path / "out.npz"))
+    sink.close()
+    arrays = numpy.load(str(tmp_path / "out.npz"))
+    assert arrays["features"].shape == (0, 0)
+    assert arrays["id"].tolist() == []
+
+
+def test_arrays_are_made_without_text(monkeypatch):
+    def format(*args):
+        raise AssertionError("text of a binary row")
+    monkeypatch.setattr(molgeom.FeatureRow, "format", format)
+    coordinates, at_symbols = molgeom.load_structure(structure(MOLECULES[0]))
+    with open(structure(MOLECULES[0]) + ".train") as f:
+        moments = molgeom.read_moments(f)
+    arrays = molgeom.compute_features_by_type(coordinates, at_symbols, moments)
+    assert sum([len(a["id"]) for a in arrays.values()]) > 0
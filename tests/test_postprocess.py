@@ -0,0 +1,136 @@
+'''
+postprocess_data.py on the rows of the test molecules.
+'''
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, run_molgeom
+
+POSTPROCESS = os.path.join(ROOT, "postprocess_data.py")
+TABLES = ["--couplings", "train.csv", "--couplings", "test.csv"]
+
+
+def postprocess(cwd, args):
+    result = subprocess.run([sys.executable, POSTPROCESS] + list(args), cwd=cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def output_files(directory):
+    return dict([(name, open(os.path.join(directory, name)).read()) for name in sorted(os.listdir(directory))])
+
+
+@pytest.mark.parametrize("minsupport", ["0", "2"])
+def test_sparse_rows_give_the_same_files_as_text_rows(molecules, minsupport):
+    cwd = str(molecules)
+    os.mkdir(str(molecules / "text"))
+    os.mkdir(str(molecules / "sparse"))
+    args = ["-f", "XYZ", "-b", "--types", "all"] + TABLES + ["manifest"]
+    run_molgeom(args + ["--pertype", "text/{type}.data"], cwd=cwd)
+    run_molgeom(args + ["--sparse", "--pertype", "sparse/{type}.svm"], cwd=cwd)
+    kinds = sorted([name[:-5] for name in os.listdir(str(molecules / "text"))])
+    options = ["--minsupport", minsupport]
+    postprocess(cwd, options + ["--outdir", "fromtext", "--countdir", "fromtext"] + ["text/%s.data" % k for k in kinds])
+    postprocess(cwd, options + ["--outdir", "fromsparse", "--countdir", "fromsparse"] + ["sparse/%s.svm" % k for k in kinds])
+    files = output_files(str(molecules / "fromtext"))
+    assert sorted(files) == sorted([k + ".xxx" for k in kinds] + [k + ".data." + s for k in kinds for s in ["train", "test"]])
+    assert files == output_files(str(molecules / "fromsparse"))
+
+
+# the commands of the original postprocess_data.sh and csv2svmlight.sh for the rows of
+# one type in data/$tt.data, with the minimum support as $MINSUPPORT
+ORIGINAL = r'''
+sed -i -e s/,$//g data/$tt.data
+grep -v X data/$tt.data > data/$tt.data.train
+grep X data/$tt.data > data/$tt.data.test
+awk -v FS="," '{for(i=1;i<=NF;i++) if($i!=0) a[i]++;} END{ for(i=1;i<=NF;i++) print i" "a[i];}' data/$tt.data.train > $tt.xxx
+myFeatures=$(awk -v m=$MINSUPPORT '{if($2!="" && $2>m && ($1!=2 && $1!=3 && $1!=4)) printf("%s,",$1); }' $tt.xxx | sed -e s/,$//g )
+cut -f $myFeatures -d, data/$tt.data.train > aaa.$tt; mv aaa.$tt data/$tt.data.train
+cut -f $myFeatures -d, data/$tt.data.test > aaa.$tt; mv aaa.$tt data/$tt.data.test
+for s in train test; do
+    cut -f 2- -d, data/$tt.data.$s | awk -v FS="," '{a=0; printf($1); for(i=2;i<=NF;i++) if($i!=0) printf(" "i-1":"$i); print ""}' > data2/$tt.data.$s
+done
+'''
+
+
+def svmlight_values(text):
+    ''' (label, {index: value}) of every line, the label X of the original test rows as 0 '''
+    rows = []
+    for line in text.splitlines():
+        fields = line.split()
+        label = 0.0 if fields[0] == "X" else float(fields[0])
+        rows.append((label, dict([(int(f.split(":")[0]), float(f.split(":")[1])) for f in fields[1:]])))
+    return rows
+
+
+def feature_rows(molecules, types="all"):
+    ''' the text rows of the test molecules, train and test couplings, one file per type in text/ '''
+    os.mkdir(str(molecules / "text"))
+    run_molgeom(["-f", "XYZ", "-b", "--types", types] + TABLES + ["--pertype", "text/{type}.data", "manifest"],
+                cwd=str(molecules))
+    return sorted([name[:-5] for name in os.listdir(str(molecules / "text"))])
+
+
+@pytest.mark.parametrize("minsupport", ["2", "4"])
+def test_files_match_the_original_shell_pipeline(molecules, minsupport):
+    cwd = str(molecules)
+    kinds = feature_rows(molecules)
+    postprocess(cwd, ["--minsupport", minsupport, "--outdir", "out", "--countdir", "out"] + ["text/%s.data" % k for k in kinds])
+    for d in ["data", "data2"]:
+        os.mkdir(str(molecules / d))
+    compared = []
+    for kind in kinds:
+        rows = open(str(molecules / "text" / (kind + ".data"))).read().splitlines()
+        if len([r for r in rows if ",X," not in r]) <= int(minsupport):
+            continue  # the original pipeline mistook the target for the id when the id was left out
+        with open(str(molecules / "data" / (kind + ".data")), "w") as f:
+            f.write("\n".join(rows) + "\n")
+        env = dict(os.environ, tt=kind, MINSUPPORT=minsupport)
+        subprocess.check_call(["bash", "-c", ORIGINAL], cwd=cwd, env=env)
+        assert open(str(molecules / "out" / (kind + ".xxx"))).read() == open(str(molecules / (kind + ".xxx"))).read()
+        for s in ["train", "test"]:
+            new = svmlight_values(open(str(molecules / "out" / ("%s.data.%s" % (kind, s)))).read())
+            assert new == svmlight_values(open(str(molecules / "data2" / ("%s.data.%s" % (kind, s)))).read())
+            assert len(new) == len([r for r in rows if (",X," in r) == (s == "test")])
+        compared.append(kind)
+    assert len(compared) > 2
+
+
+def test_type_without_train_rows(molecules):
+    cwd = str(molecules)
+    kinds = feature_rows(molecules)
+    # all the 2JHC couplings in the test set
+    rows = [r.split(",") for r in open(str(molecules / "text" / "2JHC.data")).read().splitlines()]
+    with open(str(molecules / "text" / "2JHC.data"), "w") as f:
+        for r in rows:
+            f.write(",".join(r[:4] + ["X"] + r[5:]) + "\n")
+    postprocess(cwd, ["--minsupport", "0", "--outdir", "out", "--countdir", "out"] + ["text/%s.data" % k for k in kinds])
+    assert open(str(molecules / "out" / "2JHC.data.train")).read() == ""
+    assert open(str(molecules / "out" / "2JHC.data.test")).read().splitlines() == ["0.0"] * len(rows)
+    counts = open(str(molecules / "out" / "2JHC.xxx")).read().splitlines()
+    assert counts == ["%d " % (i + 1) for i in range(len(rows[0]) - 1)]
+    # the other types are as without it
+    postprocess(cwd, ["--minsupport", "0", "--outdir", "others", "--countdir", "others"] +
+                ["text/%s.data" % k for k in kinds if k != "2JHC"])
+    others = output_files(str(molecules / "others"))
+    assert dict([(n, t) for n, t in output_files(str(molecules / "out")).items() if not n.startswith("2JHC")]) == others
+
+
+def test_spill_files_round_trip(molecules, monkeypatch):
+    import postprocess_data
+    cwd = str(molecules)
+    kinds = feature_rows(molecules)
+    files = ["text/%s.data" % k for k in kinds]
+    postprocess(cwd, ["--minsupport", "1", "--outdir", "whole", "--countdir", "whole"] + files)
+    # a few rows at a time through the binary files
+    monkeypatch.chdir(cwd)
+    monkeypatch.setattr(postprocess_data, "BUFFERROWS", 2)
+    monkeypatch.setattr(postprocess_data, "argv", ["postprocess_data.py", "--minsupport", "1", "--outdir", "spilled",
+                                                   "--countdir", "spilled"] + files)
+    postprocess_data.main()
+    assert output_files(str(molecules / "spilled")) == output_files(str(molecules / "whole"))
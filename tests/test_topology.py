@@ -0,0 +1,188 @@
+'''
+Bonds, rings and topological distances of the molecules (see Topology).
+'''
+
+import numpy
+import pytest
+
+from conftest import MOLECULES, ALLTYPES, baseline, run_molgeom, assert_rows_match, structure
+
+import molgeom
+
+CELL = (20.0, 21.0, 22.0, 90.0, 90.0, 90.0)
+
+
+def assert_same_topology(a, b):
+    assert a.neighbors == b.neighbors
+    assert [list(n) for n in a.neighbors] == [list(n) for n in b.neighbors]
+    assert (a.distances == b.distances).all()
+    assert sorted(a.cyclic) == sorted(b.cyclic)
+    assert a.ringsize.tolist() == b.ringsize.tolist()
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_saved_topology_is_loaded_back(tmp_path, molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    topology = molgeom.perceive_bonds(coordinates, at_symbols)
+    topofile = str(tmp_path / "topo.npz")
+    topology.save(topofile)
+    assert_same_topology(molgeom.Topology.load(topofile, coordinates, at_symbols), topology)
+
+
+def test_saved_topology_is_only_for_the_same_structure(tmp_path):
+    coordinates, at_symbols = molgeom.load_structure(structure("dsgdb9nsd_000005"))
+    topofile = str(tmp_path / "topo.npz")
+    molgeom.perceive_bonds(coordinates, at_symbols).save(topofile)
+    moved = coordinates.copy()
+    moved[0, 0] += 0.1
+    assert molgeom.Topology.load(topofile, moved, at_symbols) is None
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols[:-1] + ["F"]) is None
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols, CELL) is None
+    assert molgeom.Topology.load(str(tmp_path / "none.npz"), coordinates, at_symbols) is None
+    # written without the ring sizes
+    data = dict(numpy.load(topofile))
+    del data["ringsize"]
+    numpy.savez(topofile, **data)
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols) is None
+
+
+def test_saved_periodic_topology_is_only_for_the_same_cell(tmp_path):
+    coordinates, at_symbols = molgeom.load_structure(structure("dsgdb9nsd_000005"))
+    topofile = str(tmp_path / "topo.npz")
+    topology = molgeom.perceive_bonds(coordinates, at_symbols, CELL)
+    topology.save(topofile)
+    assert_same_topology(molgeom.Topology.load(topofile, coordinates, at_symbols, CELL), topology)
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols, molgeom.PeriodicCell(CELL)) is not None
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols) is None
+    assert molgeom.Topology.load(topofile, coordinates, at_symbols, (20.0, 21.0, 23.0, 90.0, 90.0, 90.0)) is None
+
+
+def test_topology_cache_gives_the_baseline_rows(molecules):
+    args = ["-f", "XYZ", "-b", "--types", ALLTYPES, "--topocache", "topo", "manifest"]
+    expected = sum([baseline(m) for m in MOLECULES], [])
+    for run in range(2): # computed, then loaded
+        assert_rows_match(run_molgeom(args, cwd=str(molecules)).stdout.splitlines(), expected)
+    assert len(list((molecules / "topo").iterdir())) == len(MOLECULES)
+
+
+def graph(n, bonds):
+    ''' neighbors dicts (as GetBonds) of n atoms with the bonds given '''
+    neighbors = [dict() for i in range(n)]
+    for i, j in bonds:
+        neighbors[i][j] = neighbors[j][i] = 1.0
+    return neighbors
+
+
+def floyd_warshall(neighbors):
+    n = len(neighbors)
+    d = [[0 if i == j else (1 if j in neighbors[i] else 1000) for j in range(n)] for i in range(n)]
+    for k in range(n):
+        for i in range(n):
+            for j in range(n):
+                d[i][j] = min(d[i][j], d[i][k] + d[k][j])
+    return d
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_topological_distances_of_molecules(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    neighbors = molgeom.GetBonds(coordinates, at_symbols)
+    assert molgeom.GetTopologicalDistances(neighbors).tolist() == floyd_warshall(neighbors)
+
+
+def test_topological_distances_of_disconnected_graph():
+    neighbors = graph(7, [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5)])
+    distances = molgeom.GetTopologicalDistances(neighbors)
+    assert distances.tolist() == floyd_warshall(neighbors)
+    assert distances[0][2] == 2 and distances[0][4] == 1000 and distances[6][6] == 0
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_topological_distances_of_random_graph(seed):
+    # a few chains with cross links, long paths and more than one component
+    r = numpy.random.RandomState(seed)
+    bonds = [(i, i + 1) for i in range(79) if i % 30 != 29]
+    bonds += [tuple(b) for b in r.randint(80, size=(12, 2)).tolist() if b[0] != b[1]]
+    neighbors = graph(80, bonds)
+    assert molgeom.GetTopologicalDistances(neighbors).tolist() == floyd_warshall(neighbors)
+
+
+def cyclic_brute_force(neighbors, at_symbols):
+    ''' heavy atoms with a heavy neighbor still reachable once their bond is removed '''
+    heavy = [i for i in range(len(neighbors)) if at_symbols[i] != "H"]
+    cyclic = []
+    for i in heavy:
+        for j in neighbors[i]:
+            if at_symbols[j] == "H":
+                continue
+            seen, frontier = set([j]), [j]
+            while frontier:
+                k = frontier.pop()
+                for l in neighbors[k]:
+                    if at_symbols[l] != "H" and l not in seen and not (k == j and l == i):
+                        seen.add(l)
+                        frontier.append(l)
+            if i in seen:
+                cyclic.append(i)
+                break
+    return cyclic
+
+
+def ring_sizes_brute_force(neighbors, at_symbols):
+    ''' length of the shortest closed path of heavy atoms through every atom, over
+    all the simple paths leaving it (0 if none) '''
+    sizes = []
+    for i in range(len(neighbors)):
+        best = 0
+        stack = [[i]] if at_symbols[i] != "H" else []
+        while stack:
+            path = stack.pop()
+            for j in neighbors[path[-1]]:
+                if at_symbols[j] == "H":
+                    continue
+                if j == i and len(path) > 2 and (best == 0 or len(path) < best):
+                    best = len(path)
+                elif j not in path:
+                    stack.append(path + [j])
+        sizes.append(best)
+    return sizes
+
+
+RINGGRAPHS = [
+    # two fused rings with a chain and a hydrogen
+    ([(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0), (2, 6), (6, 7), (7, 3), (5, 8), (8, 9), (9, 10)],
+     ["C"] * 10 + ["H"]),
+    # two rings joined by a bridge, a separate molecule with a ring
+    ([(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 5), (5, 6), (6, 4), (7, 8), (8, 9), (9, 10), (10, 7)],
+     ["C", "N", "C", "C", "C", "O", "C", "C", "C", "C", "C"]),
+    # a "ring" closed through a hydrogen is no ring
+    ([(0, 1), (1, 2), (2, 3), (3, 0)], ["C", "C", "C", "H"]),
+]
+
+
+@pytest.mark.parametrize("bonds, at_symbols", RINGGRAPHS)
+def test_cyclic_atoms_match_brute_force(bonds, at_symbols):
+    neighbors = graph(len(at_symbols), bonds)
+    assert sorted(molgeom.GetCyclicAtoms(neighbors, at_symbols)) == cyclic_brute_force(neighbors, at_symbols)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_cyclic_atoms_of_molecules(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    neighbors = molgeom.GetBonds(coordinates, at_symbols)
+    assert sorted(molgeom.GetCyclicAtoms(neighbors, at_symbols)) == cyclic_brute_force(neighbors, at_symbols)
+
+
+@pytest.mark.parametrize("bonds, at_symbols", RINGGRAPHS)
+def test_ring_sizes_match_brute_force(bonds, at_symbols):
+    neighbors = graph(len(at_symbols), bonds)
+    topology = molgeom.Topology(numpy.zeros((len(at_symbols), 3)), at_symbols, neighbors=neighbors)
+    assert topology.ringsize.tolist() == ring_sizes_brute_force(neighbors, at_symbols)
+    assert topology.ringsize.nonzero()[0].tolist() == cyclic_brute_force(neighbors, at_symbols)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_ring_sizes_of_molecules(molecule):
+    coordinates, at_symbols = molgeom.load_structure(structure(molecule))
+    topology = molgeom.perceive_bonds(coordinates, at_symbols)
+    assert topology.ringsize.tolist() == ring_sizes_brute_force(topology.neighbors, at_symbols)
@@ -0,0 +1,235 @@
+'''
+Distances, angles and torsions measured along a trajectory against the scalar
+routines, one frame at a time, and the readers of the frames.
+'''
+
+import io
+import os
+
+import numpy
+import pytest
+
+from conftest import MOLECULES, run_molgeom, structure
+
+import molgeom
+
+NATOMS = 7
+NFRAMES = 12
+TASKS = "1 2\n3 7\n1 2 3\n4 5 6\n1 2 3 4\n2 3 4 5 180\n7 1 2 3 120\n"
+SYMBOLS = ["C", "C", "N", "O", "C", "H", "H"]
+
+
+def trajectory_frames(seed=8):
+    r = numpy.random.RandomState(seed)
+    base = r.rand(NATOMS, 3) * 4
+    return [base + r.rand(NATOMS, 3) * 0.6 for k in range(NFRAMES)]
+
+
+def write_trajectory(filename, frames, comments=None):
+    if comments is None:
+        comments = ["frame %d" % k for k in range(len(frames))]
+    with open(filename, "w") as f:
+        for comment, xyz in zip(comments, frames):
+            f.write("%d\n%s\n" % (len(xyz), comment))
+            for s, (x, y, z) in zip(SYMBOLS, xyz):
+                f.write("%s %.6f %.6f %.6f\n" % (s, x, y, z))
+
+
+@pytest.fixture
+def trajectory(tmp_path):
+    write_trajectory(str(tmp_path / "t.xyz"), trajectory_frames())
+    with open(str(tmp_path / "tasks"), "w") as f:
+        f.write(TASKS)
+    return tmp_path
+
+
+def read_measures(filename):
+    lines = open(filename).read().splitlines()
+    return lines[0], numpy.array([[float(x) for x in l.split()] for l in lines[1:]])
+
+
+def expected_measures(frames, measure):
+    ''' frame number and measures of every frame, computed on the coordinates as written '''
+    rows = []
+    for k, xyz in enumerate(frames, 1):
+        xyz = numpy.array([[float("%.6f" % x) for x in atom] for atom in xyz])
+        rows.append([k] + measure(xyz))
+    return numpy.array(rows)
+
+
+def scalar_dists(xyz):
+    return [molgeom.getdist(xyz[0], xyz[1]), molgeom.getdist(xyz[2], xyz[6])]
+
+
+def scalar_angles(xyz):
+    return [molgeom.getangle(xyz[0], xyz[1], xyz[2]), molgeom.getangle(xyz[3], xyz[4], xyz[5])]
+
+
+def scalar_torsions(xyz):
+    return [molgeom.getdih(xyz[0], xyz[1], xyz[2], xyz[3], 360), molgeom.getdih(xyz[1], xyz[2], xyz[3], xyz[4], 180),
+            molgeom.getdih(xyz[6], xyz[0], xyz[1], xyz[2], 120)]
+
+
+def test_tasks_match_scalar_routines(trajectory):
+    run_molgeom(["-f", "XYZ", "-e", "tasks", "t.xyz"], cwd=str(trajectory))
+    frames = trajectory_frames()
+    for name, measure, header in [("dists.dat", scalar_dists, "# frame 1-2 3-7"),
+                                  ("angs.dat", scalar_angles, "# frame 1-2-3 4-5-6"),
+                                  ("tors.dat", scalar_torsions, "# frame 1-2-3-4 2-3-4-5 7-1-2-3")]:
+        first, values = read_measures(str(trajectory / name))
+        assert first == header
+        # the values are written with 4 decimals
+        assert numpy.allclose(values, expected_measures(frames, measure), rtol=0, atol=6e-5)
+
+
+def test_single_distance_of_every_frame(trajectory):
+    run_molgeom(["-f", "XYZ", "-d", "3", "7", "t.xyz"], cwd=str(trajectory))
+    first, values = read_measures(str(trajectory / "distcml.dat"))
+    expected = expected_measures(trajectory_frames(), lambda xyz: [molgeom.getdist(xyz[2], xyz[6])])
+    assert numpy.allclose(values, expected, rtol=0, atol=6e-5)
+
+
+def test_periodic_distances_of_every_frame(trajectory):
+    cellparam = (3.0, 3.5, 4.0, 90.0, 90.0, 90.0)
+    run_molgeom(["-f", "XYZ", "-u"] + [str(c) for c in cellparam] + ["-d", "1", "2", "t.xyz"], cwd=str(trajectory))
+    first, values = read_measures(str(trajectory / "distcml.dat"))
+    expected = expected_measures(trajectory_frames(), lambda xyz: [molgeom.getpbcdist(xyz[0], xyz[1], cellparam)])
+    assert numpy.allclose(values, expected, rtol=0, atol=6e-5)
+
+
+@pytest.mark.parametrize("extra", [["--frames", "3:10:2"], ["--frames", "5"], ["-j", "2"], ["-j", "3", "--frames", "2::3"]])
+def test_frame_selections_and_jobs_match_the_full_run(trajectory, extra):
+    cwd = str(trajectory)
+    run_molgeom(["-f", "XYZ", "-e", "tasks", "t.xyz"], cwd=cwd)
+    full = dict([(name, open(str(trajectory / name)).read().splitlines()) for name in ["dists.dat", "angs.dat", "tors.dat"]])
+    run_molgeom(["-f", "XYZ", "-e", "tasks"] + extra + ["t.xyz"], cwd=cwd)
+    selection = extra[extra.index("--frames") + 1] if "--frames" in extra else ":"
+    numbers = molgeom.select_frames(selection, NFRAMES)
+    for name in full:
+        lines = open(str(trajectory / name)).read().splitlines()
+        assert lines == [full[name][0]] + [full[name][n + 1] for n in numbers]
+
+
+def frame_offsets(filename):
+    starts = [0]
+    for line in open(filename):
+        starts.append(starts[-1] + len(line))
+    return starts[:-1:NATOMS + 2]
+
+
+def rewrite_keeping_size(filename, comments, keep_mtime):
+    ''' the trajectory again with other comments of the same total length '''
+    stat = os.stat(filename)
+    write_trajectory(filename, trajectory_frames(), comments)
+    assert os.path.getsize(filename) == stat.st_size
+    if keep_mtime:
+        os.utime(filename, (stat.st_atime, stat.st_mtime))
+    else:
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+
+
+def test_frame_index_matches_the_file(trajectory):
+    filename = str(trajectory / "t.xyz")
+    offsets, natoms = molgeom.build_frame_index(filename, "XYZ")
+    assert offsets.tolist() == frame_offsets(filename)
+    assert natoms.tolist() == [NATOMS] * NFRAMES
+    # the index of an unchanged trajectory is not written again
+    os.utime(filename + ".frames.npz", (1000, 1000))
+    assert molgeom.build_frame_index(filename, "XYZ")[0].tolist() == offsets.tolist()
+    assert os.path.getmtime(filename + ".frames.npz") == 1000
+
+
+@pytest.mark.parametrize("first,keep_mtime", [(0, True), (3, False)])
+def test_frame_index_of_a_rewritten_trajectory_is_rebuilt(trajectory, first, keep_mtime):
+    filename = str(trajectory / "t.xyz")
+    comments = ["frame %d" % k for k in range(NFRAMES)]
+    write_trajectory(filename, trajectory_frames(), comments)
+    molgeom.build_frame_index(filename, "XYZ")
+    # same size, but the frames after the first one changed start elsewhere: with the
+    # same modification time the header of the first frame differs, otherwise only the time
+    comments[first] += "xx"
+    comments[first + 1] = comments[first + 1][:-2]
+    rewrite_keeping_size(filename, comments, keep_mtime)
+    offsets, natoms = molgeom.build_frame_index(filename, "XYZ")
+    assert offsets.tolist() == frame_offsets(filename)
+
+
+def test_frame_index_without_time_is_rebuilt(trajectory):
+    filename = str(trajectory / "t.xyz")
+    numpy.savez(filename + ".frames.npz", offsets=numpy.arange(NFRAMES), natoms=numpy.ones(NFRAMES),
+                size=os.path.getsize(filename))
+    assert molgeom.build_frame_index(filename, "XYZ")[0].tolist() == frame_offsets(filename)
+
+
+def read_xyz_lines(text):
+    ''' coordinates and symbols of the first frame of an xyz text, line by line '''
+    lines = text.splitlines()[2:2 + int(text.split()[0])]
+    coordinates = numpy.zeros((len(lines), 4))
+    for n, line in enumerate(lines):
+        fields = line.split()
+        coordinates[n, :len(fields[1:5])] = [float(x) for x in fields[1:5]]
+    return coordinates, [line.split()[0] for line in lines]
+
+
+def xyz_text(widths, seed=9):
+    ''' a frame with atom lines of the given numbers of fields (the 6th one an atom type) '''
+    r = numpy.random.RandomState(seed)
+    text = "%d\ncomment\n" % len(widths)
+    for n, width in enumerate(widths):
+        fields = [SYMBOLS[n % NATOMS]] + ["%.6f" % x for x in r.rand(4) * 5 - 1] + ["%d" % (n + 1)]
+        text += " ".join(fields[:width]) + "\n"
+    return text
+
+
+@pytest.fixture(params=[True, False], ids=["loadtxt", "split"])
+def blockloadtxt(request, monkeypatch):
+    ''' the frames parsed by numpy.loadtxt, or split in python as with numpy before 1.23 '''
+    if request.param and not molgeom.BLOCKLOADTXT:
+        pytest.skip("numpy.loadtxt parses in python here")
+    monkeypatch.setattr(molgeom, "BLOCKLOADTXT", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("widths", [[5] * 6, [4] * 6, [4, 6] * 3, [6, 4] * 3, [4, 5, 6] * 2, [5, 5, 4, 6], [6] * 4, [5, 4],
+                                    [5, 6] * 3])
+def test_read_xyz_matches_line_by_line_parsing(blockloadtxt, widths):
+    text = xyz_text(widths)
+    coordinates, offset, at_symbols = molgeom.read_xyz(io.StringIO(text))
+    expected, symbols = read_xyz_lines(text)
+    assert at_symbols == symbols
+    assert (coordinates == expected).all()
+    assert offset == len(text)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_read_xyz_of_the_molecules(blockloadtxt, molecule):
+    text = open(structure(molecule)).read()
+    coordinates, offset, at_symbols = molgeom.read_xyz(io.StringIO(text))
+    expected, symbols = read_xyz_lines(text)
+    assert at_symbols == symbols
+    assert (coordinates == expected).all()
+
+
+ARCFRAME = '''     5  methanol frame
+     1  C      0.000000    0.000000    0.000000     1     2     3     4
+     2  O      1.410000    0.000000    0.000000     6     1     5
+     3  H     -0.360000    1.020000    0.000000     5     1
+     4  H     -0.360000   -0.510000    0.880000     5     1
+     5  H      1.730000    0.900000    0.000000    21     2
+'''
+
+
+def test_read_arc_of_lines_of_different_widths(blockloadtxt):
+    text = ARCFRAME + ARCFRAME.replace("0.000000 ", "0.500000 ")
+    stream = io.StringIO(text)
+    coordinates, offset, at_symbols, at_types, at_connectivity = molgeom.read_arc(stream)
+    rows = [line.split() for line in ARCFRAME.splitlines()[1:]]
+    assert at_symbols == [r[1] for r in rows]
+    assert coordinates.tolist() == [[float(x) for x in r[2:5]] for r in rows]
+    assert at_types.tolist() == [float(r[5]) for r in rows]
+    assert at_connectivity.tolist() == [[float(x) for x in r[6:]] + [0.0] * (11 - len(r)) for r in rows]
+    assert offset == len(ARCFRAME)
+    second, end = molgeom.read_arc(stream, offset)
+    assert second.tolist() == [[float(x.replace("0.000000", "0.500000")) for x in r[2:5]] for r in rows]
+    assert end == len(text)
+    assert molgeom.read_arc(stream, end) == "EOF"